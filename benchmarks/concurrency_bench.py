@@ -0,0 +1,151 @@
+"""
+Queueing delay of updates under mixed load, no database needed.
+
+    python -m benchmarks.concurrency_bench --curators 200 --rate 0.15 --seconds 20 --concurrency 32
+
+Runs the same workload through an Application three times, with only the update processing
+changed:
+
+- sequential: the old default, one update at a time.
+- concurrent: PTB's plain concurrent_updates(N), no ordering between updates of one chat.
+- per-chat:   core.update_processor.PerChatUpdateProcessor(N), as main.py now builds it.
+
+Curators press buttons (fast handlers, --fast ms) at --rate presses per second each, and
+with probability --double-tap press twice. The admin sends /stats every --slow-every seconds
+(slow handler, --slow ms). Handlers only await (like DB calls in the executor and Bot API
+requests), so concurrency helps as long as the real handlers are I/O bound.
+
+Queueing delay is the time from putting an update into Application.update_queue to its handler
+starting. "overlaps" counts updates whose handler started while an earlier update of the same
+chat was still running; "reordered" counts updates that started before an earlier one of their chat.
+"""
+import time
+import random
+import asyncio
+import argparse
+import statistics
+from collections import defaultdict
+from telegram import Update
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler
+from benchmarks.fakes import FakeRequest, command_update, callback_update
+from core.update_processor import PerChatUpdateProcessor
+
+ADMIN_TG = 1_000
+CURATOR_TG = 10_000  # + curator index
+
+class Probe:
+    def __init__(self):
+        self.enqueued = {}  # update_id -> perf_counter at enqueue
+        self.delays = defaultdict(list)
+        self.running = defaultdict(int)  # chat -> handlers in flight
+        self.last_started = {}  # chat -> update_id of the last started handler
+        self.overlaps = 0
+        self.reordered = 0
+
+    def started(self, label, update):
+        chat = update.effective_chat.id
+        self.delays[label].append(time.perf_counter() - self.enqueued[update.update_id])
+        if self.running[chat]:
+            self.overlaps += 1
+        if self.last_started.get(chat, -1) > update.update_id:
+            self.reordered += 1
+        self.last_started[chat] = max(update.update_id, self.last_started.get(chat, -1))
+        self.running[chat] += 1
+
+    def finished(self, update):
+        self.running[update.effective_chat.id] -= 1
+
+def handlers(probe, args):
+    async def fast(update, context):
+        probe.started("button", update)
+        try:
+            await update.callback_query.answer()
+            await asyncio.sleep(random.uniform(0.5, 1.5) * args.fast / 1000)
+        finally:
+            probe.finished(update)
+
+    async def slow(update, context):
+        probe.started("/stats", update)
+        try:
+            await asyncio.sleep(random.uniform(0.8, 1.2) * args.slow / 1000)
+        finally:
+            probe.finished(update)
+
+    return [CallbackQueryHandler(fast), CommandHandler("stats", slow)]
+
+def workload(args, seed):
+    """[(at_seconds, raw_update)] for the whole run, sorted by time."""
+    rng = random.Random(seed)
+    events = []
+    for i in range(args.curators):
+        t = rng.expovariate(args.rate)
+        while t < args.seconds:
+            events.append((t, CURATOR_TG + i, f"take:{rng.randint(1, 18)}"))
+            if rng.random() < args.double_tap:
+                events.append((t + 0.01, CURATOR_TG + i, f"take:{rng.randint(1, 18)}"))
+            t += rng.expovariate(args.rate)
+    t = 0.0
+    while t < args.seconds:
+        events.append((t, ADMIN_TG, "/stats"))
+        t += args.slow_every
+    events.sort(key=lambda e: e[0])
+    # Build the updates in time order, so update ids grow with arrival
+    return [(at, command_update(tg, data) if data.startswith("/") else callback_update(tg, data))
+            for at, tg, data in events]
+
+async def run_policy(name, concurrent_updates, args):
+    probe = Probe()
+    app = (Application.builder().token("1:BENCH").request(FakeRequest()).get_updates_request(FakeRequest())
+           .updater(None).concurrent_updates(concurrent_updates).build())
+    for handler in handlers(probe, args):
+        app.add_handler(handler)
+    async with app:
+        await app.start()
+        started = time.perf_counter()
+        for at, data in workload(args, args.seed):
+            delay = started + at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            update = Update.de_json(data, app.bot)
+            probe.enqueued[update.update_id] = time.perf_counter()
+            await app.update_queue.put(update)
+        await app.update_queue.join()
+        # Also waits for updates still parked behind their chat
+        await app.stop()
+        elapsed = time.perf_counter() - started
+    report(name, probe, elapsed)
+
+def _percentile(sorted_ms, q):
+    return sorted_ms[min(len(sorted_ms) - 1, int(len(sorted_ms) * q))]
+
+def report(name, probe, elapsed):
+    print(f"\n== {name}: finished in {elapsed:.1f}s, overlaps={probe.overlaps}, reordered={probe.reordered}")
+    print(f"{'update':<10}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for label, values in sorted(probe.delays.items()):
+        ms = sorted(v * 1000 for v in values)
+        print(f"{label:<10}{len(ms):>8}{statistics.median(ms):>10.1f}{_percentile(ms, 0.95):>10.1f}"
+              f"{_percentile(ms, 0.99):>10.1f}{ms[-1]:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--curators", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=0.15, help="button presses per second per curator")
+    parser.add_argument("--double-tap", type=float, default=0.1, help="probability that a press is doubled")
+    parser.add_argument("--fast", type=float, default=20.0, help="button handler time, ms")
+    parser.add_argument("--slow", type=float, default=500.0, help="/stats handler time, ms")
+    parser.add_argument("--slow-every", type=float, default=2.0, help="seconds between /stats")
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    policies = [
+        ("sequential", False),
+        ("concurrent", args.concurrency),
+        ("per-chat", PerChatUpdateProcessor(args.concurrency)),
+    ]
+    for name, concurrent_updates in policies:
+        asyncio.run(run_policy(name, concurrent_updates, args))
+
+if __name__ == "__main__":
+    main()
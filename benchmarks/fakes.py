@@ -0,0 +1,91 @@
+"""
+Offline stand-ins for the Telegram side of the benchmarks: a Bot API transport that answers
+locally and builders for raw command / callback updates.
+"""
+import json
+import time
+import asyncio
+import itertools
+from collections import defaultdict
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+class FakeRequest(BaseRequest):
+    """Bot API transport that answers every call locally with a plausible result."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = defaultdict(int)
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        if api_method == "getMe":
+            result = BOT_USER
+        elif api_method in ("sendMessage", "editMessageText"):
+            chat_id = params.get("chat_id", 0)
+            result = {
+                "message_id": params.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+_update_ids = itertools.count(1)
+
+def _user(tg_id):
+    return {"id": tg_id, "is_bot": False, "first_name": f"User{tg_id}"}
+
+def command_update(tg_id, text):
+    update_id = next(_update_ids)
+    command = text.split(" ", 1)[0]
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": tg_id, "type": "private"},
+            "from": _user(tg_id),
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        },
+    }
+
+def callback_update(tg_id, data):
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(tg_id),
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": tg_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "bench",
+            },
+        },
+    }
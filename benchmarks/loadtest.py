@@ -0,0 +1,172 @@
+"""
+Synthetic load test for the bot handlers.
+
+Builds the real Application (main.register_handlers) with a fake Bot API transport,
+so nothing is sent to Telegram, and feeds it synthetic updates against the Postgres
+configured in .env, inside a throwaway schema (bench_loadtest):
+
+    python -m benchmarks.loadtest --users 100 --stations 18 --concurrency 50 --seconds 30
+
+1. Registration: every virtual curator sends /reg_user 1XX (so at most 100 curators).
+2. Event day: --concurrency virtual users run journeys for --seconds:
+   /free -> take:<N> button -> the organizer of N sends /reward and presses "Station free";
+   with probability --stats-ratio the admin sends /stats instead.
+
+Latency is measured around Application.process_update, per command / callback.
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+import statistics
+from collections import defaultdict
+
+SCHEMA = "bench_loadtest"
+# libpq reads PGOPTIONS, so every pooled connection uses the bench schema
+os.environ["PGOPTIONS"] = f"-c search_path={SCHEMA}"
+# Measure the handlers, not core.throttle (virtual users press much faster than people)
+os.environ.setdefault("THROTTLE_USER_LIMITS", "")
+os.environ.setdefault("THROTTLE_ROLE_LIMITS", "")
+
+import psycopg2
+from telegram import Update
+from telegram.ext import Application
+from core.config import DB_CONFIG
+from core import database, async_db
+from core.database import db_cursor, set_setting, register_organizer
+from core.state import state
+from main import register_handlers
+from benchmarks.fakes import FakeRequest, command_update, callback_update
+
+ADMIN_TG = 1_000
+ORGANIZER_TG = 2_000  # + station number
+CURATOR_TG = 10_000  # + curator index
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.handler_errors = 0
+
+    async def send(self, app, label, data):
+        update = Update.de_json(data, app.bot)
+        started = time.perf_counter()
+        # Handler exceptions do not propagate, process_update passes them to on_error
+        await app.process_update(update)
+        self.latencies[label].append(time.perf_counter() - started)
+
+async def on_error(update, context):
+    context.application.bot_data["recorder"].handler_errors += 1
+
+def setup(stations):
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+        cur.execute(f"CREATE SCHEMA {SCHEMA};")
+    conn.close()
+    database.init_db()
+    with db_cursor() as cur:
+        cur.execute("DELETE FROM stations;")
+        for n in range(1, stations + 1):
+            cur.execute("INSERT INTO stations (number, name, location) VALUES (%s, %s, 'bench');", (n, f"Station {n}"))
+        cur.execute("INSERT INTO users (tg_id, role) VALUES (%s, 'admin');", (ADMIN_TG,))
+    database.load_settings()
+    set_setting("org_registration_open", "true")
+    for n in range(1, stations + 1):
+        register_organizer(ORGANIZER_TG + n, n)
+    set_setting("quest_started", "true")
+    set_setting("quest_ended", "false")
+    database.rebuild_leaderboard()
+    state.load()
+
+def teardown():
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+    conn.close()
+
+async def run_registration(app, rec, users, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def register(i):
+        async with sem:
+            await rec.send(app, "/reg_user", command_update(CURATOR_TG + i, f"/reg_user {100 + i}"))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(register(i) for i in range(users)))
+    return time.perf_counter() - started
+
+async def run_event(app, rec, users, stations, concurrency, seconds, stats_ratio):
+    deadline = time.monotonic() + seconds
+
+    async def virtual_user():
+        while time.monotonic() < deadline:
+            if random.random() < stats_ratio:
+                await rec.send(app, "/stats", command_update(ADMIN_TG, "/stats"))
+                continue
+            curator = CURATOR_TG + random.randrange(users)
+            number = random.randint(1, stations)
+            organizer = ORGANIZER_TG + number
+            await rec.send(app, "/free", command_update(curator, "/free"))
+            await rec.send(app, "take:", callback_update(curator, f"take:{number}"))
+            await rec.send(app, "/reward", command_update(organizer, f"/reward {random.randint(1, 10)}"))
+            await rec.send(app, "free_station:", callback_update(organizer, f"free_station:{number}"))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user() for _ in range(concurrency)))
+    return time.perf_counter() - started
+
+def _percentile(sorted_ms, q):
+    return sorted_ms[min(len(sorted_ms) - 1, int(len(sorted_ms) * q))]
+
+def report(title, rec, elapsed):
+    total = sum(len(v) for v in rec.latencies.values())
+    print(f"\n== {title}: {total} updates in {elapsed:.1f}s, {total / elapsed:.1f} updates/s")
+    print(f"{'command':<16}{'count':>8}{'per s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for label, values in sorted(rec.latencies.items()):
+        ms = sorted(v * 1000 for v in values)
+        print(f"{label:<16}{len(ms):>8}{len(ms) / elapsed:>9.1f}{statistics.median(ms):>9.2f}"
+              f"{_percentile(ms, 0.95):>9.2f}{_percentile(ms, 0.99):>9.2f}")
+    if rec.handler_errors:
+        print(f"handler exceptions: {rec.handler_errors}")
+
+async def run(args):
+    transport = FakeRequest(latency=args.api_latency / 1000)
+    app = (Application.builder().token("1:BENCH").request(transport)
+           .get_updates_request(FakeRequest()).updater(None).build())
+    register_handlers(app)
+    app.add_error_handler(on_error)
+    async with app:
+        rec = app.bot_data["recorder"] = Recorder()
+        elapsed = await run_registration(app, rec, args.users, args.concurrency)
+        report("registration", rec, elapsed)
+
+        rec = app.bot_data["recorder"] = Recorder()
+        elapsed = await run_event(app, rec, args.users, args.stations, args.concurrency, args.seconds, args.stats_ratio)
+        report("event day", rec, elapsed)
+    print(f"\nBot API calls: {dict(transport.calls)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100, help="virtual curators (max 100, group numbers are 1XX)")
+    parser.add_argument("--stations", type=int, default=18)
+    parser.add_argument("--concurrency", type=int, default=20, help="updates in flight at once")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--stats-ratio", type=float, default=0.05)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Bot API latency, ms")
+    parser.add_argument("--keep", action="store_true", help="do not drop the bench schema afterwards")
+    args = parser.parse_args()
+    args.users = max(1, min(args.users, 100))
+
+    setup(args.stations)
+    try:
+        asyncio.run(run(args))
+    finally:
+        async_db.shutdown()
+        if not args.keep:
+            teardown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Discrete-event simulation of station assignment.
+
+    python -m benchmarks.scheduler_sim --groups 60 --stations 18 --visit 8 --travel 2 --duration 180
+    python -m benchmarks.scheduler_sim --db
+
+Compares two policies on the same random workload:
+
+- race:     the old flow. A group that is done looks at /free, takes a random free station it has
+            not visited, and if there is none it retries after about --poll minutes.
+- waitlist: the /next + release flow of core.database. A group that is done takes a free unvisited
+            station, otherwise it queues for every station it still needs. A released station goes
+            at once to the longest-waiting group that has not visited it.
+
+Without --db no database is needed, and the waitlist policy is only a model of that flow (see
+ModelScheduler): it shows what the policy does, not that core.database implements it. With --db
+the waitlist policy calls the real take_next_station, reward_current_group_by_organizer and
+release_station_by_number in a throwaway schema (bench_scheduler_sim) of the Postgres
+configured in .env, so the numbers come from the code that runs at the event.
+
+A station counts as idle while nobody works at it, including when it is reserved for a group
+that is still walking there. Times are in minutes.
+"""
+import os
+import heapq
+import random
+import argparse
+import itertools
+import statistics
+
+class Waitlists:
+    """
+    One heap per station of (enqueued_at, seq, group). A group waits in the heaps of all stations it
+    still needs; an assignment bumps its ticket, which marks its other entries stale (lazy deletion).
+    """
+
+    def __init__(self, stations):
+        self.heaps = {s: [] for s in stations}
+        self.ticket = {}
+        self._seq = itertools.count()
+
+    def join(self, group, stations, now):
+        ticket = self.ticket[group] = next(self._seq)
+        for s in stations:
+            heapq.heappush(self.heaps[s], (now, ticket, group))
+
+    def pop(self, station):
+        heap = self.heaps[station]
+        while heap:
+            _, ticket, group = heapq.heappop(heap)
+            if self.ticket.get(group) == ticket:
+                del self.ticket[group]
+                return group
+        return None
+
+    def __len__(self):
+        return len(self.ticket)
+
+class ModelScheduler:
+    """The waitlist flow as modelled here, on top of Waitlists."""
+
+    def __init__(self, station_ids, todo, rng):
+        self.free = set(station_ids)
+        self.todo = todo
+        self.rng = rng
+        self.waitlists = Waitlists(station_ids)
+
+    def take_next(self, now, group):
+        """/next: the claimed station, or None if the group now waits."""
+        options = [s for s in self.free if s in self.todo[group]]
+        if options:
+            station = self.rng.choice(options)
+            self.free.discard(station)
+            return station
+        self.waitlists.join(group, self.todo[group], now)
+        return None
+
+    def release(self, now, group, station):
+        """The group leaves; returns the [(group, station)] assignments the release made."""
+        nxt = self.waitlists.pop(station)
+        if nxt is None:
+            self.free.add(station)
+            return []
+        return [(nxt, station)]
+
+    def close(self):
+        pass
+
+SCHEMA = "bench_scheduler_sim"
+CURATOR_TG = 10_000  # + group
+ORGANIZER_TG = 20_000  # + station number
+GROUP_NUMBER = 100_000  # + group
+
+class DbScheduler:
+    """The waitlist flow of core.database, run against a throwaway schema."""
+
+    def __init__(self, groups, stations, keep=False):
+        # Imported here so the model needs no database or .env. libpq reads PGOPTIONS, so every
+        # pooled connection uses the bench schema; a remembered release or reward (core.idempotency)
+        # would answer from memory instead of running the flow being measured.
+        os.environ["PGOPTIONS"] = f"-c search_path={SCHEMA}"
+        os.environ["IDEMPOTENCY_TTL"] = "0"
+        import psycopg2
+        from core.config import DB_CONFIG
+        from core import database
+        self.db, self.connect, self.keep = database, lambda: psycopg2.connect(**DB_CONFIG), keep
+        self._drop_schema(create=True)
+        database.init_db()
+        with database.db_cursor() as cur:
+            cur.execute("DELETE FROM stations;")
+            for n in range(1, stations + 1):
+                cur.execute("INSERT INTO stations (number, name, location) VALUES (%s, %s, 'bench');", (n, f"Station {n}"))
+        database.set_setting("org_registration_open", "true")
+        for n in range(1, stations + 1):
+            database.register_organizer(ORGANIZER_TG + n, n)
+        for g in range(groups):
+            database.register_curator(CURATOR_TG + g, str(GROUP_NUMBER + g))
+        database.set_setting("quest_started", "true")
+        database.set_setting("quest_ended", "false")
+        database.load_settings()
+
+    def _drop_schema(self, create=False):
+        conn = self.connect()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+            if create:
+                cur.execute(f"CREATE SCHEMA {SCHEMA};")
+        conn.close()
+
+    def take_next(self, now, group):
+        res = self.db.take_next_station(CURATOR_TG + group)
+        if not res["ok"]:
+            raise RuntimeError(res["error"])
+        return res["assigned"]["number"] if res.get("assigned") else None
+
+    def release(self, now, group, station):
+        # The organizer's /reward marks the station visited, which keeps the group off it from now on
+        res = self.db.reward_current_group_by_organizer(ORGANIZER_TG + station, 1)
+        if not res["ok"]:
+            raise RuntimeError(res["error"])
+        res = self.db.release_station_by_number(station)
+        return [(int(a["group_number"]) - GROUP_NUMBER, a["number"]) for a in res["assigned"]]
+
+    def close(self):
+        if not self.keep:
+            self._drop_schema()
+
+def simulate(policy, groups, stations, visit, travel, duration, poll, seed, scheduler=None):
+    """Run one policy; the waitlist policy asks `scheduler` (a ModelScheduler unless given)."""
+    rng = random.Random(seed)
+    station_ids = list(range(1, stations + 1))
+    todo = {g: set(station_ids) for g in range(groups)}
+    free = set(station_ids)
+    busy_time = {s: 0.0 for s in station_ids}
+    waiting_since = {}
+    group_wait = []
+    visits = 0
+    if scheduler is None:
+        scheduler = ModelScheduler(station_ids, todo, rng)
+    events = []  # (time, seq, kind, group, station)
+    seq = itertools.count()
+
+    def at(t, kind, group, station=None):
+        heapq.heappush(events, (t, next(seq), kind, group, station))
+
+    def assign(now, group, station):
+        free.discard(station)
+        todo[group].discard(station)
+        group_wait.append(now - waiting_since.pop(group))
+        at(now + travel, "arrive", group, station)
+
+    def look_for_station(now, group):
+        waiting_since.setdefault(group, now)
+        if policy == "waitlist":
+            station = scheduler.take_next(now, group)
+            if station is not None:
+                assign(now, group, station)
+            return
+        options = [s for s in free if s in todo[group]]
+        if options:
+            assign(now, group, rng.choice(options))
+        else:
+            at(now + rng.uniform(0.5, 1.5) * poll, "poll", group)
+
+    for g in range(groups):
+        at(rng.uniform(0, 2), "poll", g)  # everyone reacts to /begin within a couple of minutes
+
+    while events:
+        now, _, kind, group, station = heapq.heappop(events)
+        if now > duration:
+            break
+        if kind == "poll":
+            if todo[group]:
+                look_for_station(now, group)
+        elif kind == "arrive":
+            work = rng.uniform(0.5, 1.5) * visit
+            busy_time[station] += min(work, duration - now)
+            at(now + work, "leave", group, station)
+        elif kind == "leave":
+            visits += 1
+            free.add(station)
+            if policy == "waitlist":
+                for nxt, st in scheduler.release(now, group, station):
+                    assign(now, nxt, st)
+            if todo[group]:
+                look_for_station(now, group)
+
+    idle = {s: duration - busy_time[s] for s in station_ids}
+    return {
+        "visits": visits,
+        "idle": idle,
+        "group_wait": group_wait,
+        "finished": sum(1 for g in todo if not todo[g]),
+    }
+
+def report(policy, res, duration):
+    idle = res["idle"]
+    waits = sorted(res["group_wait"]) or [0.0]
+    print(f"\n== {policy}")
+    print(f"completed visits: {res['visits']}, groups that visited every station: {res['finished']}")
+    print(f"station idle, min: mean={statistics.mean(idle.values()):.1f} max={max(idle.values()):.1f} "
+          f"utilization={1 - sum(idle.values()) / (duration * len(idle)):.1%}")
+    print(f"group wait for a station, min: p50={statistics.median(waits):.1f} p95={waits[int(len(waits) * 0.95) - 1] if len(waits) > 1 else waits[0]:.1f}")
+    print("idle per station: " + ", ".join(f"{s}:{v:.0f}" for s, v in sorted(idle.items())))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", type=int, default=60)
+    parser.add_argument("--stations", type=int, default=18)
+    parser.add_argument("--visit", type=float, default=8.0, help="mean minutes at a station")
+    parser.add_argument("--travel", type=float, default=2.0, help="minutes to walk to a station")
+    parser.add_argument("--duration", type=float, default=180.0, help="event length, minutes")
+    parser.add_argument("--poll", type=float, default=3.0, help="race policy: minutes between /free retries")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", action="store_true", help="run the waitlist policy through core.database")
+    parser.add_argument("--keep", action="store_true", help="--db: do not drop the bench schema afterwards")
+    args = parser.parse_args()
+
+    for policy in ("race", "waitlist"):
+        scheduler = DbScheduler(args.groups, args.stations, args.keep) if args.db and policy == "waitlist" else None
+        try:
+            res = simulate(policy, args.groups, args.stations, args.visit, args.travel, args.duration, args.poll, args.seed, scheduler)
+        finally:
+            if scheduler is not None:
+                scheduler.close()
+        report(policy + (" (core.database)" if scheduler is not None else ""), res, args.duration)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Concurrency benchmark for take_station.
+
+Runs against the Postgres configured in .env, inside a throwaway schema
+(bench_take_station) so real quest data is not touched:
+
+    python -m benchmarks.take_station_bench --claimers 50 --rounds 200 --seconds 10
+
+1. Contention: every round all claimers hit the same free station at once.
+   Exactly one winner per round is expected.
+2. Throughput: claimers take and release random stations for --seconds.
+
+Both phases run for the current single-statement claim and for the previous
+SELECT-then-UPDATE flow (kept here as `legacy_take_station` for comparison).
+"""
+import os
+import time
+import random
+import argparse
+import threading
+import statistics
+
+SCHEMA = "bench_take_station"
+# libpq reads PGOPTIONS, so every pooled connection uses the bench schema
+os.environ["PGOPTIONS"] = f"-c search_path={SCHEMA}"
+# The legacy flow holds two connections per claimer; keep --claimers below half of this
+os.environ.setdefault("DB_POOL_MAX", "200")
+# Every round releases and claims the same station again: a remembered release or take
+# (core.idempotency) would answer from memory instead of running the flow being measured
+os.environ["IDEMPOTENCY_TTL"] = "0"
+
+import psycopg2
+from core.config import DB_CONFIG
+from core import database
+from core.database import db_cursor, take_station, release_station_by_number, register_curator, set_setting
+
+def legacy_take_station(group_tg_id: int, station_number: int):
+    """The pre-optimization flow: 5 round trips, check-then-act without locking."""
+    with db_cursor() as cur:
+        cur.execute("SELECT id, group_id FROM users WHERE tg_id=%s AND role='curator';", (group_tg_id,))
+        u = cur.fetchone()
+        if not u:
+            return {"ok": False, "error": "You are not registered as a curator."}
+        for key in ("quest_started", "quest_ended"):
+            with db_cursor() as cur2:
+                cur2.execute("SELECT value FROM settings WHERE key=%s;", (key,))
+                cur2.fetchone()
+        cur.execute("SELECT id, is_free FROM stations WHERE number=%s;", (station_number,))
+        st = cur.fetchone()
+        if not st:
+            return {"ok": False, "error": "Station not found."}
+        if not st["is_free"]:
+            return {"ok": False, "error": "Station is already occupied."}
+        cur.execute("UPDATE stations SET is_free=FALSE, current_group=%s WHERE id=%s;", (u["group_id"], st["id"]))
+    return {"ok": True, "station_id": st["id"]}
+
+def setup(claimers, stations):
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+        cur.execute(f"CREATE SCHEMA {SCHEMA};")
+    conn.close()
+    database.init_db()
+    with db_cursor() as cur:
+        cur.execute("DELETE FROM stations;")
+        for n in range(1, stations + 1):
+            cur.execute("INSERT INTO stations (number, name, location) VALUES (%s, %s, 'bench');", (n, f"Station {n}"))
+    for i in range(claimers):
+        register_curator(10_000 + i, str(100_000 + i))
+    set_setting("quest_started", "true")
+    set_setting("quest_ended", "false")
+    database.load_settings()
+
+def teardown():
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+    conn.close()
+
+def run_contention(claim, claimers, rounds):
+    """Return the list of winner counts per round."""
+    winners_per_round = []
+    for _ in range(rounds):
+        release_station_by_number(1)
+        barrier = threading.Barrier(claimers)
+        wins = []
+
+        def attempt(tg_id):
+            barrier.wait()
+            if claim(tg_id, 1)["ok"]:
+                wins.append(tg_id)
+
+        threads = [threading.Thread(target=attempt, args=(10_000 + i,)) for i in range(claimers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        winners_per_round.append(len(wins))
+    return winners_per_round
+
+def run_throughput(claim, claimers, stations, seconds):
+    with db_cursor() as cur:
+        cur.execute("UPDATE stations SET is_free=TRUE, current_group=NULL;")
+    deadline = time.monotonic() + seconds
+    latencies = []
+    claimed = []
+    lock = threading.Lock()
+
+    def loop(tg_id):
+        own_lat, own_claims = [], 0
+        while time.monotonic() < deadline:
+            number = random.randint(1, stations)
+            t0 = time.perf_counter()
+            res = claim(tg_id, number)
+            own_lat.append(time.perf_counter() - t0)
+            if res["ok"]:
+                own_claims += 1
+                release_station_by_number(number)
+        with lock:
+            latencies.extend(own_lat)
+            claimed.append(own_claims)
+
+    threads = [threading.Thread(target=loop, args=(10_000 + i,)) for i in range(claimers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return len(latencies), sum(claimed), latencies
+
+def report(name, winners, attempts, claims, latencies, seconds):
+    multi = sum(1 for w in winners if w > 1)
+    none = sum(1 for w in winners if w == 0)
+    lat_ms = sorted(x * 1000 for x in latencies) or [0.0]
+    p95 = lat_ms[int(len(lat_ms) * 0.95) - 1] if len(lat_ms) > 1 else lat_ms[0]
+    print(f"\n== {name}")
+    print(f"contention rounds: {len(winners)}, rounds with >1 winner: {multi}, without a winner: {none}, max winners: {max(winners)}")
+    print(f"attempts/s: {attempts / seconds:.1f}, successful claims/s: {claims / seconds:.1f}")
+    print(f"claim latency ms: p50={statistics.median(lat_ms):.2f} p95={p95:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--claimers", type=int, default=20)
+    parser.add_argument("--stations", type=int, default=18)
+    parser.add_argument("--rounds", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--keep", action="store_true", help="do not drop the bench schema afterwards")
+    args = parser.parse_args()
+
+    setup(args.claimers, args.stations)
+    try:
+        for name, claim in (("legacy SELECT + UPDATE", legacy_take_station), ("single-statement claim", take_station)):
+            winners = run_contention(claim, args.claimers, args.rounds)
+            attempts, claims, latencies = run_throughput(claim, args.claimers, args.stations, args.seconds)
+            report(name, winners, attempts, claims, latencies, args.seconds)
+    finally:
+        if not args.keep:
+            teardown()
+
+if __name__ == "__main__":
+    main()
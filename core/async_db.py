@@ -0,0 +1,113 @@
+"""
+Async facade over core.database for use inside handlers.
+
+Each helper runs the synchronous psycopg2 function on a dedicated thread pool,
+so a slow query only suspends the awaiting handler instead of the whole event loop.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from core import database, exporter
+from core.config import DB_POOL_MAX
+
+# One thread per pooled connection: more threads would only queue on the pool
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix="db")
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking DB callable in the DB executor, preserving context variables."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, partial(ctx.run, func, *args, **kwargs))
+
+def _async(func):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    return wrapper
+
+def shutdown():
+    _executor.shutdown(wait=True)
+
+# --- Settings ---
+set_setting = _async(database.set_setting)
+get_setting = _async(database.get_setting)
+
+# --- Events ---
+create_event = _async(database.create_event)
+get_event_by_code = _async(database.get_event_by_code)
+get_event_by_id = _async(database.get_event_by_id)
+list_events = _async(database.list_events)
+switch_event = _async(database.switch_event)
+
+# --- User / group helpers ---
+get_user_by_tg = _async(database.get_user_by_tg)
+get_user_identity = _async(database.get_user_identity)
+get_user_role = _async(database.get_user_role)
+get_user_event = _async(database.get_user_event)
+get_group_by_number = _async(database.get_group_by_number)
+get_group_by_id = _async(database.get_group_by_id)
+register_curator = _async(database.register_curator)
+register_organizer = _async(database.register_organizer)
+
+# --- Stations ---
+get_free_stations_with_location = _async(database.get_free_stations_with_location)
+
+async def get_free_stations_snapshot(event_id: int = database.DEFAULT_EVENT_ID):
+    # A valid cached list is returned without the executor hop
+    cached = database.peek_free_stations(event_id)
+    if cached is not None:
+        return cached
+    return await run_db(database.get_free_stations_snapshot, event_id)
+
+get_station_by_number = _async(database.get_station_by_number)
+get_station_by_id = _async(database.get_station_by_id)
+take_station = _async(database.take_station)
+release_station_by_number = _async(database.release_station_by_number)
+
+# --- Waitlists ---
+take_next_station = _async(database.take_next_station)
+join_waitlist = _async(database.join_waitlist)
+leave_waitlist = _async(database.leave_waitlist)
+
+# --- Rewards / scoring ---
+reward_current_group_by_organizer = _async(database.reward_current_group_by_organizer)
+manual_pay_group = _async(database.manual_pay_group)
+
+# --- Ledger / checkpoints ---
+create_score_checkpoint = _async(database.create_score_checkpoint)
+reconcile_scores = _async(database.reconcile_scores)
+get_leaderboard_at = _async(database.get_leaderboard_at)
+
+# --- Queries / stats / history ---
+get_group_score_and_history_by_tg = _async(database.get_group_score_and_history_by_tg)
+get_group_score_and_history = _async(database.get_group_score_and_history)
+get_all_groups_stats = _async(database.get_all_groups_stats)
+get_all_registered_user_tgids = _async(database.get_all_registered_user_tgids)
+get_curator_tg_by_group_id = _async(database.get_curator_tg_by_group_id)
+get_organizer_station_by_tg = _async(database.get_organizer_station_by_tg)
+get_organizer_tg_by_station_id = _async(database.get_organizer_tg_by_station_id)
+set_free_station_alerts = _async(database.set_free_station_alerts)
+get_free_station_subscribers = _async(database.get_free_station_subscribers)
+
+# --- Export ---
+export_to_tempfile = _async(exporter.export_to_tempfile)
+
+# --- Quest state ---
+resync_state = _async(database.resync_state)
+
+# --- Broadcasts ---
+create_broadcast = _async(database.create_broadcast)
+claim_unfinished_broadcasts = _async(database.claim_unfinished_broadcasts)
+get_pending_broadcast_recipients = _async(database.get_pending_broadcast_recipients)
+get_broadcast_counts = _async(database.get_broadcast_counts)
+record_broadcast_results = _async(database.record_broadcast_results)
+finish_broadcast = _async(database.finish_broadcast)
+
+# --- Update queue ---
+enqueue_update = _async(database.enqueue_update)
+claim_updates = _async(database.claim_updates)
+complete_update = _async(database.complete_update)
+fail_update = _async(database.fail_update)
+heartbeat_updates = _async(database.heartbeat_updates)
+requeue_stale_updates = _async(database.requeue_stale_updates)
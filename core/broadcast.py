@@ -0,0 +1,151 @@
+"""
+Broadcast engine for /begin and /mailing.
+
+Jobs and per-recipient status live in Postgres (broadcasts / broadcast_recipients),
+so a restarted bot resumes only the recipients that are still pending.
+Sending is bounded by BROADCAST_CONCURRENCY and a global + per-chat token bucket.
+"""
+import time
+import asyncio
+import logging
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError, TelegramError
+from core import async_db
+from core.config import (
+    BROADCAST_CONCURRENCY, BROADCAST_RATE, BROADCAST_PER_CHAT_RATE,
+    BROADCAST_MAX_RETRIES, BROADCAST_PROGRESS_INTERVAL,
+)
+from core.utils.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 5  # seconds
+STALE_AFTER = 20  # a running job without heartbeat for this long is considered orphaned
+
+# Shared by every running job so parallel broadcasts together stay under Telegram's global limit
+_global_bucket = None
+
+def _get_global_bucket():
+    global _global_bucket
+    if _global_bucket is None:
+        _global_bucket = TokenBucket(BROADCAST_RATE)
+    return _global_bucket
+
+async def deliver(bot, chat_id, text, chat_bucket):
+    """
+    Send one message with retries, under the global bucket and `chat_bucket`. Returns (status, error).
+    Also used by core.push, so pushes and broadcasts share Telegram's global limit.
+    """
+    bucket = _get_global_bucket()
+    error = None
+    for attempt in range(BROADCAST_MAX_RETRIES):
+        await bucket.acquire()
+        await chat_bucket.acquire()
+        try:
+            await bot.send_message(chat_id=chat_id, text=text)
+            return "sent", None
+        except RetryAfter as e:
+            # Flood control: stop everyone, not only this recipient
+            logger.warning(f"Broadcast hit flood control, pausing for {e.retry_after}s")
+            bucket.pause(float(e.retry_after))
+            error = str(e)
+        except (Forbidden, BadRequest) as e:
+            # Blocked bot, deleted account, bad chat id — retrying will not help
+            return "failed", str(e)
+        except (TimedOut, NetworkError) as e:
+            error = str(e)
+            await asyncio.sleep(min(2 ** attempt, 30))
+        except TelegramError as e:
+            return "failed", str(e)
+    return "failed", error
+
+def _progress_text(title, counts, total, done=False):
+    head = f"{title} completed." if done else f"{title} in progress..."
+    return f"{head}\nSent: {counts['sent']}, failed: {counts['failed']}, remaining: {total - counts['sent'] - counts['failed']}"
+
+async def run_broadcast(bot, broadcast_id, text, progress_chat_id=None, progress_message_id=None, title="Mailing"):
+    pending = await async_db.get_pending_broadcast_recipients(broadcast_id)
+    counts = await async_db.get_broadcast_counts(broadcast_id)
+    total = counts["pending"] + counts["sent"] + counts["failed"]
+    queue = asyncio.Queue()
+    for tg in pending:
+        queue.put_nowait(tg)
+    results = []
+
+    async def flush():
+        batch = results[:]
+        del results[:len(batch)]
+        await async_db.record_broadcast_results(broadcast_id, batch)
+
+    async def report(done=False):
+        if not progress_chat_id or not progress_message_id:
+            return
+        try:
+            await bot.edit_message_text(
+                chat_id=progress_chat_id,
+                message_id=progress_message_id,
+                text=_progress_text(title, counts, total, done),
+            )
+        except TelegramError as e:
+            logger.debug(f"Progress update skipped: {e}")
+
+    async def worker():
+        while True:
+            try:
+                tg = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            # Fresh bucket per recipient: each chat gets at most one message per job,
+            # the bucket only spaces out retries to the same chat
+            status, error = await deliver(bot, tg, text, TokenBucket(BROADCAST_PER_CHAT_RATE, 1))
+            counts[status] += 1
+            results.append((tg, status, error))
+
+    workers = [asyncio.create_task(worker()) for _ in range(BROADCAST_CONCURRENCY)]
+    last_report = last_flush = time.monotonic()
+    try:
+        while not all(w.done() for w in workers):
+            await asyncio.wait(workers, timeout=1.0)
+            # Flushing also refreshes the heartbeat that keeps other instances from taking the job over
+            if results or time.monotonic() - last_flush >= HEARTBEAT_INTERVAL:
+                last_flush = time.monotonic()
+                await flush()
+            if time.monotonic() - last_report >= BROADCAST_PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                await report()
+        for w in workers:
+            w.result()
+    finally:
+        for w in workers:
+            w.cancel()
+        if results:
+            await flush()
+    await async_db.finish_broadcast(broadcast_id)
+    await report(done=True)
+    logger.info(f"Broadcast {broadcast_id} finished: {counts['sent']} sent, {counts['failed']} failed")
+    return counts
+
+async def start_broadcast(application, text, tg_ids, admin_chat_id, title="Mailing"):
+    """Persist a broadcast job and send it in the background. Returns the job id."""
+    msg = await application.bot.send_message(chat_id=admin_chat_id, text=f"{title} queued for {len(set(tg_ids))} users...")
+    broadcast_id = await async_db.create_broadcast(text, tg_ids, admin_chat_id, msg.message_id)
+    application.create_task(run_broadcast(application.bot, broadcast_id, text, admin_chat_id, msg.message_id, title))
+    return broadcast_id
+
+async def resume_broadcasts(application):
+    """
+    Resume broadcasts interrupted by a restart (call from Application.post_init).
+    Jobs whose heartbeat is still fresh are checked again once it has had time to expire.
+    """
+    async def resume():
+        for job in await async_db.claim_unfinished_broadcasts(STALE_AFTER):
+            logger.info(f"Resuming broadcast {job['id']}")
+            application.create_task(run_broadcast(
+                application.bot, job["id"], job["text"], job["progress_chat_id"], job["progress_message_id"]
+            ))
+
+    async def resume_later():
+        await asyncio.sleep(STALE_AFTER)
+        await resume()
+
+    await resume()
+    application.create_task(resume_later())
@@ -26,3 +26,77 @@ DB_CONFIG = {
     "port": POSTGRES_PORT,
     "database": POSTGRES_DB,
 }
+
+# Connection pool settings
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTHCHECK_INTERVAL", "30"))  # ping connections idle longer than this
+
+# Optional streaming read replica (libpq DSN or postgresql:// URL). Read-only helpers use it while its
+# replay lag stays under DB_REPLICA_MAX_LAG seconds; reads that must see a write (same group, event, ...)
+# stay on the primary until the replica has replayed it.
+DB_REPLICA_DSN = os.getenv("DB_REPLICA_DSN")
+DB_REPLICA_POOL_MAX = int(os.getenv("DB_REPLICA_POOL_MAX", str(DB_POOL_MAX)))
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "2"))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))  # seconds between lag checks
+
+# User identity (role, group, station) cache used by require_role
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "10000"))
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", "300"))  # seconds
+
+# Broadcasts (/begin, /mailing)
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))  # parallel send_message calls
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))  # messages per second overall (Telegram allows ~30)
+BROADCAST_PER_CHAT_RATE = float(os.getenv("BROADCAST_PER_CHAT_RATE", "1"))  # messages per second to one chat
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "5"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "3"))  # seconds between progress edits
+
+# /stats pagination
+STATS_PAGE_SIZE = int(os.getenv("STATS_PAGE_SIZE", "30"))
+
+# /free pagination (Telegram allows at most 100 inline buttons per message)
+FREE_STATIONS_PAGE_SIZE = int(os.getenv("FREE_STATIONS_PAGE_SIZE", "20"))
+
+# /info history pagination
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+
+# Updates handled concurrently in polling/webhook mode; updates of one chat always run in order (1 = sequential)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+
+# Repeated button presses, /take, /station_free and /reward within this many seconds are answered
+# from memory; redelivered updates (same update_id) are dropped. 0 turns this off.
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "10"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "20000"))
+
+# Flood protection, "role=rate/burst;..." in updates per second (0 = unlimited). "guest" covers
+# unregistered users and users whose role is not cached yet.
+# THROTTLE_USER_LIMITS apply to each user of the role, THROTTLE_ROLE_LIMITS to all of them together.
+THROTTLE_USER_LIMITS = os.getenv("THROTTLE_USER_LIMITS", "guest=0.5/3;curator=1/5;organizer=2/10;admin=0")
+THROTTLE_ROLE_LIMITS = os.getenv("THROTTLE_ROLE_LIMITS", "guest=30/60")
+
+# Update ingress: "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public base URL; if set, setWebhook is called at startup
+
+# Scale-out mode: BOT_MODE=ingress writes updates to the update_queue table,
+# BOT_MODE=worker processes them (run as many workers as needed)
+INGRESS_SOURCE = os.getenv("INGRESS_SOURCE", "webhook")  # webhook or polling
+WORKER_BATCH = int(os.getenv("WORKER_BATCH", "20"))  # updates processed concurrently by one worker
+WORKER_IDLE_POLL = float(os.getenv("WORKER_IDLE_POLL", "1.0"))  # seconds between polls when no NOTIFY arrives
+WORKER_MAX_ATTEMPTS = int(os.getenv("WORKER_MAX_ATTEMPTS", "3"))
+WORKER_STALE_AFTER = float(os.getenv("WORKER_STALE_AFTER", "120"))  # seconds without a heartbeat of its worker before an update is requeued
+
+# Prometheus metrics endpoint (0 disables it)
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Push notifications from station/reward events; only one instance (advisory lock) sends them
+PUSH_NOTIFICATIONS = os.getenv("PUSH_NOTIFICATIONS", "true").lower() == "true"
+
+# Seconds between score checkpoints of the rewards ledger (0 disables the periodic job)
+SCORE_CHECKPOINT_INTERVAL = float(os.getenv("SCORE_CHECKPOINT_INTERVAL", "300"))
@@ -1,15 +1,127 @@
+import json
 import time
 import decimal
 import logging
+import threading
+from datetime import datetime
+from contextlib import contextmanager
 import psycopg2
-from psycopg2.extras import DictCursor
-from core.config import DB_CONFIG
+from psycopg2.extras import DictCursor, Json, execute_values
+from core.config import DB_CONFIG, IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL, HISTORY_PAGE_SIZE
+from core.config import DB_REPLICA_MAX_LAG, DB_REPLICA_CHECK_INTERVAL
+from core.pool import get_pool, get_replica_pool
+from core.metrics import register, Counter
+from core.migrations import apply_migrations, DEFAULT_EVENT_ID
+from core.notify import listener
+from core.utils.cache import TTLCache
+from core.leaderboard import leaderboards
+from core.state import state
+from core.idempotency import recall, remember, forget
 
 logger = logging.getLogger(__name__)
 
 def get_connection():
+    """Open a dedicated (non-pooled) connection. Helpers should use db_cursor() instead."""
     return psycopg2.connect(**DB_CONFIG, cursor_factory=DictCursor)
 
+@contextmanager
+def db_cursor():
+    """
+    Borrow a pooled connection and yield a cursor.
+    Commits on normal exit, rolls back if the block raises.
+    """
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        try:
+            yield cur
+            conn.commit()
+        finally:
+            cur.close()
+
+# --- Read replica routing ---
+# Read-only helpers use db_read_cursor(*scopes). A scope names data a write touched, e.g.
+# ("group", id) or ("stations", event_id); writers call _wrote(scope) after committing (and the
+# NOTIFY handlers do for other instances' writes). _wrote records the primary's WAL position, and
+# a read of the scope uses the replica only once its replay position has passed it, so callers
+# always see their own writes however the lag changes between checks.
+_write_lsn = TTLCache(100000, 3600)  # scope -> WAL position (bytes) after its last write
+_replica = {"ok": False, "checked": 0.0, "lag": None, "replayed": 0}
+_replica_check_lock = threading.Lock()
+
+REPLICA_READS = register(Counter("db_read_routing_total", "Read-only helper calls by target", ("target",)))
+
+_REPLAYED_SQL = "SELECT COALESCE((pg_last_wal_replay_lsn() - '0/0')::bigint, -1) AS replayed;"
+
+def _wrote(*scopes):
+    # Without a replica there is nothing to route, so no extra round trip
+    if get_replica_pool() is None:
+        return
+    with db_cursor() as cur:
+        cur.execute("SELECT (pg_current_wal_lsn() - '0/0')::bigint AS lsn;")
+        lsn = cur.fetchone()["lsn"]
+    for scope in scopes:
+        _write_lsn.set(scope, max(lsn, _write_lsn.get(scope, 0)))
+
+def _note_replayed(replayed):
+    _replica["replayed"] = max(_replica["replayed"], replayed)
+
+def _replica_usable(replica_pool):
+    """Lag check at most every DB_REPLICA_CHECK_INTERVAL seconds; one thread checks, the others use the last result."""
+    if time.monotonic() - _replica["checked"] < DB_REPLICA_CHECK_INTERVAL or not _replica_check_lock.acquire(blocking=False):
+        return _replica["ok"]
+    try:
+        with replica_pool.connection() as conn, conn.cursor() as cur:
+            # Zero while the replica has replayed everything it received (also when it is idle)
+            cur.execute("""
+                SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END AS lag,
+                       COALESCE((pg_last_wal_replay_lsn() - '0/0')::bigint, -1) AS replayed;
+            """)
+            row = cur.fetchone()
+        _note_replayed(row["replayed"])
+        _replica["lag"] = float(row["lag"] or 0)
+        _replica["ok"] = _replica["lag"] < DB_REPLICA_MAX_LAG
+        if not _replica["ok"]:
+            logger.warning(f"Replica lag {_replica['lag']:.1f}s, reading from the primary")
+    except Exception as e:
+        logger.warning(f"Replica check failed, reading from the primary: {e}")
+        _replica["ok"] = False
+    finally:
+        _replica["checked"] = time.monotonic()
+        _replica_check_lock.release()
+    return _replica["ok"]
+
+@contextmanager
+def db_read_cursor(*scopes):
+    """
+    Cursor for read-only queries: on the replica if one is configured, healthy, within
+    DB_REPLICA_MAX_LAG and past the last write of every scope in `scopes`; otherwise on the primary.
+    """
+    replica_pool = get_replica_pool()
+    if replica_pool is None:
+        target = "primary"
+    elif not _replica_usable(replica_pool):
+        target = "primary_replica_down"
+    else:
+        needed = max((_write_lsn.get(scope, 0) for scope in scopes), default=0)
+        with replica_pool.connection() as conn:
+            cur = conn.cursor()
+            try:
+                if needed > _replica["replayed"]:
+                    # Ask the replica itself; replay only moves forward, so the read below sees the write
+                    cur.execute(_REPLAYED_SQL)
+                    _note_replayed(cur.fetchone()["replayed"])
+                if needed <= _replica["replayed"]:
+                    REPLICA_READS.inc("replica")
+                    yield cur
+                    return
+            finally:
+                cur.close()
+        target = "primary_recent_write"
+    REPLICA_READS.inc(target)
+    with db_cursor() as cur:
+        yield cur
+
 def wait_for_db(retries=20, delay=2):
     """Wait for the database to become available."""
     for i in range(retries):
@@ -24,414 +136,1034 @@ def wait_for_db(retries=20, delay=2):
     raise RuntimeError("Could not connect to Postgres.")
 
 def init_db():
-    """Create tables and fill with test stations (if not present)."""
-    conn = get_connection()
-    cur = conn.cursor()
+    """Bring the schema up to date (applies only pending migrations, see core.migrations)."""
+    apply_migrations()
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id SERIAL PRIMARY KEY,
-        tg_id BIGINT UNIQUE NOT NULL,
-        role VARCHAR(20) NOT NULL, -- curator, organizer, admin
-        group_id INT,
-        station_id INT
-    );
-    """)
+# --- Settings ---
+# In-process copy of the settings table as {event_id: {key: value}}. Filled by load_settings()
+# at startup, updated by set_setting() and refreshed when another process NOTIFYs a change.
+SETTINGS_CHANNEL = "settings_changed"
+_settings_cache = {}
+_settings_loaded = False
+_settings_lock = threading.Lock()
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS groups (
-        id SERIAL PRIMARY KEY,
-        group_number VARCHAR(20) UNIQUE NOT NULL,
-        score NUMERIC DEFAULT 0
-    );
-    """)
+def _read_setting(cur, key: str, event_id: int = DEFAULT_EVENT_ID) -> str | None:
+    cur.execute("SELECT value FROM settings WHERE event_id=%s AND key=%s;", (event_id, key))
+    row = cur.fetchone()
+    return row["value"] if row else None
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS stations (
-        id SERIAL PRIMARY KEY,
-        number INT UNIQUE NOT NULL,
-        name VARCHAR(200),
-        location TEXT,
-        is_free BOOLEAN DEFAULT TRUE,
-        current_group INT REFERENCES groups(id)
-    );
-    """)
+def load_settings():
+    """(Re)load all settings into the in-process cache."""
+    global _settings_cache, _settings_loaded
+    with db_cursor() as cur:
+        cur.execute("SELECT event_id, key, value FROM settings;")
+        fresh = {}
+        for row in cur.fetchall():
+            fresh.setdefault(row["event_id"], {})[row["key"]] = row["value"]
+    with _settings_lock:
+        _settings_cache = fresh
+        _settings_loaded = True
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS rewards (
-        id SERIAL PRIMARY KEY,
-        group_id INT REFERENCES groups(id),
-        station_id INT REFERENCES stations(id),
-        points NUMERIC NOT NULL,
-        bonus NUMERIC DEFAULT 0,
-        timestamp TIMESTAMP DEFAULT NOW()
-    );
-    """)
+def start_settings_sync():
+    """Keep the settings cache in sync with other bot instances via LISTEN/NOTIFY."""
+    listener.subscribe(SETTINGS_CHANNEL, lambda payload: load_settings())
+    listener.on_reconnect(load_settings)
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS settings (
-        key VARCHAR(100) PRIMARY KEY,
-        value TEXT
-    );
-    """)
-
-    conn.commit()
-
-    # If there are no stations — create sample stations 1..10
-    cur.execute("SELECT COUNT(*) FROM stations;")
-    cnt = cur.fetchone()[0]
-
-    if cnt == 0:
-        logger.info("Creating test stations (1–18)")
-
-        # Sample stations data specially for my university
-        stations_data = [
-            (1, "Station 1", "329"),
-            (2, "Station 2", "above room 101"),
-            (3, "Station 3", "near the tennis tables"),
-            (4, "Station 4", "253"),
-            (5, "Station 5", "above the cafeteria"),
-            (6, "Station 6", "hall E"),
-            (7, "Station 7", "210D"),
-            (8, "Station 8", "235"),
-            (9, "Station 9", "hall E"),
-            (10, "Station 10", "217"),
-            (11, "Station 11", "hall E"),
-            (12, "Station 12", "212D"),
-            (13, "Station 13", "bank (2nd floor)"),
-            (14, "Station 14", "2nd floor above the entrance (windows facing math-mech)"),
-            (15, "Station 15", "248"),
-            (16, "Station 16", "240"),
-            (17, "Station 17", "outside"),
-            (18, "Station 18", "outside"),
-        ]
-
-        for number, name, location in stations_data:
-            cur.execute(
-                """
-                INSERT INTO stations (number, name, location, is_free)
-                VALUES (%s, %s, %s, TRUE)
-                ON CONFLICT DO NOTHING;
-                """,
-                (number, name, location)
-            )
-        conn.commit()
+def set_setting(key: str, value: str, event_id: int = DEFAULT_EVENT_ID):
+    with db_cursor() as cur:
+        # The settings_changed trigger notifies other instances
+        cur.execute("""
+            INSERT INTO settings (event_id, key, value) VALUES (%s, %s, %s)
+            ON CONFLICT (event_id, key) DO UPDATE SET value = EXCLUDED.value;
+        """, (event_id, key, value))
+    with _settings_lock:
+        _settings_cache.setdefault(event_id, {})[key] = value
 
-    # Initialize default settings if not present
-    def set_default(key, val):
-        cur.execute("INSERT INTO settings (key, value) VALUES (%s, %s) ON CONFLICT (key) DO NOTHING;", (key, val))
+def get_setting(key: str, event_id: int = DEFAULT_EVENT_ID) -> str | None:
+    if _settings_loaded:
+        return _settings_cache.get(event_id, {}).get(key)
+    with db_cursor() as cur:
+        return _read_setting(cur, key, event_id)
 
-    set_default("org_registration_open", "false")
-    set_default("quest_started", "false")
-    set_default("quest_ended", "false")
-    conn.commit()
+# --- Events ---
+EVENT_SETTINGS = ("org_registration_open", "quest_started", "quest_ended")
 
-    cur.close()
-    conn.close()
+def create_event(code: str, title: str | None = None):
+    """Create an event with all switches off. Returns {"ok", "event_id"} or {"ok": False, "error"}."""
+    with db_cursor() as cur:
+        cur.execute("INSERT INTO events (code, title) VALUES (%s, %s) ON CONFLICT (code) DO NOTHING RETURNING id;", (code, title))
+        row = cur.fetchone()
+        if not row:
+            return {"ok": False, "error": f"Event {code} already exists."}
+        event_id = row["id"]
+        for key in EVENT_SETTINGS:
+            cur.execute("INSERT INTO settings (event_id, key, value) VALUES (%s, %s, 'false');", (event_id, key))
+    with _settings_lock:
+        _settings_cache[event_id] = {key: "false" for key in EVENT_SETTINGS}
+    return {"ok": True, "event_id": event_id}
 
-# --- Settings ---
-def set_setting(key: str, value: str):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO settings (key, value) VALUES (%s, %s) ON CONFLICT (key) DO UPDATE SET value = %s;", (key, value, value))
-    conn.commit()
-    cur.close()
-    conn.close()
-
-def get_setting(key: str) -> str | None:
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT value FROM settings WHERE key=%s;", (key,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
-    return row["value"] if row else None
+def get_event_by_code(code: str):
+    with db_cursor() as cur:
+        cur.execute("SELECT * FROM events WHERE code=%s;", (code,))
+        return cur.fetchone()
+
+def get_event_by_id(event_id: int):
+    with db_cursor() as cur:
+        cur.execute("SELECT * FROM events WHERE id=%s;", (event_id,))
+        return cur.fetchone()
+
+def list_events():
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT e.id, e.code, e.title,
+                   (SELECT COUNT(*) FROM groups g WHERE g.event_id = e.id) AS groups,
+                   (SELECT COUNT(*) FROM stations s WHERE s.event_id = e.id) AS stations
+            FROM events e ORDER BY e.id;
+        """)
+        return cur.fetchall()
+
+def switch_event(tg_id: int, event_id: int):
+    """Move an admin to another event (admins act on one event at a time)."""
+    with db_cursor() as cur:
+        cur.execute("UPDATE users SET event_id=%s WHERE tg_id=%s AND role='admin';", (event_id, tg_id))
+        updated = cur.rowcount > 0
+    invalidate_user_identity(tg_id)
+    if updated:
+        state.update_user(tg_id, event_id=event_id)
+    return updated
 
 # --- User / group helpers ---
+# Once core.state is loaded (bot processes) users, groups and stations are read from memory;
+# the database paths below serve the CLIs and the ingress, which never load it.
 def get_user_by_tg(tg_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE tg_id=%s;", (tg_id,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
-    return row
+    if state.loaded:
+        return state.user(tg_id)
+    with db_cursor() as cur:
+        cur.execute("SELECT * FROM users WHERE tg_id=%s;", (tg_id,))
+        return cur.fetchone()
+
+# Identity cache: tg_id -> {"tg_id", "role", "group_id", "station_id", "event_id"} or None for unknown users.
+# Invalidated by register_curator / register_organizer; other changes expire after IDENTITY_CACHE_TTL.
+# Only used while core.state is not loaded.
+_identity_cache = TTLCache(IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL)
+_MISSING = object()
+
+def get_user_identity(tg_id):
+    if state.loaded:
+        return state.identity(tg_id)
+    ident = _identity_cache.get(tg_id, _MISSING)
+    if ident is not _MISSING:
+        return ident
+    with db_cursor() as cur:
+        cur.execute("SELECT tg_id, role, group_id, station_id, event_id FROM users WHERE tg_id=%s;", (tg_id,))
+        row = cur.fetchone()
+    ident = dict(row) if row else None
+    _identity_cache.set(tg_id, ident)
+    return ident
+
+def peek_user_role(tg_id):
+    """Role from memory only: the role, "guest" for a known unregistered user, None if not cached."""
+    if state.loaded:
+        ident = state.identity(tg_id)
+        return ident["role"] if ident else "guest"
+    ident = _identity_cache.get(tg_id, _MISSING)
+    if ident is _MISSING:
+        return None
+    return ident["role"] if ident else "guest"
+
+def invalidate_user_identity(tg_id):
+    _identity_cache.pop(tg_id)
+
+def start_identity_sync():
+    """Drop cached identities changed by other bot instances (users_changed trigger)."""
+    def on_user(payload):
+        invalidate_user_identity(int(payload))
+        # The payload has no event: keep every event's user list on the primary for a moment
+        _wrote(("users", None))
+    listener.subscribe("users_changed", on_user)
+    listener.on_reconnect(_identity_cache.clear)
 
 def get_user_role(tg_id):
-    u = get_user_by_tg(tg_id)
-    return u["role"] if u else None
-
-def get_group_by_number(group_number):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM groups WHERE group_number=%s;", (group_number,))
-    g = cur.fetchone()
-    cur.close()
-    conn.close()
-    return g
-
-def register_curator(tg_id: int, group_number: str):
-    conn = get_connection()
-    cur = conn.cursor()
-
-    # Find or create group
-    cur.execute("SELECT id FROM groups WHERE group_number=%s;", (group_number,))
-    row = cur.fetchone()
-    if row:
-        group_id = row["id"]
-    else:
-        cur.execute("INSERT INTO groups (group_number) VALUES (%s) RETURNING id;", (group_number,))
-        group_id = cur.fetchone()["id"]
+    ident = get_user_identity(tg_id)
+    return ident["role"] if ident else None
 
-    # Check if curator already registered for this group
-    cur.execute("SELECT id FROM users WHERE role='curator' AND group_id=%s;", (group_id,))
-    if cur.fetchone():
-        cur.close()
-        conn.close()
-        return {"ok": False, "error": "A curator is already registered for this group."}
+def get_user_event(tg_id):
+    """The event a user belongs to; unregistered users see the default event."""
+    ident = get_user_identity(tg_id)
+    return ident["event_id"] if ident else DEFAULT_EVENT_ID
 
-    # Register user
-    cur.execute("""
-        INSERT INTO users (tg_id, role, group_id)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (tg_id) DO UPDATE SET role=EXCLUDED.role, group_id=EXCLUDED.group_id
-        RETURNING id;
-    """, (tg_id, "curator", group_id))
-    uid = cur.fetchone()["id"]
-    conn.commit()
-    cur.close()
-    conn.close()
-    return {"ok": True, "group_id": group_id, "user_id": uid}
-
-def register_organizer(tg_id: int, station_number: int):
+def get_group_by_number(group_number, event_id: int = DEFAULT_EVENT_ID):
+    if state.loaded:
+        return state.group_by_number(event_id, group_number)
+    with db_cursor() as cur:
+        cur.execute("SELECT * FROM groups WHERE event_id=%s AND group_number=%s;", (event_id, group_number))
+        return cur.fetchone()
+
+def get_group_by_id(group_id):
+    if state.loaded:
+        return state.group(group_id)
+    with db_cursor() as cur:
+        cur.execute("SELECT * FROM groups WHERE id=%s;", (group_id,))
+        return cur.fetchone()
+
+def register_curator(tg_id: int, group_number: str, event_id: int = DEFAULT_EVENT_ID):
+    with db_cursor() as cur:
+        # Find or create group
+        cur.execute("SELECT id FROM groups WHERE event_id=%s AND group_number=%s;", (event_id, group_number))
+        row = cur.fetchone()
+        created = row is None
+        if not created:
+            group_id = row["id"]
+        else:
+            cur.execute("INSERT INTO groups (event_id, group_number) VALUES (%s, %s) RETURNING id, event_id, group_number, score;",
+                        (event_id, group_number))
+            group = cur.fetchone()
+            group_id = group["id"]
+
+        # Check if curator already registered for this group
+        cur.execute("SELECT id FROM users WHERE role='curator' AND group_id=%s;", (group_id,))
+        if cur.fetchone():
+            return {"ok": False, "error": "A curator is already registered for this group."}
+
+        # Register user
+        cur.execute("""
+            INSERT INTO users (tg_id, role, group_id, event_id)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (tg_id) DO UPDATE SET role=EXCLUDED.role, group_id=EXCLUDED.group_id, event_id=EXCLUDED.event_id
+            RETURNING *;
+        """, (tg_id, "curator", group_id, event_id))
+        user = cur.fetchone()
+    invalidate_user_identity(tg_id)
+    _wrote(("users", event_id))
+    if created:
+        leaderboards.get(event_id).set(group_id, group_number, 0)
+        state.put_group(group)
+    state.put_user(user)
+    return {"ok": True, "group_id": group_id, "user_id": user["id"]}
+
+def register_organizer(tg_id: int, station_number: int, event_id: int = DEFAULT_EVENT_ID):
     # Check if registration is open
-    if get_setting("org_registration_open") != "true":
+    if get_setting("org_registration_open", event_id) != "true":
         return {"ok": False, "error": "Organizer registration is closed."}
 
-    conn = get_connection()
-    cur = conn.cursor()
+    with db_cursor() as cur:
 
-    # Find station
-    cur.execute("SELECT id FROM stations WHERE number=%s;", (station_number,))
-    st = cur.fetchone()
-    if not st:
-        cur.close()
-        conn.close()
-        return {"ok": False, "error": "Station with this number not found."}
-    station_id = st["id"]
-
-    # Check if organizer already registered for this station
-    cur.execute("SELECT id FROM users WHERE role='organizer' AND station_id=%s;", (station_id,))
-    if cur.fetchone():
-        cur.close()
-        conn.close()
-        return {"ok": False, "error": "An organizer is already registered for this station."}
-
-    # Create or update organizer user
-    cur.execute("""
-        INSERT INTO users (tg_id, role, station_id)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (tg_id) DO UPDATE SET role=EXCLUDED.role, station_id=EXCLUDED.station_id
-        RETURNING id;
-    """, (tg_id, "organizer", station_id))
-    uid = cur.fetchone()["id"]
-    conn.commit()
-    cur.close()
-    conn.close()
-    return {"ok": True, "user_id": uid, "station_id": station_id}
+        # Find station
+        cur.execute("SELECT id FROM stations WHERE event_id=%s AND number=%s;", (event_id, station_number))
+        st = cur.fetchone()
+        if not st:
+            return {"ok": False, "error": "Station with this number not found."}
+        station_id = st["id"]
+
+        # Check if organizer already registered for this station
+        cur.execute("SELECT id FROM users WHERE role='organizer' AND station_id=%s;", (station_id,))
+        if cur.fetchone():
+            return {"ok": False, "error": "An organizer is already registered for this station."}
+
+        # Create or update organizer user
+        cur.execute("""
+            INSERT INTO users (tg_id, role, station_id, event_id)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (tg_id) DO UPDATE SET role=EXCLUDED.role, station_id=EXCLUDED.station_id, event_id=EXCLUDED.event_id
+            RETURNING *;
+        """, (tg_id, "organizer", station_id, event_id))
+        user = cur.fetchone()
+    invalidate_user_identity(tg_id)
+    _wrote(("users", event_id))
+    state.put_user(user)
+    return {"ok": True, "user_id": user["id"], "station_id": station_id}
 
 # --- Stations ---
+# Free stations kept in memory per event as {event_id: [(number, location), ...]} ordered by number.
+# An event's list is dropped by take_station / release_station_by_number (and by the station_events and
+# stations_changed triggers for changes made elsewhere) and rebuilt from core.state on the next read. _free_version grows on every drop,
+# so callers can memoize whatever they render from one version of the list.
+STATIONS_CHANNEL = "stations_changed"
+_free_stations = {}
+_free_version = 0
+_free_lock = threading.Lock()
+_free_load_lock = threading.Lock()
 
-def get_free_stations_with_location():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT number, location FROM stations WHERE is_free=TRUE ORDER BY number;")
-    rows = [(row["number"], row["location"]) for row in cur.fetchall()]
-    cur.close()
-    conn.close()
-    return rows
-
-def get_station_by_number(number):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM stations WHERE number=%s;", (number,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
-    return row
+def invalidate_free_stations(event_id: int | None = None):
+    """Drop the list of one event, or of all events when event_id is None."""
+    global _free_version
+    with _free_lock:
+        if event_id is None:
+            _free_stations.clear()
+        else:
+            _free_stations.pop(event_id, None)
+        _free_version += 1
+    _wrote(("stations", event_id))
+
+def peek_free_stations(event_id: int = DEFAULT_EVENT_ID):
+    """(version, stations) if the cached list is valid, else None. Never touches the database."""
+    with _free_lock:
+        stations = _free_stations.get(event_id)
+        return (_free_version, stations) if stations is not None else None
+
+def get_free_stations_snapshot(event_id: int = DEFAULT_EVENT_ID):
+    """(version, [(number, location), ...]) — from memory, or reloaded once after an invalidation."""
+    # Concurrent readers after an invalidation wait for a single reload instead of all querying
+    with _free_load_lock:
+        cached = peek_free_stations(event_id)
+        if cached is not None:
+            return cached
+        with _free_lock:
+            version = _free_version
+        if state.loaded:
+            fresh = state.free_stations(event_id)
+        else:
+            # The list is cached until the next change, so it must not come from a replica that lags behind it
+            with db_read_cursor(("stations", event_id), ("stations", None)) as cur:
+                cur.execute("SELECT number, location FROM stations WHERE event_id=%s AND is_free=TRUE ORDER BY number;", (event_id,))
+                fresh = [(row["number"], row["location"]) for row in cur.fetchall()]
+        with _free_lock:
+            # Keep it only if nothing was taken or released while loading
+            if _free_version == version:
+                _free_stations[event_id] = fresh
+        return version, fresh
+
+def start_free_stations_sync():
+    """
+    Drop the free-station list when other bot instances (or psql) change stations, and forget
+    the remembered takes and releases (core.idempotency) such a change outdates.
+    """
+    def on_station_event(payload):
+        ev = json.loads(payload)
+        invalidate_free_stations(ev["event_id"])
+        if ev["is_free"]:
+            # The visit is over: taking the station again is a new request
+            forget(("take", ev["old_group_id"], ev["number"]))
+        else:
+            # Occupied again: the next release is a new request
+            forget(("release", ev["event_id"], ev["number"]))
+
+    # stations_changed sends the event id of an added, removed or edited station,
+    # station_events reports taking and releasing
+    listener.subscribe(STATIONS_CHANNEL, lambda payload: invalidate_free_stations(int(payload) if payload else None))
+    listener.subscribe("station_events", on_station_event)
+    listener.on_reconnect(invalidate_free_stations)
+
+def get_free_stations_with_location(event_id: int = DEFAULT_EVENT_ID):
+    return get_free_stations_snapshot(event_id)[1]
+
+def get_station_by_number(number, event_id: int = DEFAULT_EVENT_ID):
+    if state.loaded:
+        return state.station(event_id, number)
+    with db_cursor() as cur:
+        cur.execute("SELECT * FROM stations WHERE event_id=%s AND number=%s;", (event_id, number))
+        return cur.fetchone()
 
 def take_station(group_tg_id: int, station_number: int):
-    """Curator takes a station: set is_free=False, current_group=group.id."""
-    conn = get_connection()
-    cur = conn.cursor()
-
-    # Checks
-    cur.execute("SELECT id, group_id FROM users WHERE tg_id=%s AND role='curator';", (group_tg_id,))
-    u = cur.fetchone()
-    if not u:
-        cur.close()
-        conn.close()
-        return {"ok": False, "error": "You are not registered as a curator."}
-    group_id = u["group_id"]
+    """
+    Curator takes a station: set is_free=False, current_group=group.id.
+    The claim is a single conditional UPDATE that re-checks the curator, the quest state
+    and is_free, so of several concurrent claims for one station exactly one wins.
+    A repeat of a successful claim (double-tap) is answered from core.idempotency.
+    The committed row is applied to core.state before the free list is dropped.
+    """
+    ident = get_user_identity(group_tg_id)
+    # Cheap rejection from the settings cache; the UPDATE below re-checks in the database
+    event_id = ident["event_id"] if ident else DEFAULT_EVENT_ID
+    if get_setting("quest_started", event_id) != "true":
+        return {"ok": False, "error": "The quest has not started yet."}
+    if get_setting("quest_ended", event_id) == "true":
+        return {"ok": False, "error": "The quest is finished — stations cannot be taken."}
+    key = ("take", ident["group_id"], station_number) if ident and ident["group_id"] else None
+    if state.loaded and ident and ident["role"] == "curator":
+        known = state.station(event_id, station_number)
+        if known is None:
+            return {"ok": False, "error": "Station not found."}
+        if not known["is_free"]:
+            # Only a claim the group still holds can be repeated (another instance may have released it since)
+            repeated = recall(key) if known["current_group"] == ident["group_id"] else None
+            return repeated or {"ok": False, "error": "Station is already occupied."}
+    elif key:
+        repeated = recall(key)
+        if repeated:
+            return repeated
 
-    # Check quest status
-    if get_setting("quest_started") != "true":
-        cur.close()
-        conn.close()
+    with db_cursor() as cur:
+        cur.execute("""
+            UPDATE stations s SET is_free = FALSE, current_group = u.group_id
+            FROM users u
+            WHERE s.number = %s AND s.is_free
+              AND u.tg_id = %s AND u.role = 'curator' AND s.event_id = u.event_id
+              AND EXISTS (SELECT 1 FROM settings st WHERE st.event_id = u.event_id AND st.key = 'quest_started' AND st.value = 'true')
+              AND NOT EXISTS (SELECT 1 FROM settings st WHERE st.event_id = u.event_id AND st.key = 'quest_ended' AND st.value = 'true')
+            RETURNING s.*;
+        """, (station_number, group_tg_id))
+        st = cur.fetchone()
+        if st:
+            # The group no longer waits for a station
+            cur.execute("DELETE FROM station_waitlist WHERE group_id = %s;", (st["current_group"],))
+        else:
+            # Lost the claim: one more query only to explain why
+            cur.execute("""
+                SELECT (SELECT role FROM users WHERE tg_id = %(tg)s) AS role,
+                       (SELECT is_free FROM stations WHERE event_id = %(event)s AND number = %(number)s) AS is_free,
+                       (SELECT value FROM settings WHERE event_id = %(event)s AND key = 'quest_started') AS quest_started,
+                       (SELECT value FROM settings WHERE event_id = %(event)s AND key = 'quest_ended') AS quest_ended;
+            """, {"tg": group_tg_id, "event": event_id, "number": station_number})
+            why = cur.fetchone()
+    if st:
+        state.put_stations([st])
+        # After the commit, so a concurrent reload cannot cache the pre-claim list
+        invalidate_free_stations(event_id)
+        forget(("release", event_id, station_number))
+        return remember(("take", st["current_group"], station_number),
+                        {"ok": True, "station_id": st["id"], "name": st["name"], "location": st["location"]})
+    if why["role"] != "curator":
+        return {"ok": False, "error": "You are not registered as a curator."}
+    if why["quest_started"] != "true":
         return {"ok": False, "error": "The quest has not started yet."}
-    if get_setting("quest_ended") == "true":
-        cur.close()
-        conn.close()
+    if why["quest_ended"] == "true":
         return {"ok": False, "error": "The quest is finished — stations cannot be taken."}
+    if why["is_free"] is None:
+        return {"ok": False, "error": "Station not found."}
+    return {"ok": False, "error": "Station is already occupied."}
+
+def release_station_by_number(station_number: int, event_id: int = DEFAULT_EVENT_ID):
+    """
+    Free the station and, in the same transaction, hand it to the longest-waiting eligible group
+    (see Waitlists below). The group that just left may in turn get a free station it waits for.
+    Returns {"ok": True, "assigned": [{"group_id", "group_number", "number", "name", "location"}, ...]}.
+    A repeated release (double-tap) gets the same result back with "repeated": True.
+    """
+    repeated = recall(("release", event_id, station_number))
+    if repeated:
+        return repeated
+    assigned = []
+    written = []  # station rows changed by this transaction, for core.state
+    with db_cursor() as cur:
+        cur.execute("""
+            UPDATE stations s SET is_free = TRUE, current_group = NULL
+            FROM (SELECT id, current_group FROM stations WHERE event_id = %s AND number = %s FOR UPDATE) old
+            WHERE s.id = old.id
+            RETURNING s.*, old.current_group AS left_group;
+        """, (event_id, station_number))
+        row = cur.fetchone()
+        if row:
+            written.append(row)
+        if row and _quest_running(event_id):
+            a = _assign_waiting_group(cur, row["id"], written)
+            if a:
+                assigned.append(a)
+            if row["left_group"]:
+                a = _assign_station_to_group(cur, row["left_group"], written, exclude_station_id=row["id"])
+                if a:
+                    assigned.append(a)
+    state.put_stations(written)
+    invalidate_free_stations(event_id)
+    if row:
+        # The visit is over: the next take or reward at this station is a new request
+        forget(("take", row["left_group"], station_number), ("reward", row["visit_id"], "points"), ("reward", row["visit_id"], "bonus"))
+    return remember(("release", event_id, station_number), {"ok": True, "assigned": assigned})
 
-    cur.execute("SELECT id, is_free FROM stations WHERE number=%s;", (station_number,))
+# --- Waitlists ---
+# station_waitlist holds (group, station) requests; station_id NULL means "any station not visited yet".
+# Its (created_at, id) order is the priority: a freed station goes to the group that has waited
+# longest among those that wait for it, are not at another station and have no reward there yet.
+def _quest_running(event_id: int = DEFAULT_EVENT_ID):
+    return get_setting("quest_started", event_id) == "true" and get_setting("quest_ended", event_id) != "true"
+
+def _claim_for_group(cur, station_id, group_id, written):
+    """
+    Give a free station to a group that is not at a station. Returns the assignment or None.
+    The claimed station row is appended to `written`, for core.state after the commit.
+    """
+    # Row lock on the group serializes concurrent assignments of the same group
+    cur.execute("SELECT group_number FROM groups WHERE id = %s FOR UPDATE;", (group_id,))
+    group = cur.fetchone()
+    cur.execute("""
+        UPDATE stations SET is_free = FALSE, current_group = %(group_id)s
+        WHERE id = %(station_id)s AND is_free
+          AND NOT EXISTS (SELECT 1 FROM stations busy WHERE busy.current_group = %(group_id)s)
+        RETURNING *;
+    """, {"station_id": station_id, "group_id": group_id})
     st = cur.fetchone()
     if not st:
-        cur.close()
-        conn.close()
-        return {"ok": False, "error": "Station not found."}
-    if not st["is_free"]:
-        cur.close()
-        conn.close()
-        return {"ok": False, "error": "Station is already occupied."}
-
-    # Take the station
-    cur.execute("UPDATE stations SET is_free=FALSE, current_group=%s WHERE id=%s;", (group_id, st["id"]))
-
-    conn.commit()
-    cur.close()
-    conn.close()
-    return {"ok": True, "station_id": st["id"]}
-
-def release_station_by_number(station_number: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE stations SET is_free=TRUE, current_group=NULL WHERE number=%s;", (station_number,))
-    conn.commit()
-    cur.close()
-    conn.close()
-    return {"ok": True}
+        return None
+    written.append(st)
+    cur.execute("DELETE FROM station_waitlist WHERE group_id = %s;", (group_id,))
+    return {"group_id": group_id, "group_number": group["group_number"],
+            "number": st["number"], "name": st["name"], "location": st["location"]}
+
+def _assign_waiting_group(cur, station_id, written, attempts=5):
+    for _ in range(attempts):
+        cur.execute("""
+            SELECT w.group_id FROM station_waitlist w
+            WHERE (w.station_id = %(station_id)s
+                   OR (w.station_id IS NULL AND w.event_id = (SELECT event_id FROM stations WHERE id = %(station_id)s)))
+              AND NOT EXISTS (SELECT 1 FROM stations s WHERE s.current_group = w.group_id)
+              AND NOT EXISTS (SELECT 1 FROM rewards r WHERE r.group_id = w.group_id AND r.station_id = %(station_id)s)
+            ORDER BY w.created_at, w.id
+            LIMIT 1
+            FOR UPDATE OF w SKIP LOCKED;
+        """, {"station_id": station_id})
+        w = cur.fetchone()
+        if not w:
+            return None
+        assigned = _claim_for_group(cur, station_id, w["group_id"], written)
+        if assigned:
+            return assigned
+        # The group got a station elsewhere in the meantime (its rows are gone now), try the next one
+    return None
+
+def _assign_station_to_group(cur, group_id, written, exclude_station_id=None):
+    """Give a waiting group a free station it waits for (or any unvisited one). Returns the assignment or None."""
+    cur.execute("""
+        SELECT s.id FROM stations s
+        WHERE s.event_id = (SELECT event_id FROM groups WHERE id = %(group_id)s)
+          AND s.is_free AND s.id IS DISTINCT FROM %(exclude)s
+          AND EXISTS (SELECT 1 FROM station_waitlist w
+                      WHERE w.group_id = %(group_id)s AND (w.station_id = s.id OR w.station_id IS NULL))
+          AND NOT EXISTS (SELECT 1 FROM rewards r WHERE r.group_id = %(group_id)s AND r.station_id = s.id)
+        ORDER BY s.number
+        LIMIT 1
+        FOR UPDATE OF s SKIP LOCKED;
+    """, {"group_id": group_id, "exclude": exclude_station_id})
+    st = cur.fetchone()
+    return _claim_for_group(cur, st["id"], group_id, written) if st else None
+
+def _curator_group(tg_id):
+    """(group_id, event_id) of a curator, or (None, None)."""
+    u = get_user_identity(tg_id)
+    return (u["group_id"], u["event_id"]) if u and u["role"] == "curator" else (None, None)
+
+def take_next_station(tg_id: int):
+    """
+    "Next best station": claim a random free station the group has not visited yet,
+    otherwise put the group on the waitlist for any station.
+    Returns {"ok", "assigned"} or {"ok", "waiting", "position"} or {"ok": False, "error"}.
+    """
+    group_id, event_id = _curator_group(tg_id)
+    if group_id is None:
+        return {"ok": False, "error": "You are not registered as a curator."}
+    if not _quest_running(event_id):
+        return {"ok": False, "error": "The quest is not running."}
+    assigned = None
+    written = []
+    with db_cursor() as cur:
+        cur.execute("SELECT 1 FROM stations WHERE current_group = %s;", (group_id,))
+        if not cur.fetchone():
+            # Random order spreads simultaneous requests over the free stations instead of all locking the first
+            cur.execute("""
+                SELECT s.id FROM stations s
+                WHERE s.event_id = %s AND s.is_free
+                  AND NOT EXISTS (SELECT 1 FROM rewards r WHERE r.group_id = %s AND r.station_id = s.id)
+                ORDER BY random()
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED;
+            """, (event_id, group_id))
+            st = cur.fetchone()
+            if st:
+                assigned = _claim_for_group(cur, st["id"], group_id, written)
+        if not assigned:
+            cur.execute("""
+                INSERT INTO station_waitlist (event_id, group_id, station_id) VALUES (%s, %s, NULL)
+                ON CONFLICT (group_id) WHERE station_id IS NULL DO NOTHING;
+            """, (event_id, group_id))
+            position = _waitlist_position(cur, group_id, None)
+    if assigned:
+        state.put_stations(written)
+        invalidate_free_stations(event_id)
+        return {"ok": True, "assigned": assigned}
+    return {"ok": True, "waiting": True, "position": position}
+
+def join_waitlist(tg_id: int, station_number: int):
+    """
+    Wait for one station: taken at once if it is free (and the group is not at a station),
+    otherwise the group is queued and gets it on release if it is still first in line.
+    """
+    group_id, event_id = _curator_group(tg_id)
+    if group_id is None:
+        return {"ok": False, "error": "You are not registered as a curator."}
+    if not _quest_running(event_id):
+        return {"ok": False, "error": "The quest is not running."}
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT id, is_free,
+                   EXISTS (SELECT 1 FROM rewards r WHERE r.group_id = %(group_id)s AND r.station_id = s.id) AS visited,
+                   EXISTS (SELECT 1 FROM stations b WHERE b.current_group = %(group_id)s) AS busy
+            FROM stations s WHERE event_id = %(event_id)s AND number = %(number)s;
+        """, {"group_id": group_id, "event_id": event_id, "number": station_number})
+        st = cur.fetchone()
+        if not st:
+            return {"ok": False, "error": "Station not found."}
+        if st["visited"]:
+            return {"ok": False, "error": "Your group has already visited this station."}
+        assigned = None
+        written = []
+        if st["is_free"] and not st["busy"]:
+            assigned = _claim_for_group(cur, st["id"], group_id, written)
+        if not assigned:
+            cur.execute("""
+                INSERT INTO station_waitlist (event_id, group_id, station_id) VALUES (%s, %s, %s)
+                ON CONFLICT (group_id, station_id) DO NOTHING;
+            """, (event_id, group_id, st["id"]))
+            position = _waitlist_position(cur, group_id, st["id"])
+    if assigned:
+        state.put_stations(written)
+        invalidate_free_stations(event_id)
+        return {"ok": True, "assigned": assigned}
+    return {"ok": True, "waiting": True, "position": position}
+
+def _waitlist_position(cur, group_id, station_id):
+    """1-based place of the group among the groups waiting for this station (or for any station)."""
+    cur.execute("""
+        SELECT COUNT(DISTINCT w.group_id) + 1 AS position FROM station_waitlist w
+        WHERE (w.station_id IS NOT DISTINCT FROM %(station_id)s OR w.station_id IS NULL OR %(station_id)s IS NULL)
+          AND w.event_id = (SELECT event_id FROM groups WHERE id = %(group_id)s)
+          AND w.group_id <> %(group_id)s
+          AND (w.created_at, w.id) < (SELECT created_at, id FROM station_waitlist
+                                      WHERE group_id = %(group_id)s AND station_id IS NOT DISTINCT FROM %(station_id)s);
+    """, {"group_id": group_id, "station_id": station_id})
+    return cur.fetchone()["position"]
+
+def leave_waitlist(tg_id: int):
+    """Remove all waitlist entries of the caller's group. Returns the number of entries removed."""
+    group_id, _ = _curator_group(tg_id)
+    if group_id is None:
+        return 0
+    with db_cursor() as cur:
+        cur.execute("DELETE FROM station_waitlist WHERE group_id = %s;", (group_id,))
+        return cur.rowcount
 
 # --- Rewards / scoring ---
-def reward_current_group_by_organizer(org_tg_id: int, points: float, bonus: float = 0.0):
-    conn = get_connection()
-    cur = conn.cursor()
+def _bump_group_summary(cur, group_id, amount, station_number):
+    """Keep group_summaries in step with a new rewards row (same transaction)."""
+    cur.execute("""
+        INSERT INTO group_summaries (group_id, total, reward_count, last_station_number, last_reward_at)
+        VALUES (%s, %s, 1, %s, NOW())
+        ON CONFLICT (group_id) DO UPDATE SET
+            total = group_summaries.total + EXCLUDED.total,
+            reward_count = group_summaries.reward_count + 1,
+            last_station_number = COALESCE(EXCLUDED.last_station_number, group_summaries.last_station_number),
+            last_reward_at = EXCLUDED.last_reward_at;
+    """, (group_id, amount, station_number))
 
+def reward_current_group_by_organizer(org_tg_id: int, points: float, bonus: float = 0.0):
     # Find organizer and their station
-    cur.execute("SELECT station_id FROM users WHERE tg_id=%s AND role='organizer';", (org_tg_id,))
-    u = cur.fetchone()
-    if not u:
-        cur.close()
-        conn.close()
+    u = get_user_identity(org_tg_id)
+    if not u or u["role"] != "organizer":
         return {"ok": False, "error": "You are not registered as an organizer."}
     station_id = u["station_id"]
     if station_id is None:
-        cur.close()
-        conn.close()
         return {"ok": False, "error": "You do not have a station assigned."}
+    # A zero row would not be covered by the unique indexes below, so it could be repeated endlessly
+    if not points and not bonus:
+        return {"ok": False, "error": "Nothing to award."}
+    # A visit gets points once and a bonus once (unique indexes on rewards.visit_id). The remembered
+    # result is keyed by the visit, so the next group at the station is never answered from it.
+    kind = "points" if points else "bonus"
+    amount = points or bonus
+    if state.loaded:
+        known = state.station_by_id(station_id)
+        if not known or not known["current_group"]:
+            return {"ok": False, "error": "There is no group at your station at the moment."}
+        repeated = _recall_reward(("reward", known["visit_id"], kind), amount) if known["visit_id"] is not None else None
+        if repeated:
+            return repeated
 
-    # Find group at this station
-    cur.execute("SELECT current_group FROM stations WHERE id=%s;", (station_id,))
-    st = cur.fetchone()
-    if not st or not st["current_group"]:
-        cur.close()
-        conn.close()
-        return {"ok": False, "error": "There is no group at your station at the moment."}
-    group_id = st["current_group"]
-
-    # Add record to rewards
-    cur.execute("INSERT INTO rewards (group_id, station_id, points, bonus) VALUES (%s, %s, %s, %s);",
-                (group_id, station_id, decimal.Decimal(points), decimal.Decimal(bonus)))
-    # Update group score
-    cur.execute("UPDATE groups SET score = score + %s + %s WHERE id=%s;", (decimal.Decimal(points), decimal.Decimal(bonus), group_id))
-
-    conn.commit()
-    cur.close()
-    conn.close()
-    return {"ok": True, "group_id": group_id}
+    with db_cursor() as cur:
+        # Find group at this station (the reward must go to the visit the database knows)
+        cur.execute("SELECT current_group, number, visit_id FROM stations WHERE id=%s;", (station_id,))
+        st = cur.fetchone()
+        if not st or not st["current_group"]:
+            return {"ok": False, "error": "There is no group at your station at the moment."}
+        group_id = st["current_group"]
+        # Stations occupied before visits existed have none: no shortcut for them
+        key = ("reward", st["visit_id"], kind) if st["visit_id"] is not None else None
+        repeated = _recall_reward(key, amount) if key else None
+        if repeated:
+            return repeated
+
+        # Add record to rewards
+        cur.execute("""
+            INSERT INTO rewards (event_id, group_id, station_id, points, bonus, visit_id) VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT DO NOTHING RETURNING id;
+        """, (u["event_id"], group_id, station_id, decimal.Decimal(points), decimal.Decimal(bonus), st["visit_id"]))
+        if cur.fetchone() is None:
+            what = "points" if points else "a bonus"
+            return {"ok": False, "error": f"The group has already received {what} for this visit."}
+        _bump_group_summary(cur, group_id, decimal.Decimal(points) + decimal.Decimal(bonus), st["number"])
+        # Update group score
+        cur.execute("UPDATE groups SET score = score + %s + %s WHERE id=%s RETURNING group_number, score;",
+                    (decimal.Decimal(points), decimal.Decimal(bonus), group_id))
+        g = cur.fetchone()
+    leaderboards.get(u["event_id"]).set(group_id, g["group_number"], g["score"])
+    state.set_score(group_id, g["score"])
+    _wrote(("group", group_id), ("scores", u["event_id"]))
+    result = {"ok": True, "group_id": group_id, "amount": amount}
+    return remember(key, result) if key else result
+
+def _recall_reward(key, amount):
+    """The remembered reward of this visit; a different amount is refused like the database would."""
+    repeated = recall(key)
+    if repeated and repeated["amount"] != amount:
+        what = "points" if key[2] == "points" else "a bonus"
+        return {"ok": False, "error": f"The group has already received {what} for this visit."}
+    return repeated
 
-def manual_pay_group(group_number: str, points: float):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM groups WHERE group_number=%s;", (group_number,))
-    g = cur.fetchone()
-    if not g:
-        cur.close()
-        conn.close()
-        return {"ok": False, "error": "Group not found."}
-    group_id = g["id"]
-    cur.execute("INSERT INTO rewards (group_id, station_id, points, bonus) VALUES (%s, NULL, %s, %s);",
-                (group_id, decimal.Decimal(points), decimal.Decimal(0)))
-    cur.execute("UPDATE groups SET score = score + %s WHERE id=%s;", (decimal.Decimal(points), group_id))
-    conn.commit()
-    cur.close()
-    conn.close()
+def manual_pay_group(group_number: str, points: float, event_id: int = DEFAULT_EVENT_ID):
+    with db_cursor() as cur:
+        cur.execute("SELECT id FROM groups WHERE event_id=%s AND group_number=%s;", (event_id, group_number))
+        g = cur.fetchone()
+        if not g:
+            return {"ok": False, "error": "Group not found."}
+        group_id = g["id"]
+        cur.execute("INSERT INTO rewards (event_id, group_id, station_id, points, bonus) VALUES (%s, %s, NULL, %s, %s);",
+                    (event_id, group_id, decimal.Decimal(points), decimal.Decimal(0)))
+        _bump_group_summary(cur, group_id, decimal.Decimal(points), None)
+        cur.execute("UPDATE groups SET score = score + %s WHERE id=%s RETURNING score;", (decimal.Decimal(points), group_id))
+        score = cur.fetchone()["score"]
+    leaderboards.get(event_id).set(group_id, group_number, score)
+    state.set_score(group_id, score)
+    _wrote(("group", group_id), ("scores", event_id))
     return {"ok": True, "group_id": group_id}
 
+# --- Ledger / checkpoints ---
+# groups.score is a cache of the rewards ledger. A group's ledger total is its entry in the
+# latest checkpoint of its event plus the event's rewards inserted after that checkpoint.
+CHECKPOINT_LOCK_ID = 727003  # arbitrary constant for pg_try_advisory_xact_lock (with the event id)
+
+_LEDGER_SCORES_SQL = """
+    WITH cp AS (
+        SELECT id, last_reward_id FROM score_checkpoints
+        WHERE event_id = %(event_id)s AND created_at <= %(at)s ORDER BY id DESC LIMIT 1
+    ), delta AS (
+        SELECT group_id, SUM(points + COALESCE(bonus, 0)) AS amount FROM rewards
+        WHERE event_id = %(event_id)s AND id > COALESCE((SELECT last_reward_id FROM cp), 0) AND timestamp <= %(at)s
+        GROUP BY group_id
+    )
+    SELECT g.id AS group_id, g.event_id, g.group_number, g.score AS stored,
+           COALESCE(e.score, 0) + COALESCE(d.amount, 0) AS ledger
+    FROM groups g
+    LEFT JOIN score_checkpoint_entries e ON e.group_id = g.id AND e.checkpoint_id = (SELECT id FROM cp)
+    LEFT JOIN delta d ON d.group_id = g.id
+    WHERE g.event_id = %(event_id)s
+"""
+
+def create_score_checkpoint(event_id: int = DEFAULT_EVENT_ID):
+    """
+    Store the ledger total of every group of the event up to its newest reward.
+    Returns {"id", "last_reward_id", "groups"}, or None if there is nothing new
+    or another instance is creating a checkpoint of this event right now.
+    """
+    with db_cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s, %s);", (CHECKPOINT_LOCK_ID, event_id))
+        if not cur.fetchone()[0]:
+            return None
+        # Waits for in-flight reward inserts, so no lower id can commit after the checkpoint
+        cur.execute("LOCK TABLE rewards IN SHARE MODE;")
+        cur.execute("SELECT COALESCE(MAX(id), 0) AS last FROM rewards WHERE event_id = %s;", (event_id,))
+        last = cur.fetchone()["last"]
+        cur.execute("SELECT last_reward_id FROM score_checkpoints WHERE event_id = %s ORDER BY id DESC LIMIT 1;", (event_id,))
+        prev = cur.fetchone()
+        if prev and prev["last_reward_id"] == last:
+            return None
+        cur.execute(_LEDGER_SCORES_SQL, {"at": datetime.max, "event_id": event_id})
+        scores = cur.fetchall()
+        cur.execute("INSERT INTO score_checkpoints (event_id, last_reward_id, created_at) VALUES (%s, %s, clock_timestamp()) RETURNING id;",
+                    (event_id, last))
+        checkpoint_id = cur.fetchone()["id"]
+        execute_values(cur, "INSERT INTO score_checkpoint_entries (checkpoint_id, group_id, score) VALUES %s;",
+                       [(checkpoint_id, r["group_id"], r["ledger"]) for r in scores])
+    return {"id": checkpoint_id, "last_reward_id": last, "groups": len(scores)}
+
+def reconcile_scores(fix: bool = False, event_id: int = DEFAULT_EVENT_ID):
+    """
+    Compare groups.score of the event with the ledger. Returns [{"group_id", "group_number", "stored", "ledger"}]
+    for groups that drifted; with fix=True their scores are reset to the ledger value.
+    """
+    with db_cursor() as cur:
+        if fix:
+            # Freeze the ledger so the corrected score cannot miss a concurrent reward
+            cur.execute("LOCK TABLE rewards IN SHARE MODE;")
+        cur.execute(_LEDGER_SCORES_SQL + " AND g.score IS DISTINCT FROM COALESCE(e.score, 0) + COALESCE(d.amount, 0) ORDER BY g.group_number;",
+                    {"at": datetime.max, "event_id": event_id})
+        drift = [dict(r) for r in cur.fetchall()]
+        if fix:
+            for r in drift:
+                cur.execute("UPDATE groups SET score = %s WHERE id = %s;", (r["ledger"], r["group_id"]))
+    if fix:
+        for r in drift:
+            leaderboards.get(r["event_id"]).set(r["group_id"], r["group_number"], r["ledger"])
+            state.set_score(r["group_id"], r["ledger"])
+    return drift
+
+def get_leaderboard_at(at, limit=None, event_id: int = DEFAULT_EVENT_ID):
+    """[(group_number, score), ...] as of timestamp `at`, best first, from the nearest earlier checkpoint."""
+    with db_cursor() as cur:
+        cur.execute(_LEDGER_SCORES_SQL + """
+              AND (e.group_id IS NOT NULL OR d.group_id IS NOT NULL)
+            ORDER BY ledger DESC, g.group_number
+            LIMIT %(limit)s;
+        """, {"at": at, "limit": limit, "event_id": event_id})
+        return [(r["group_number"], r["ledger"]) for r in cur.fetchall()]
+
 # --- Queries / stats / history ---
-def get_group_score_and_history_by_tg(tg_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT group_id FROM users WHERE tg_id=%s AND role='curator';", (tg_id,))
-    u = cur.fetchone()
-    if not u:
-        cur.close()
-        conn.close()
+def get_group_score_and_history_by_tg(tg_id, before=None, after=None):
+    u = get_user_identity(tg_id)
+    if not u or u["role"] != "curator":
         return None
-    group_id = u["group_id"]
-    cur.execute("SELECT group_number, score FROM groups WHERE id=%s;", (group_id,))
-    g = cur.fetchone()
-    cur.execute("""
-        SELECT r.points, r.bonus, s.number as station_number, r.timestamp
-        FROM rewards r
-        LEFT JOIN stations s ON r.station_id = s.id
-        WHERE r.group_id = %s
-        ORDER BY r.timestamp DESC;
-    """, (group_id,))
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return {"group": g, "history": rows}
-
-def get_all_groups_stats():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT group_number, score FROM groups ORDER BY score DESC NULLS LAST;")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return rows
-
-def get_all_registered_user_tgids():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT tg_id FROM users;")
-    rows = [r["tg_id"] for r in cur.fetchall() if r["tg_id"]]
-    cur.close()
-    conn.close()
-    return rows
+    return get_group_score_and_history(u["group_id"], before, after)
+
+def get_group_score_and_history(group_id, before=None, after=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Group header (score + precomputed summary) and one page of reward history, newest first.
+    Pages are keyset-paginated on (timestamp, id): pass the (timestamp, id) of the last row
+    as `before` for older entries, or of the first row as `after` for newer ones.
+    """
+    with db_read_cursor(("group", group_id)) as cur:
+        cur.execute("""
+            SELECT g.group_number, g.score,
+                   COALESCE(gs.reward_count, 0) AS reward_count, gs.last_station_number, gs.last_reward_at
+            FROM groups g
+            LEFT JOIN group_summaries gs ON gs.group_id = g.id
+            WHERE g.id = %s;
+        """, (group_id,))
+        g = cur.fetchone()
+        if not g:
+            return None
+
+        if after is not None:
+            cond, order, key = "AND (r.timestamp, r.id) > (%s, %s)", "ASC", after
+        elif before is not None:
+            cond, order, key = "AND (r.timestamp, r.id) < (%s, %s)", "DESC", before
+        else:
+            cond, order, key = "", "DESC", ()
+        cur.execute(f"""
+            SELECT r.id, r.points, r.bonus, s.number as station_number, r.timestamp
+            FROM rewards r
+            LEFT JOIN stations s ON r.station_id = s.id
+            WHERE r.group_id = %s {cond}
+            ORDER BY r.timestamp {order}, r.id {order}
+            LIMIT %s;
+        """, (group_id, *key, limit + 1))
+        rows = cur.fetchall()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if after is not None:
+        rows.reverse()
+        has_newer, has_older = more, True
+    else:
+        has_newer, has_older = before is not None, more
+    return {"group": g, "history": rows, "has_older": has_older, "has_newer": has_newer}
+
+def rebuild_leaderboard():
+    """Reload the in-memory leaderboards of all events from the groups table."""
+    with db_cursor() as cur:
+        cur.execute("SELECT event_id, id, group_number, score FROM groups;")
+        leaderboards.load((r["event_id"], r["id"], r["group_number"], r["score"]) for r in cur.fetchall())
+
+def start_leaderboard_sync():
+    """Apply score changes committed by other bot instances (group_scores trigger)."""
+    def on_score(payload):
+        g = json.loads(payload)
+        leaderboards.get(g["event_id"]).set(g["id"], g["group_number"], decimal.Decimal(str(g["score"] or 0)))
+        _wrote(("group", g["id"]), ("scores", g["event_id"]))
+    listener.subscribe("group_scores", on_score)
+    listener.on_reconnect(rebuild_leaderboard)
+
+def get_all_groups_stats(event_id: int = DEFAULT_EVENT_ID):
+    if state.loaded:
+        return state.group_scores(event_id)
+    with db_read_cursor(("scores", event_id)) as cur:
+        cur.execute("SELECT group_number, score FROM groups WHERE event_id=%s ORDER BY score DESC NULLS LAST;", (event_id,))
+        return cur.fetchall()
+
+def get_all_registered_user_tgids(event_id: int = DEFAULT_EVENT_ID):
+    if state.loaded:
+        return state.user_tgids(event_id)
+    with db_read_cursor(("users", event_id), ("users", None)) as cur:
+        cur.execute("SELECT tg_id FROM users WHERE event_id=%s;", (event_id,))
+        return [r["tg_id"] for r in cur.fetchall() if r["tg_id"]]
 
 def get_curator_tg_by_group_id(group_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT tg_id FROM users WHERE role='curator' AND group_id=%s;", (group_id,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+    if state.loaded:
+        return state.curator_of(group_id)
+    with db_cursor() as cur:
+        cur.execute("SELECT tg_id FROM users WHERE role='curator' AND group_id=%s;", (group_id,))
+        row = cur.fetchone()
     return row["tg_id"] if row else None
 
+def get_organizer_tg_by_station_id(station_id):
+    if state.loaded:
+        return state.organizer_of(station_id)
+    with db_cursor() as cur:
+        cur.execute("SELECT tg_id FROM users WHERE role='organizer' AND station_id=%s;", (station_id,))
+        row = cur.fetchone()
+    return row["tg_id"] if row else None
+
+def set_free_station_alerts(tg_id: int, enabled: bool):
+    """Opt a curator in/out of "station N is free" pushes. Returns False for non-curators."""
+    with db_cursor() as cur:
+        cur.execute("UPDATE users SET notify_free=%s WHERE tg_id=%s AND role='curator';", (enabled, tg_id))
+        updated = cur.rowcount > 0
+    if updated:
+        state.update_user(tg_id, notify_free=enabled)
+    return updated
+
+def get_free_station_subscribers(event_id: int = DEFAULT_EVENT_ID):
+    """Opted-in curators of the event whose group is not at a station right now."""
+    if state.loaded:
+        return state.free_station_subscribers(event_id)
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT u.tg_id FROM users u
+            WHERE u.event_id = %s AND u.role = 'curator' AND u.notify_free
+              AND NOT EXISTS (SELECT 1 FROM stations s WHERE s.current_group = u.group_id);
+        """, (event_id,))
+        return [r["tg_id"] for r in cur.fetchall()]
+
 def get_organizer_station_by_tg(tg_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT station_id FROM users WHERE tg_id=%s AND role='organizer';", (tg_id,))
-    row = cur.fetchone()
-    if not row:
-        cur.close()
-        conn.close()
+    u = get_user_identity(tg_id)
+    if not u or u["role"] != "organizer":
         return None
-    station_id = row["station_id"]
-    cur.execute("SELECT * FROM stations WHERE id=%s;", (station_id,))
-    st = cur.fetchone()
-    cur.close()
-    conn.close()
-    return st
+    return get_station_by_id(u["station_id"])
+
+def get_station_by_id(station_id):
+    if state.loaded:
+        return state.station_by_id(station_id)
+    with db_cursor() as cur:
+        cur.execute("SELECT * FROM stations WHERE id=%s;", (station_id,))
+        return cur.fetchone()
+
+# --- Quest state ---
+def resync_state():
+    """Reconcile core.state with the database (see QuestState.reconcile). Returns the drifted records."""
+    drift = state.reconcile()
+    invalidate_free_stations()
+    return drift
+
+# --- Broadcasts ---
+def create_broadcast(text: str, tg_ids, progress_chat_id=None, progress_message_id=None):
+    """Store a broadcast job with one pending row per distinct recipient. Returns the job id."""
+    with db_cursor() as cur:
+        cur.execute(
+            "INSERT INTO broadcasts (text, progress_chat_id, progress_message_id) VALUES (%s, %s, %s) RETURNING id;",
+            (text, progress_chat_id, progress_message_id)
+        )
+        broadcast_id = cur.fetchone()["id"]
+        execute_values(
+            cur,
+            "INSERT INTO broadcast_recipients (broadcast_id, tg_id) VALUES %s ON CONFLICT DO NOTHING;",
+            [(broadcast_id, tg) for tg in set(tg_ids)]
+        )
+    return broadcast_id
+
+def claim_unfinished_broadcasts(stale_after: float):
+    """
+    Return running broadcasts not touched for `stale_after` seconds (their process died)
+    and mark them as taken over by this process.
+    """
+    with db_cursor() as cur:
+        cur.execute("""
+            UPDATE broadcasts SET updated_at = NOW()
+            WHERE status = 'running' AND updated_at < NOW() - make_interval(secs => %s)
+            RETURNING id, text, progress_chat_id, progress_message_id;
+        """, (stale_after,))
+        return cur.fetchall()
+
+def get_pending_broadcast_recipients(broadcast_id: int):
+    with db_cursor() as cur:
+        cur.execute(
+            "SELECT tg_id FROM broadcast_recipients WHERE broadcast_id=%s AND status='pending' ORDER BY tg_id;",
+            (broadcast_id,)
+        )
+        return [r["tg_id"] for r in cur.fetchall()]
+
+def get_broadcast_counts(broadcast_id: int):
+    with db_cursor() as cur:
+        cur.execute(
+            "SELECT status, COUNT(*) AS cnt FROM broadcast_recipients WHERE broadcast_id=%s GROUP BY status;",
+            (broadcast_id,)
+        )
+        counts = {"pending": 0, "sent": 0, "failed": 0}
+        counts.update({r["status"]: r["cnt"] for r in cur.fetchall()})
+    return counts
+
+def record_broadcast_results(broadcast_id: int, results):
+    """results: [(tg_id, status, error), ...] — also refreshes the job heartbeat."""
+    with db_cursor() as cur:
+        if results:
+            execute_values(cur, """
+                UPDATE broadcast_recipients AS r SET status = v.status, error = v.error
+                FROM (VALUES %s) AS v(broadcast_id, tg_id, status, error)
+                WHERE r.broadcast_id = v.broadcast_id AND r.tg_id = v.tg_id;
+            """, [(broadcast_id, tg, status, error) for tg, status, error in results],
+                template="(%s::int, %s::bigint, %s, %s)")
+        cur.execute("UPDATE broadcasts SET updated_at = NOW() WHERE id=%s;", (broadcast_id,))
+
+def finish_broadcast(broadcast_id: int):
+    with db_cursor() as cur:
+        cur.execute("UPDATE broadcasts SET status='done', updated_at=NOW() WHERE id=%s;", (broadcast_id,))
+
+# --- Update queue (ingress / worker mode) ---
+UPDATE_QUEUE_CHANNEL = "update_queue"
+
+def enqueue_update(update_id, chat_key, payload: dict):
+    """Store a raw Telegram update for the workers. Duplicate update_ids are ignored."""
+    with db_cursor() as cur:
+        cur.execute(
+            "INSERT INTO update_queue (update_id, chat_key, payload) VALUES (%s, %s, %s) ON CONFLICT (update_id) DO NOTHING;",
+            (update_id, chat_key, Json(payload))
+        )
+        cur.execute("SELECT pg_notify(%s, '');", (UPDATE_QUEUE_CHANNEL,))
+
+def claim_updates(worker_id: str, limit: int):
+    """
+    Claim up to `limit` updates, at most one per chat_key: only the oldest pending update of a
+    chat is eligible, and only while no other update of that chat is being processed.
+    This keeps per-chat order across all workers; SKIP LOCKED lets workers claim in parallel.
+    """
+    with db_cursor() as cur:
+        cur.execute("""
+            WITH next AS (
+                SELECT q.id FROM update_queue q
+                WHERE q.status = 'pending'
+                  AND NOT EXISTS (SELECT 1 FROM update_queue p
+                                  WHERE p.chat_key = q.chat_key AND p.status = 'processing')
+                  AND NOT EXISTS (SELECT 1 FROM update_queue e
+                                  WHERE e.chat_key = q.chat_key AND e.status = 'pending' AND e.id < q.id)
+                ORDER BY q.id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE update_queue u
+            SET status = 'processing', locked_by = %s, locked_at = NOW(), attempts = u.attempts + 1
+            FROM next WHERE u.id = next.id
+            RETURNING u.id, u.payload, u.attempts;
+        """, (limit, worker_id))
+        return cur.fetchall()
+
+def complete_update(queue_id: int):
+    with db_cursor() as cur:
+        cur.execute("DELETE FROM update_queue WHERE id=%s;", (queue_id,))
+
+def fail_update(queue_id: int, max_attempts: int):
+    """Put the update back for another try, or park it as failed (which unblocks its chat)."""
+    with db_cursor() as cur:
+        cur.execute("""
+            UPDATE update_queue
+            SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END, locked_by = NULL, locked_at = NULL
+            WHERE id=%s;
+        """, (max_attempts, queue_id))
+
+def heartbeat_updates(worker_id: str):
+    """Refresh the claims of a live worker, so long-running handlers are not requeued under it."""
+    with db_cursor() as cur:
+        cur.execute("UPDATE update_queue SET locked_at = NOW() WHERE locked_by = %s AND status = 'processing';", (worker_id,))
+        return cur.rowcount
+
+def requeue_stale_updates(stale_after: float):
+    """Release updates held by workers that died mid-processing (no heartbeat for `stale_after` seconds)."""
+    with db_cursor() as cur:
+        cur.execute("""
+            UPDATE update_queue SET status = 'pending', locked_by = NULL, locked_at = NULL
+            WHERE status = 'processing' AND locked_at < NOW() - make_interval(secs => %s);
+        """, (stale_after,))
+        return cur.rowcount
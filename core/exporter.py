@@ -0,0 +1,90 @@
+"""
+Streaming CSV export of quest results (used by /export and export_data.py).
+
+Every export covers one event. Rows are read through a named (server-side) cursor in batches of ITERSIZE and written
+straight to the output, so memory use does not depend on the size of the event.
+
+    rewards: every ledger entry in insertion order
+    groups:  final ranking with score and reward summary
+    visits:  one row per (group, station) with the time of the visit and the points received
+"""
+import csv
+import gzip
+import logging
+import tempfile
+from core.pool import get_pool
+from core.migrations import DEFAULT_EVENT_ID
+
+logger = logging.getLogger(__name__)
+
+ITERSIZE = 2000
+
+EXPORTS = {
+    "rewards": """
+        SELECT r.id, r.timestamp, g.group_number, s.number AS station_number, r.points, r.bonus
+        FROM rewards r
+        LEFT JOIN groups g ON g.id = r.group_id
+        LEFT JOIN stations s ON s.id = r.station_id
+        WHERE r.event_id = %(event_id)s
+        ORDER BY r.id;
+    """,
+    "groups": """
+        SELECT RANK() OVER (ORDER BY g.score DESC NULLS LAST) AS rank, g.group_number, g.score,
+               COALESCE(gs.reward_count, 0) AS reward_count, gs.last_station_number, gs.last_reward_at
+        FROM groups g
+        LEFT JOIN group_summaries gs ON gs.group_id = g.id
+        WHERE g.event_id = %(event_id)s
+        ORDER BY rank, g.group_number;
+    """,
+    "visits": """
+        SELECT g.group_number, s.number AS station_number, s.name AS station_name,
+               MIN(r.timestamp) AS first_reward_at, MAX(r.timestamp) AS last_reward_at,
+               SUM(r.points) AS points, SUM(COALESCE(r.bonus, 0)) AS bonus
+        FROM rewards r
+        JOIN groups g ON g.id = r.group_id
+        JOIN stations s ON s.id = r.station_id
+        WHERE r.event_id = %(event_id)s
+        GROUP BY g.group_number, s.number, s.name
+        ORDER BY g.group_number, first_reward_at;
+    """,
+}
+
+def write_export(kind: str, out, event_id: int = DEFAULT_EVENT_ID):
+    """Write one export as CSV (with header) to the text file `out`. Returns the number of rows."""
+    rows = 0
+    with get_pool().connection() as conn:
+        # A named cursor keeps the result on the server and fetches ITERSIZE rows per round trip
+        cur = conn.cursor(name=f"export_{kind}")
+        cur.itersize = ITERSIZE
+        try:
+            cur.execute(EXPORTS[kind], {"event_id": event_id})
+            writer = csv.writer(out)
+            header_written = False
+            for row in cur:
+                if not header_written:
+                    writer.writerow([col.name for col in cur.description])
+                    header_written = True
+                writer.writerow(list(row))
+                rows += 1
+            if not header_written and cur.description:
+                writer.writerow([col.name for col in cur.description])
+        finally:
+            cur.close()
+    return rows
+
+def export_filename(kind: str, compress: bool = False):
+    return f"{kind}.csv.gz" if compress else f"{kind}.csv"
+
+def export_to_path(kind: str, path: str, compress: bool = False, event_id: int = DEFAULT_EVENT_ID):
+    """Write one export to a file, gzip-compressed if requested. Returns the number of rows."""
+    opener = gzip.open if compress else open
+    with opener(path, "wt", encoding="utf-8", newline="") as out:
+        rows = write_export(kind, out, event_id)
+    logger.info(f"Exported {rows} {kind} rows to {path}")
+    return rows
+
+def export_to_tempfile(kind: str, compress: bool = False, event_id: int = DEFAULT_EVENT_ID):
+    """Export into a new temporary file (the caller deletes it). Returns (path, rows)."""
+    with tempfile.NamedTemporaryFile(prefix=f"export_{kind}_", suffix=".csv.gz" if compress else ".csv", delete=False) as f:
+        path = f.name
+    return path, export_to_path(kind, path, compress, event_id)
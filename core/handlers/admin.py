@@ -1,39 +1,44 @@
+import re
 from telegram import Update
 from telegram.ext import ContextTypes
-from core.database import set_setting, get_setting, get_station_by_number, get_all_registered_user_tgids, get_all_groups_stats, manual_pay_group, get_station_by_number
-from core.database import get_free_stations_with_location
+from core.async_db import set_setting, get_setting, get_station_by_number, get_all_registered_user_tgids, manual_pay_group, get_station_by_number
+from core.async_db import get_free_stations_with_location
+from core.async_db import create_score_checkpoint, reconcile_scores, get_leaderboard_at, export_to_tempfile
+from core.async_db import create_event, get_event_by_code, list_events, switch_event, resync_state
+from core.exporter import EXPORTS, export_filename
+import os
+from datetime import datetime
 from telegram.constants import ParseMode
 from core.utils.permissions import require_role
+from core.broadcast import start_broadcast
+from core.leaderboard import leaderboards
+from core.config import STATS_PAGE_SIZE
+from core.utils.keyboards import pager_keyboard
 
 @require_role("admin")
 async def open_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    set_setting("org_registration_open", "true")
+    await set_setting("org_registration_open", "true", context.identity["event_id"])
     await update.message.reply_text("Registration for organizers is now open!")
 
 @require_role("admin")
 async def close_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    set_setting("org_registration_open", "false")
+    await set_setting("org_registration_open", "false", context.identity["event_id"])
     await update.message.reply_text("Registration for organizers is now closed.")
 
 # Begin quest, acces to stations is allowed
 @require_role("admin")
 async def begin(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    set_setting("quest_started", "true")
-    set_setting("quest_ended", "false")
-    tgs = get_all_registered_user_tgids()
+    event_id = context.identity["event_id"]
+    await set_setting("quest_started", "true", event_id)
+    await set_setting("quest_ended", "false", event_id)
+    tgs = await get_all_registered_user_tgids(event_id)
     text = f"Quest has begun! Type /free to see the list of available stations and take the first one."
-    sent = 0
-    for tg in set(tgs):
-        try:
-            await context.bot.send_message(chat_id=tg, text=text)
-            sent += 1
-        except Exception:
-            pass
-    await update.message.reply_text(f"Quest started. Notifications sent to registered users ({sent}).")
+    await start_broadcast(context.application, text, tgs, update.effective_chat.id, title="Quest start notification")
+    await update.message.reply_text(f"Quest started. Notifying {len(set(tgs))} registered users, progress is shown above.")
 
 @require_role("admin")
 async def end(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    set_setting("quest_ended", "true")
+    await set_setting("quest_ended", "true", context.identity["event_id"])
     await update.message.reply_text("Quest ended. Taking new stations is no longer allowed.")
 
 @require_role("admin")
@@ -48,7 +53,7 @@ async def pay(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         await update.message.reply_text("N must be a number (can be fractional).")
         return
-    res = manual_pay_group(group, n)
+    res = await manual_pay_group(group, n, context.identity["event_id"])
     if not res["ok"]:
         await update.message.reply_text(f"Error: {res['error']}")
         return
@@ -60,26 +65,138 @@ async def mailing(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not text:
         await update.message.reply_text("Type /mailing <text> to send a message to all registered users.")
         return
-    tgs = get_all_registered_user_tgids()
-    sent = 0
-    for tg in set(tgs):
-        try:
-            await context.bot.send_message(chat_id=tg, text=text)
-            sent += 1
-        except Exception:
-            pass
-    await update.message.reply_text(f"Mailing completed. Sent to: {sent}")
+    tgs = await get_all_registered_user_tgids(context.identity["event_id"])
+    await start_broadcast(context.application, text, tgs, update.effective_chat.id)
+
+def render_stats_page(page: int, event_id: int):
+    """Text and pager keyboard for one /stats page, served from the event's in-memory leaderboard."""
+    leaderboard = leaderboards.get(event_id)
+    total = len(leaderboard)
+    pages = max(1, -(-total // STATS_PAGE_SIZE))
+    page = min(max(page, 1), pages)
+    lines = [f"{pos}. Group {number} — {float(score):.2f}" for pos, number, score in leaderboard.top(STATS_PAGE_SIZE, (page - 1) * STATS_PAGE_SIZE)]
+    if pages > 1:
+        lines.append(f"\nPage {page}/{pages}, {total} groups")
+    return "\n".join(lines), pager_keyboard("stats", page, pages)
 
 @require_role("admin")
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    rows = get_all_groups_stats()
-    if not rows:
+    event_id = context.identity["event_id"]
+    if not len(leaderboards.get(event_id)):
         await update.message.reply_text("There are no registered groups yet.")
         return
-    lines = []
-    pos = 1
-    for r in rows:
-        score = float(r["score"] or 0)
-        lines.append(f"{pos}. Group {r['group_number']} — {score:.2f}")
-        pos += 1
-    await update.message.reply_text("\n".join(lines))
+    page = 1
+    if context.args:
+        try:
+            page = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("Using: /stats [page]")
+            return
+    text, kb = render_stats_page(page, event_id)
+    await update.message.reply_text(text, reply_markup=kb)
+
+@require_role("admin")
+async def checkpoint(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    cp = await create_score_checkpoint(context.identity["event_id"])
+    if not cp:
+        await update.message.reply_text("No new rewards since the last checkpoint.")
+        return
+    await update.message.reply_text(f"Checkpoint {cp['id']} saved: {cp['groups']} groups, rewards up to #{cp['last_reward_id']}.")
+
+@require_role("admin")
+async def reconcile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    fix = bool(context.args) and context.args[0].lower() == "fix"
+    drift = await reconcile_scores(fix=fix, event_id=context.identity["event_id"])
+    if not drift:
+        await update.message.reply_text("All group scores match the rewards ledger.")
+        return
+    lines = [f"Group {r['group_number']}: stored {float(r['stored'] or 0):.2f}, ledger {float(r['ledger']):.2f}" for r in drift[:50]]
+    if len(drift) > 50:
+        lines.append(f"... and {len(drift) - 50} more")
+    head = f"Fixed {len(drift)} group scores:" if fix else f"{len(drift)} group scores differ from the ledger (/reconcile fix to correct):"
+    await update.message.reply_text(head + "\n" + "\n".join(lines))
+
+@require_role("admin")
+async def resync(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    drift = await resync_state()
+    if not drift:
+        await update.message.reply_text("The in-memory state matches the database.")
+        return
+    lines = [f"{r['label']}: {r['diff']}" for r in drift[:50]]
+    if len(drift) > 50:
+        lines.append(f"... and {len(drift) - 50} more")
+    await update.message.reply_text(f"Reloaded, {len(drift)} records had drifted:\n" + "\n".join(lines))
+
+@require_role("admin")
+async def standings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        at = datetime.fromisoformat(" ".join(context.args))
+    except ValueError:
+        await update.message.reply_text("Using: /standings <YYYY-MM-DD HH:MM>")
+        return
+    rows = await get_leaderboard_at(at, STATS_PAGE_SIZE, context.identity["event_id"])
+    if not rows:
+        await update.message.reply_text(f"No scores as of {at:%Y-%m-%d %H:%M}.")
+        return
+    lines = [f"{pos}. Group {number} — {float(score):.2f}" for pos, (number, score) in enumerate(rows, 1)]
+    await update.message.reply_text(f"Standings as of {at:%Y-%m-%d %H:%M}:\n" + "\n".join(lines))
+
+@require_role("admin")
+async def export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = [a.lower() for a in context.args]
+    compress = "gz" in args
+    kinds = [a for a in args if a != "gz"] or ["all"]
+    if kinds == ["all"]:
+        kinds = list(EXPORTS)
+    unknown = [k for k in kinds if k not in EXPORTS]
+    if unknown:
+        await update.message.reply_text(f"Using: /export [{'|'.join(EXPORTS)}|all] [gz]")
+        return
+    for kind in kinds:
+        path, rows = await export_to_tempfile(kind, compress, context.identity["event_id"])
+        try:
+            with open(path, "rb") as f:
+                await update.message.reply_document(f, filename=export_filename(kind, compress), caption=f"{kind}: {rows} rows")
+        finally:
+            os.unlink(path)
+
+EVENT_CODE_RE = re.compile(r"^[a-z0-9_-]{1,50}$")
+
+@require_role("admin")
+async def new_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = context.args
+    if not args or not EVENT_CODE_RE.match(args[0].lower()):
+        await update.message.reply_text("Using: /new_event <code> [title] (code: latin letters, digits, - and _)")
+        return
+    code = args[0].lower()
+    title = " ".join(args[1:]) or None
+    res = await create_event(code, title)
+    if not res["ok"]:
+        await update.message.reply_text(f"Error: {res['error']}")
+        return
+    await update.message.reply_text(
+        f"Event {code} created. Switch to it with /use_event {code}; curators and organizers "
+        f"join it with /reg_user <group> {code} and /reg_org <N> {code}."
+    )
+
+@require_role("admin")
+async def events(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    current = context.identity["event_id"]
+    lines = [
+        f"{'▶' if e['id'] == current else '•'} {e['code']}" + (f" — {e['title']}" if e["title"] else "")
+        + f" ({e['groups']} groups, {e['stations']} stations)"
+        for e in await list_events()
+    ]
+    await update.message.reply_text("Events:\n" + "\n".join(lines))
+
+@require_role("admin")
+async def use_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        await update.message.reply_text("Using: /use_event <code>")
+        return
+    event = await get_event_by_code(context.args[0].lower())
+    if not event:
+        await update.message.reply_text("Event not found. See /events.")
+        return
+    await switch_event(update.effective_user.id, event["id"])
+    await update.message.reply_text(f"Admin commands now apply to event {event['code']}.")
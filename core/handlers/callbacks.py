@@ -1,11 +1,18 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from core.database import take_station, get_station_by_number, release_station_by_number, get_user_role
+from core.async_db import take_station, release_station_by_number, get_user_identity, get_group_score_and_history_by_tg, get_free_stations_snapshot, get_user_event
 from core.utils.keyboards import free_stations_keyboard
+from core.handlers.admin import render_stats_page
+from core.handlers.common import render_free_page
+from core.handlers.curator import render_history
 import logging
+from datetime import datetime
+from core.metrics import track_callback
+from core.scheduler import announce_assignments, released_text
 
 logger = logging.getLogger(__name__)
 
+@track_callback
 async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -19,25 +26,67 @@ async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Curator took the station via button
         number = int(data.split(":", 1)[1])
         tg_id = query.from_user.id
-        res = take_station(tg_id, number)
+        res = await take_station(tg_id, number)
         if not res["ok"]:
             await query.edit_message_text(f"Failed to take the station: {res['error']}")
             return
-        station = get_station_by_number(number)
-        await query.edit_message_text(f"You have successfully taken station {number}.\nName: {station['name']}\nLocation: {station['location']}")
+        if res.get("repeated"):
+            # Double-tap: the message already shows the result
+            return
+        await query.edit_message_text(f"You have successfully taken station {number}.\nName: {res['name']}\nLocation: {res['location']}")
         return
 
     if data.startswith("free_station:"):
         number = int(data.split(":", 1)[1])
         # Check that the request is made by the organizer of this station
         tg_id = query.from_user.id
-        role = get_user_role(tg_id)
-        if role != "organizer":
+        ident = await get_user_identity(tg_id)
+        if not ident or ident["role"] != "organizer":
             await query.edit_message_text("Only the organizer can mark the station as free.")
             return
         # снимем отметку
-        release_station_by_number(number)
-        await query.edit_message_text(f"Station {number} marked as free.")
+        res = await release_station_by_number(number, ident["event_id"])
+        if res.get("repeated"):
+            return
+        await query.edit_message_text(released_text(number, res["assigned"]))
+        await announce_assignments(context.bot, res["assigned"])
+        return
+
+    if data == "noop":
+        return
+
+    if data.startswith("free:"):
+        event_id = await get_user_event(query.from_user.id)
+        version, free = await get_free_stations_snapshot(event_id)
+        if not free:
+            await query.edit_message_text("No free stations available.")
+            return
+        text, kb = render_free_page(version, free, int(data.split(":", 1)[1]), event_id)
+        await query.edit_message_text(text, reply_markup=kb)
+        return
+
+    if data.startswith("stats:"):
+        ident = await get_user_identity(query.from_user.id)
+        if not ident or ident["role"] != "admin":
+            await query.edit_message_text("Only the main organizer can view the statistics.")
+            return
+        text, kb = render_stats_page(int(data.split(":", 1)[1]), ident["event_id"])
+        await query.edit_message_text(text, reply_markup=kb)
+        return
+
+    if data.startswith("hist:"):
+        _, direction, rest = data.split(":", 2)
+        ts, reward_id = rest.rsplit(":", 1)
+        key = (datetime.fromisoformat(ts), int(reward_id))
+        if direction == "o":
+            page = await get_group_score_and_history_by_tg(query.from_user.id, before=key)
+        else:
+            page = await get_group_score_and_history_by_tg(query.from_user.id, after=key)
+        if not page:
+            await query.edit_message_text("You are not registered as a curator or an error occurred.")
+            return
+        text, kb = render_history(page)
+        await query.edit_message_text(text, reply_markup=kb)
         return
 
     # Unrecognized action
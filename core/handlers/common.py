@@ -1,11 +1,18 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from core.database import get_free_stations_with_location, get_user_role, get_setting
+from core.async_db import get_free_stations_snapshot, get_user_role, get_setting, get_user_event
 from core.utils.keyboards import station_free_button, free_stations_keyboard
+from core.metrics import track_command
+from core.config import FREE_STATIONS_PAGE_SIZE
 
+# Rendered /free pages of one version of the free-station lists: (event_id, page) -> (text, keyboard)
+_free_pages = {}
+_free_pages_version = None
+
+@track_command
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    role = get_user_role(user.id)
+    role = await get_user_role(user.id)
     if role == "curator":
         text = f"Hello, {user.first_name} — you are registered as a curator. Use /help."
     elif role == "organizer":
@@ -17,9 +24,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.reply_text(text)
 
+@track_command
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    role = get_user_role(user.id)
+    role = await get_user_role(user.id)
     base = [
         "/start — greeting",
         "/help — help",
@@ -27,17 +35,22 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]
     if role == "curator":
         base += [
-            "/reg_user <group_number_in_format_1XX> — register as curator",
+            "/reg_user <group_number_in_format_1XX> [event] — register as curator",
             "/info — information about your group",
-            "/take <N> — take station №N"
+            "/rank — your group's place in the ranking",
+            "/notify_free [on|off] — notify me when a station becomes free",
+            "/take <N> — take station №N",
+            "/next — take the next free station you have not visited, or queue for one",
+            "/wait <N> — queue for station №N",
+            "/unwait — leave all queues"
         ]
     if role == "organizer":
         base += [
-            "/reg_org <N> — register as organizer of station N",
+            "/reg_org <N> [event] — register as organizer of station N",
             "/station — information about your station",
             "/station_free <N> - release station N (if you are the organizer of this station)",
             "/reward <N> — give N main points (1..10)",
-            "/reward_bonus <X.Y> — give bonus (0.0..1.0)",
+            "/reward_bonus <X.Y> — give bonus (above 0.0, up to 1.0)",
             "Button 'Station free' — mark the station as free"
         ]
     if role == "admin":
@@ -48,14 +61,37 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "/end — finish the quest (stations cannot be taken)",
             "/pay <group_number> <N> — manually give N points",
             "/mailing <text> — send a message to everyone",
-            "/stats — full statistics by groups"
+            "/stats [page] — full statistics by groups",
+            "/standings <YYYY-MM-DD HH:MM> — ranking at a point in time",
+            "/checkpoint — save a score checkpoint now",
+            "/reconcile [fix] — check group scores against the rewards ledger",
+            "/resync — reload the in-memory quest state and show what had drifted",
+            "/export [rewards|groups|visits|all] [gz] — results as CSV files",
+            "/events — list events, /use_event <code> — switch the event admin commands apply to",
+            "/new_event <code> [title] — create another event"
         ]
     await update.message.reply_text("\n".join(base))
 
+def render_free_page(version, free, page: int, event_id: int):
+    """Text and keyboard for one /free page, memoized until the free-station list changes."""
+    global _free_pages_version
+    if version != _free_pages_version:
+        _free_pages.clear()
+        _free_pages_version = version
+    pages = max(1, -(-len(free) // FREE_STATIONS_PAGE_SIZE))
+    page = min(max(page, 1), pages)
+    if (event_id, page) not in _free_pages:
+        chunk = free[(page - 1) * FREE_STATIONS_PAGE_SIZE:page * FREE_STATIONS_PAGE_SIZE]
+        text = "Free stations:" if pages == 1 else f"Free stations ({len(free)}), page {page}/{pages}:"
+        _free_pages[event_id, page] = (text, free_stations_keyboard(chunk, page, pages))
+    return _free_pages[event_id, page]
+
+@track_command
 async def free_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    free = get_free_stations_with_location()
+    event_id = await get_user_event(update.effective_user.id)
+    version, free = await get_free_stations_snapshot(event_id)
     if not free:
         await update.message.reply_text("No free stations available.")
         return
-    kb = free_stations_keyboard(free)
-    await update.message.reply_text("Free stations:", reply_markup=kb)
+    text, kb = render_free_page(version, free, 1, event_id)
+    await update.message.reply_text(text, reply_markup=kb)
@@ -1,14 +1,20 @@
 import re
 from telegram import Update
 from telegram.ext import ContextTypes
-from core.database import register_curator, get_group_score_and_history_by_tg, take_station
+from core.async_db import register_curator, get_group_score_and_history, take_station, set_free_station_alerts, take_next_station, join_waitlist, leave_waitlist, get_event_by_code
 from core.utils.decorators import role_required
 from telegram import Update
 from telegram.ext import ContextTypes
 from core.utils.permissions import require_role
+from core.leaderboard import leaderboards
+from core.migrations import DEFAULT_EVENT_ID
+from core.utils.keyboards import history_keyboard
+from core.metrics import track_command
+from core.scheduler import assignment_text
 
 GROUP_RE = re.compile(r"^1\d{2}$")  # format 1XX
 
+@track_command
 async def reg_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     tg_id = update.effective_user.id
     args = context.args
@@ -19,22 +25,29 @@ async def reg_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not GROUP_RE.match(group_number):
         await update.message.reply_text("Invalid group number format. Expected format is 1XX (e.g. 101).")
         return
+    event_id = DEFAULT_EVENT_ID
+    if len(args) > 1:
+        event = await get_event_by_code(args[1].lower())
+        if not event:
+            await update.message.reply_text("Unknown event code.")
+            return
+        event_id = event["id"]
 
-    res = register_curator(tg_id, group_number)
+    res = await register_curator(tg_id, group_number, event_id)
     if not res["ok"]:
         await update.message.reply_text(f"Registration error: {res['error']}")
         return
     await update.message.reply_text(f"You are registered as curator of group {group_number}.")
 
-@require_role("curator", "admin")
-async def info(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    data = get_group_score_and_history_by_tg(update.effective_user.id)
-    if not data:
-        await update.message.reply_text("You are not registered as a curator or an error occurred.")
-        return
+def render_history(data):
+    """Text and older/newer keyboard for one page of get_group_score_and_history()."""
     g = data["group"]
     hist = data["history"]
-    out = [f"Group: {g['group_number']}\nCurrent score: {float(g['score']):.2f}", "\nScore history:"]
+    out = [f"Group: {g['group_number']}\nCurrent score: {float(g['score']):.2f}"]
+    if g["reward_count"]:
+        last = g["last_station_number"] if g["last_station_number"] else "—"
+        out.append(f"Rewards: {g['reward_count']}, last station: {last}")
+    out.append("\nScore history:")
     if not hist:
         out.append("— no scores yet.")
     else:
@@ -43,7 +56,18 @@ async def info(update: Update, context: ContextTypes.DEFAULT_TYPE):
             points = float(r["points"])
             bonus = float(r["bonus"] or 0)
             out.append(f"{r['timestamp']:%Y-%m-%d %H:%M} — {points} (+{bonus}) — station {station}")
-    await update.message.reply_text("\n".join(out))
+    kb = history_keyboard(hist[0], hist[-1], data["has_newer"], data["has_older"]) if hist else None
+    return "\n".join(out), kb
+
+@require_role("curator", "admin")
+async def info(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ident = context.identity
+    data = await get_group_score_and_history(ident["group_id"]) if ident["role"] == "curator" else None
+    if not data:
+        await update.message.reply_text("You are not registered as a curator or an error occurred.")
+        return
+    text, kb = render_history(data)
+    await update.message.reply_text(text, reply_markup=kb)
 
 @require_role("curator", "admin")
 async def take(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -57,8 +81,70 @@ async def take(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         await update.message.reply_text("Invalid station number.")
         return
-    res = take_station(tg_id, n)
+    res = await take_station(tg_id, n)
     if not res["ok"]:
         await update.message.reply_text(f"Failed to take the station: {res['error']}")
         return
-    await update.message.reply_text(f"You have successfully taken station {n}")
\ No newline at end of file
+    await update.message.reply_text(f"You have successfully taken station {n}")
+
+@require_role("curator")
+async def rank(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    group_id = context.identity["group_id"]
+    leaderboard = leaderboards.get(context.identity["event_id"])
+    pos = leaderboard.rank(group_id)
+    if pos is None:
+        await update.message.reply_text("Your group is not in the ranking yet.")
+        return
+    score = float(leaderboard.score(group_id))
+    await update.message.reply_text(f"Your group is #{pos} of {len(leaderboard)} with {score:.2f} points.")
+
+@require_role("curator")
+async def notify_free(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    arg = context.args[0].lower() if context.args else "on"
+    if arg not in ("on", "off"):
+        await update.message.reply_text("Using: /notify_free [on|off]")
+        return
+    await set_free_station_alerts(update.effective_user.id, arg == "on")
+    if arg == "on":
+        await update.message.reply_text("You will be notified when a station becomes free (while your group is not at a station).")
+    else:
+        await update.message.reply_text("Free station notifications are off.")
+
+@require_role("curator")
+async def next_station(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    res = await take_next_station(update.effective_user.id)
+    if not res["ok"]:
+        await update.message.reply_text(f"Error: {res['error']}")
+        return
+    if "assigned" in res:
+        await update.message.reply_text(assignment_text(res["assigned"]))
+        return
+    await update.message.reply_text(
+        f"No station is available for your group right now. You are #{res['position']} in the queue "
+        "and will get the next suitable station as soon as it is freed."
+    )
+
+@require_role("curator")
+async def wait(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = context.args
+    if not args:
+        await update.message.reply_text("Please specify the station number: /wait 3")
+        return
+    try:
+        n = int(args[0])
+    except ValueError:
+        await update.message.reply_text("Invalid station number.")
+        return
+    res = await join_waitlist(update.effective_user.id, n)
+    if not res["ok"]:
+        await update.message.reply_text(f"Error: {res['error']}")
+        return
+    if "assigned" in res:
+        await update.message.reply_text(assignment_text(res["assigned"]))
+        return
+    await update.message.reply_text(f"You are #{res['position']} in the queue for station {n}. It will be assigned to you when it is freed.")
+
+@require_role("curator")
+async def unwait(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    n = await leave_waitlist(update.effective_user.id)
+    await update.message.reply_text("You have left all queues." if n else "You are not in any queue.")
@@ -1,13 +1,19 @@
+import logging
 from telegram import Update
 from telegram.ext import ContextTypes
-from core.database import register_organizer, get_organizer_station_by_tg, reward_current_group_by_organizer, release_station_by_number, get_station_by_number, get_user_by_tg
+from core.async_db import register_organizer, get_station_by_id, reward_current_group_by_organizer, release_station_by_number, get_station_by_number, get_user_by_tg, get_group_by_id, get_event_by_code
 from core.utils.decorators import role_required
 from core.utils.keyboards import station_free_button
 from telegram import Update
 from telegram.ext import ContextTypes
 from core.utils.permissions import require_role
-from core.database import get_connection
+from core.metrics import track_command
+from core.scheduler import announce_assignments, released_text
+from core.migrations import DEFAULT_EVENT_ID
 
+logger = logging.getLogger(__name__)
+
+@track_command
 async def reg_org(update: Update, context: ContextTypes.DEFAULT_TYPE):
     args = context.args
     if not args:
@@ -18,7 +24,14 @@ async def reg_org(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         await update.message.reply_text("Invalid station number.")
         return
-    res = register_organizer(update.effective_user.id, n)
+    event_id = DEFAULT_EVENT_ID
+    if len(args) > 1:
+        event = await get_event_by_code(args[1].lower())
+        if not event:
+            await update.message.reply_text("Unknown event code.")
+            return
+        event_id = event["id"]
+    res = await register_organizer(update.effective_user.id, n, event_id)
     if not res["ok"]:
         await update.message.reply_text(f"Registration error: {res['error']}")
         return
@@ -26,7 +39,8 @@ async def reg_org(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 @require_role("organizer", "admin")
 async def station(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    st = get_organizer_station_by_tg(update.effective_user.id)
+    ident = context.identity
+    st = await get_station_by_id(ident["station_id"]) if ident["role"] == "organizer" else None
     if not st:
         await update.message.reply_text("You are not registered as organizer or station not found.")
         return
@@ -36,15 +50,10 @@ async def station(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # instead of ID, get group_number from groups table
     group_text = "No group is currently present"
     if st["current_group"]:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT group_number FROM groups WHERE id=%s;", (st["current_group"],))
-        g = cur.fetchone()
-        cur.close()
-        conn.close()
+        g = await get_group_by_id(st["current_group"])
         if g:
             group_text = f"Group: {g['group_number']}"
-    print(f'st={st}')
+    logger.debug(f"station: {dict(st)}")
     text = (
         f"Number: {st['number']}\n"
         f"Name: {st['name']}\n"
@@ -71,30 +80,36 @@ async def reward(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not (1 <= n <= 10):
         await update.message.reply_text("Points must be between 1 and 10.")
         return
-    res = reward_current_group_by_organizer(update.effective_user.id, n, 0)
+    res = await reward_current_group_by_organizer(update.effective_user.id, n, 0)
     if not res["ok"]:
         await update.message.reply_text(f"Error: {res['error']}")
         return
+    if res.get("repeated"):
+        await update.message.reply_text(f"The current group has already been rewarded with {n} points for this visit.")
+        return
     await update.message.reply_text(f"{n} points have been awarded to the current group (id={res['group_id']}).")
 
 @require_role("organizer", "admin")
 async def reward_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE):
     args = context.args
     if not args:
-        await update.message.reply_text("Please specify a bonus (0.0..1.0): /reward_bonus 0.5")
+        await update.message.reply_text("Please specify a bonus (above 0.0, up to 1.0): /reward_bonus 0.5")
         return
     try:
         v = float(args[0])
     except ValueError:
         await update.message.reply_text("Invalid number format.")
         return
-    if not (0.0 <= v <= 1.0):
-        await update.message.reply_text("Bonus must be between 0.0 and 1.0.")
+    if not (0.0 < v <= 1.0):
+        await update.message.reply_text("Bonus must be greater than 0.0 and at most 1.0.")
         return
-    res = reward_current_group_by_organizer(update.effective_user.id, 0, v)
+    res = await reward_current_group_by_organizer(update.effective_user.id, 0, v)
     if not res["ok"]:
         await update.message.reply_text(f"Error: {res['error']}")
         return
+    if res.get("repeated"):
+        await update.message.reply_text(f"The current group has already received bonus {v} for this visit.")
+        return
     await update.message.reply_text(f"Bonus {v} has been awarded to the current group (id={res['group_id']}).")
 
 @require_role("organizer", "admin")
@@ -110,9 +125,12 @@ async def station_free_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Invalid station number.")
         return
     # check that this is your station
-    st = get_organizer_station_by_tg(update.effective_user.id)
+    ident = context.identity
+    st = await get_station_by_id(ident["station_id"]) if ident["role"] == "organizer" else None
     if not st or st["number"] != n:
         await update.message.reply_text("You are not the organizer of this station.")
         return
-    release_station_by_number(n)
-    await update.message.reply_text(f"Station {n} has been marked as free.")
+    res = await release_station_by_number(n, ident["event_id"])
+    await update.message.reply_text(released_text(n, res["assigned"]))
+    if not res.get("repeated"):
+        await announce_assignments(context.bot, res["assigned"])
@@ -0,0 +1,49 @@
+"""
+Short-lived memory of completed requests, so repeats are answered without touching Postgres.
+
+- Redelivered updates (same update_id, e.g. a webhook retry) are dropped before any handler runs.
+- take_station, release_station_by_number and reward_current_group_by_organizer remember their
+  successful results for IDEMPOTENCY_TTL seconds under a key of the logical operation
+  (group + station, event + station, visit + reward kind). A double-tap or a retried command
+  gets the remembered result back, marked with "repeated": True, so handlers can skip side effects
+  (editing the message again, announcing assignments again).
+
+IDEMPOTENCY_TTL=0 turns the memory off.
+
+The memory is per process and only a shortcut: the database stays the authority (conditional
+UPDATEs for stations, one reward of each kind per visit through unique indexes on rewards).
+"""
+from telegram.ext import ApplicationHandlerStop
+from core.config import IDEMPOTENCY_TTL, IDEMPOTENCY_CACHE_SIZE
+from core.metrics import register, Counter
+from core.utils.cache import TTLCache
+
+_results = TTLCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+_updates = TTLCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+
+REPLAYS = register(Counter("bot_idempotent_replays_total", "Requests answered from the idempotency cache", ("kind",)))
+
+def recall(key):
+    """The remembered result for `key` (marked as repeated), or None."""
+    result = _results.get(key)
+    if result is None:
+        return None
+    REPLAYS.inc(key[0])
+    return {**result, "repeated": True}
+
+def remember(key, result):
+    if IDEMPOTENCY_TTL > 0:
+        _results.set(key, result)
+    return result
+
+def forget(*keys):
+    for key in keys:
+        _results.pop(key)
+
+async def drop_repeated_updates(update, context):
+    """TypeHandler callback (group -1): stop processing of an update_id seen a moment ago."""
+    if _updates.get(update.update_id):
+        REPLAYS.inc("update")
+        raise ApplicationHandlerStop
+    if IDEMPOTENCY_TTL > 0:
+        _updates.set(update.update_id, True)
@@ -0,0 +1,132 @@
+"""
+Bulk import of stations and groups from CSV (used by import_data.py).
+
+The file is streamed into a temporary staging table with COPY, validated in SQL and
+upserted into the real table of one event with a single INSERT ... ON CONFLICT, all in one transaction.
+Nothing is written in dry-run mode or when any row is invalid; the report says what
+would be (or was) inserted and updated.
+
+CSV layouts (with a header row):
+    stations: number,name,location
+    groups:   group_number
+"""
+import logging
+import psycopg2
+from core.pool import get_pool
+from core.migrations import DEFAULT_EVENT_ID
+
+logger = logging.getLogger(__name__)
+
+MAX_REPORTED_ERRORS = 50
+
+STATIONS = {
+    "staging": "CREATE TEMP TABLE import_stations (line SERIAL, number TEXT, name TEXT, location TEXT) ON COMMIT DROP;",
+    "copy": "COPY import_stations (number, name, location) FROM STDIN WITH (FORMAT csv, HEADER true);",
+    "errors": """
+        SELECT line, error FROM (
+            SELECT line, CASE
+                WHEN number IS NULL OR number !~ '^\\s*[0-9]{1,9}\\s*$' THEN 'number must be a positive integer'
+                WHEN COALESCE(trim(name), '') = '' THEN 'name is empty'
+                WHEN length(trim(name)) > 200 THEN 'name is longer than 200 characters'
+                WHEN COUNT(*) OVER (PARTITION BY trim(number)) > 1 THEN 'station number appears more than once'
+            END AS error
+            FROM import_stations
+        ) checked
+        WHERE error IS NOT NULL
+        ORDER BY line;
+    """,
+    "plan": """
+        SELECT COUNT(*) AS rows,
+               COUNT(*) FILTER (WHERE s.id IS NULL) AS inserted,
+               COUNT(*) FILTER (WHERE s.id IS NOT NULL AND (s.name, s.location)
+                                IS DISTINCT FROM (trim(i.name), NULLIF(trim(i.location), ''))) AS updated
+        FROM import_stations i
+        LEFT JOIN stations s ON s.event_id = %(event_id)s AND s.number = trim(i.number)::int;
+    """,
+    "upsert": """
+        INSERT INTO stations (event_id, number, name, location)
+        SELECT %(event_id)s, trim(number)::int, trim(name), NULLIF(trim(location), '') FROM import_stations
+        ON CONFLICT (event_id, number) DO UPDATE SET name = EXCLUDED.name, location = EXCLUDED.location
+        WHERE (stations.name, stations.location) IS DISTINCT FROM (EXCLUDED.name, EXCLUDED.location);
+    """,
+}
+
+GROUPS = {
+    "staging": "CREATE TEMP TABLE import_groups (line SERIAL, group_number TEXT) ON COMMIT DROP;",
+    "copy": "COPY import_groups (group_number) FROM STDIN WITH (FORMAT csv, HEADER true);",
+    # Same format /reg_user accepts (1XX)
+    "errors": """
+        SELECT line, error FROM (
+            SELECT line, CASE
+                WHEN group_number IS NULL OR trim(group_number) !~ '^1[0-9]{2}$' THEN 'group number must have the format 1XX'
+                WHEN COUNT(*) OVER (PARTITION BY trim(group_number)) > 1 THEN 'group number appears more than once'
+            END AS error
+            FROM import_groups
+        ) checked
+        WHERE error IS NOT NULL
+        ORDER BY line;
+    """,
+    "plan": """
+        SELECT COUNT(*) AS rows, COUNT(*) FILTER (WHERE g.id IS NULL) AS inserted, 0 AS updated
+        FROM import_groups i
+        LEFT JOIN groups g ON g.event_id = %(event_id)s AND g.group_number = trim(i.group_number);
+    """,
+    "upsert": """
+        INSERT INTO groups (event_id, group_number)
+        SELECT %(event_id)s, trim(group_number) FROM import_groups
+        ON CONFLICT (event_id, group_number) DO NOTHING;
+    """,
+}
+
+KINDS = {"stations": STATIONS, "groups": GROUPS}
+
+def import_csv(kind: str, fileobj, dry_run: bool = False, event_id: int = DEFAULT_EVENT_ID):
+    """
+    Import one CSV file into an event. Returns a report dict:
+    {"kind", "rows", "inserted", "updated", "errors": [(line, message), ...], "error_count", "applied"}
+    """
+    sql = KINDS[kind]
+    report = {"kind": kind, "rows": 0, "inserted": 0, "updated": 0, "errors": [], "error_count": 0, "applied": False}
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(sql["staging"])
+            try:
+                cur.copy_expert(sql["copy"], fileobj)
+            except psycopg2.DataError as e:
+                # Malformed CSV (wrong column count, bad quoting): COPY names the line itself
+                report["errors"] = [(None, (e.diag.context or str(e)).strip())]
+                report["error_count"] = 1
+                return report
+            cur.execute(sql["errors"])
+            errors = cur.fetchall()
+            # +1: the header is line 1 of the file
+            report["errors"] = [(r["line"] + 1, r["error"]) for r in errors[:MAX_REPORTED_ERRORS]]
+            report["error_count"] = len(errors)
+            if errors:
+                return report
+            cur.execute(sql["plan"], {"event_id": event_id})
+            plan = cur.fetchone()
+            report.update(rows=plan["rows"], inserted=plan["inserted"], updated=plan["updated"])
+            if dry_run:
+                return report
+            cur.execute(sql["upsert"], {"event_id": event_id})
+            conn.commit()
+            report["applied"] = True
+            logger.info(f"Imported {kind}: {plan['inserted']} new, {plan['updated']} updated")
+        finally:
+            # Uncommitted work (dry run, validation errors) is rolled back when the connection is returned
+            cur.close()
+    return report
+
+def format_report(report):
+    lines = [f"{report['kind']}: {report['rows']} rows — {report['inserted']} new, {report['updated']} updated"]
+    if report["error_count"]:
+        lines = [f"{report['kind']}: {report['error_count']} invalid rows, nothing imported"]
+        for line, message in report["errors"]:
+            lines.append(f"  line {line}: {message}" if line else f"  {message}")
+        if report["error_count"] > len(report["errors"]):
+            lines.append(f"  ... and {report['error_count'] - len(report['errors'])} more")
+    elif not report["applied"]:
+        lines.append("Dry run: nothing was written.")
+    return "\n".join(lines)
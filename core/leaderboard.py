@@ -0,0 +1,82 @@
+"""
+In-memory ranked leaderboard.
+
+Rebuilt from Postgres at startup and updated by the scoring helpers in core.database
+after each committed reward, so /stats and /rank never scan the groups table.
+Rank lookups and top-K slices are O(log n) on a SortedList. Every event has its own board.
+"""
+import threading
+from decimal import Decimal
+from sortedcontainers import SortedList
+
+class Leaderboard:
+    def __init__(self):
+        self._entries = {}  # group_id -> (score, group_number)
+        self._ranked = SortedList()  # (-score, group_number, group_id)
+        self._lock = threading.Lock()
+
+    def load(self, rows):
+        """rows: iterable of (group_id, group_number, score)."""
+        with self._lock:
+            self._entries = {gid: (Decimal(score or 0), number) for gid, number, score in rows}
+            self._ranked = SortedList((-score, number, gid) for gid, (score, number) in self._entries.items())
+
+    def set(self, group_id, group_number, score):
+        score = Decimal(score or 0)
+        with self._lock:
+            old = self._entries.get(group_id)
+            if old is not None:
+                self._ranked.remove((-old[0], old[1], group_id))
+            self._entries[group_id] = (score, group_number)
+            self._ranked.add((-score, group_number, group_id))
+
+    def rank(self, group_id):
+        """1-based position of the group, or None if unknown."""
+        with self._lock:
+            entry = self._entries.get(group_id)
+            if entry is None:
+                return None
+            return self._ranked.index((-entry[0], entry[1], group_id)) + 1
+
+    def score(self, group_id):
+        entry = self._entries.get(group_id)
+        return entry[0] if entry else None
+
+    def top(self, k, offset=0):
+        """[(rank, group_number, score), ...] for positions offset+1 .. offset+k."""
+        with self._lock:
+            return [
+                (offset + i + 1, number, -neg_score)
+                for i, (neg_score, number, _) in enumerate(self._ranked[offset:offset + k])
+            ]
+
+    def __len__(self):
+        return len(self._ranked)
+
+class Leaderboards:
+    """Leaderboard per event, created on first use."""
+
+    def __init__(self):
+        self._boards = {}
+        self._lock = threading.Lock()
+
+    def get(self, event_id) -> Leaderboard:
+        with self._lock:
+            board = self._boards.get(event_id)
+            if board is None:
+                board = self._boards[event_id] = Leaderboard()
+            return board
+
+    def load(self, rows):
+        """rows: iterable of (event_id, group_id, group_number, score)."""
+        per_event = {}
+        for event_id, gid, number, score in rows:
+            per_event.setdefault(event_id, []).append((gid, number, score))
+        with self._lock:
+            gone = set(self._boards) - set(per_event)
+        for event_id in gone:
+            self.get(event_id).load([])
+        for event_id, entries in per_event.items():
+            self.get(event_id).load(entries)
+
+leaderboards = Leaderboards()
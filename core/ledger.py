@@ -0,0 +1,42 @@
+"""
+Periodic score checkpoints of the rewards ledger (see the Ledger section of core.database).
+
+Every instance runs the loop over all events; create_score_checkpoint() takes an advisory lock
+per event and skips when nothing changed, so with several workers a checkpoint is still written
+only once.
+"""
+import asyncio
+import logging
+from core import async_db
+from core.config import SCORE_CHECKPOINT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+_task = None
+
+async def _checkpoint_loop(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            events = await async_db.list_events()
+        except Exception:
+            logger.exception("Score checkpoint failed")
+            continue
+        for event in events:
+            try:
+                cp = await async_db.create_score_checkpoint(event["id"])
+            except Exception:
+                logger.exception(f"Score checkpoint of event {event['id']} failed")
+                continue
+            if cp:
+                logger.info(f"Score checkpoint {cp['id']} of event {event['id']} up to reward {cp['last_reward_id']} ({cp['groups']} groups)")
+
+async def start_checkpoints(application=None):
+    """Start the periodic checkpoint job (call from Application.post_init)."""
+    global _task
+    if SCORE_CHECKPOINT_INTERVAL > 0:
+        _task = asyncio.create_task(_checkpoint_loop(SCORE_CHECKPOINT_INTERVAL))
+
+async def stop_checkpoints(application=None):
+    if _task is not None:
+        _task.cancel()
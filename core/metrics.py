@@ -0,0 +1,204 @@
+"""
+Minimal Prometheus-format metrics.
+
+- per-command / per-callback latency histograms (track_command, track_callback; require_role
+  applies track_command automatically)
+- DB queries and DB time per handled update (counted by MeteredCursor, the pool's cursor class)
+- pool connection gauges and counters, and outbound Telegram API latency (MeteredRequest)
+
+start_metrics_server() exposes everything on http://METRICS_LISTEN:METRICS_PORT/metrics.
+"""
+import time
+import logging
+import threading
+import contextvars
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from psycopg2.extras import DictCursor
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+def _labels_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v).replace(chr(34), "")}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+class Counter:
+    def __init__(self, name, doc, labels=()):
+        self.name, self.doc, self.labels = name, doc, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for lv, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels_text(self.labels, lv)} {v}")
+        return lines
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time."""
+    type = "gauge"
+
+    def __init__(self, name, doc, read):
+        self.name, self.doc, self.read = name, doc, read
+
+    def render(self):
+        value = self.read()
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.type}"]
+        if value is not None:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+class CallbackCounter(Gauge):
+    """Counter whose running total is kept elsewhere (e.g. by the pool) and read at scrape time."""
+    type = "counter"
+
+class Histogram:
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.doc, self.labels, self.buckets = name, doc, tuple(labels), tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            s = self._series.setdefault(label_values, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for lv, s in sorted(self._series.items()):
+                for bound, cnt in zip(self.buckets, s):
+                    lines.append(f"{self.name}_bucket{_labels_text(self.labels + ('le',), lv + (bound,))} {cnt}")
+                lines.append(f"{self.name}_bucket{_labels_text(self.labels + ('le',), lv + ('+Inf',))} {s[-1]}")
+                lines.append(f"{self.name}_sum{_labels_text(self.labels, lv)} {s[-2]}")
+                lines.append(f"{self.name}_count{_labels_text(self.labels, lv)} {s[-1]}")
+        return lines
+
+REGISTRY = []
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+def render_all():
+    lines = []
+    for metric in REGISTRY:
+        try:
+            lines.extend(metric.render())
+        except Exception:
+            logger.exception(f"Failed to render metric {metric.name}")
+    return "\n".join(lines) + "\n"
+
+HANDLER_LATENCY = register(Histogram("bot_handler_seconds", "Handler latency", ("kind", "name")))
+HANDLER_ERRORS = register(Counter("bot_handler_errors_total", "Handlers that raised", ("kind", "name")))
+UPDATE_DB_QUERIES = register(Histogram("bot_update_db_queries", "DB queries per handled update", ("kind", "name"), COUNT_BUCKETS))
+UPDATE_DB_SECONDS = register(Histogram("bot_update_db_seconds", "DB time per handled update", ("kind", "name")))
+DB_QUERY_SECONDS = register(Histogram("db_query_seconds", "Latency of single DB statements"))
+TELEGRAM_API_SECONDS = register(Histogram("telegram_api_seconds", "Outbound Telegram Bot API call latency", ("method",)))
+
+# --- Per-update DB accounting ---
+class UpdateStats:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+_update_stats = contextvars.ContextVar("update_stats", default=None)
+
+class MeteredCursor(DictCursor):
+    """DictCursor that times every statement (core.async_db propagates the context into DB threads)."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_QUERY_SECONDS.observe(elapsed)
+            stats = _update_stats.get()
+            if stats is not None:
+                stats.queries += 1
+                stats.db_time += elapsed
+
+def track_handler(kind, name):
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(update, context, *args, **kwargs):
+            return await _tracked(kind, name, func, update, context, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def track_command(func):
+    return track_handler("command", func.__name__)(func)
+
+def track_callback(func):
+    """Like track_handler, labelled by the callback_data prefix (take, free_station, stats, ...)."""
+    @wraps(func)
+    async def wrapper(update, context, *args, **kwargs):
+        data = update.callback_query.data if update.callback_query else ""
+        name = (data or "").split(":", 1)[0] or "empty"
+        return await _tracked("callback", name, func, update, context, *args, **kwargs)
+    return wrapper
+
+async def _tracked(kind, name, func, update, context, *args, **kwargs):
+    stats = UpdateStats()
+    token = _update_stats.set(stats)
+    started = time.perf_counter()
+    try:
+        return await func(update, context, *args, **kwargs)
+    except Exception:
+        HANDLER_ERRORS.inc(kind, name)
+        raise
+    finally:
+        HANDLER_LATENCY.observe(time.perf_counter() - started, kind, name)
+        UPDATE_DB_QUERIES.observe(stats.queries, kind, name)
+        UPDATE_DB_SECONDS.observe(stats.db_time, kind, name)
+        _update_stats.reset(token)
+
+# --- Outbound Telegram API ---
+class MeteredRequest(HTTPXRequest):
+    async def do_request(self, url, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            TELEGRAM_API_SECONDS.observe(time.perf_counter() - started, url.rsplit("/", 1)[-1])
+
+# --- HTTP endpoint ---
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render_all().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(listen, port):
+    server = ThreadingHTTPServer((listen, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Metrics endpoint on http://{listen}:{port}/metrics")
+    return server
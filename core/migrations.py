@@ -0,0 +1,552 @@
+"""
+Versioned schema migrations.
+
+Applied versions are recorded in schema_version; apply_migrations() runs only the
+pending ones, each in its own transaction, under an advisory lock so that several
+bot instances starting at once do not race. To change the schema, append a new
+(version, description, step) entry to MIGRATIONS — never edit an applied one.
+A step is either a list of SQL statements or a function taking a cursor.
+"""
+import logging
+from core.pool import get_pool
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_LOCK_ID = 727001  # arbitrary constant for pg_advisory_lock
+DEFAULT_EVENT_ID = 1  # existing data and single-quest deployments live in this event
+
+# Sample stations data specially for my university
+SAMPLE_STATIONS = [
+    (1, "Station 1", "329"),
+    (2, "Station 2", "above room 101"),
+    (3, "Station 3", "near the tennis tables"),
+    (4, "Station 4", "253"),
+    (5, "Station 5", "above the cafeteria"),
+    (6, "Station 6", "hall E"),
+    (7, "Station 7", "210D"),
+    (8, "Station 8", "235"),
+    (9, "Station 9", "hall E"),
+    (10, "Station 10", "217"),
+    (11, "Station 11", "hall E"),
+    (12, "Station 12", "212D"),
+    (13, "Station 13", "bank (2nd floor)"),
+    (14, "Station 14", "2nd floor above the entrance (windows facing math-mech)"),
+    (15, "Station 15", "248"),
+    (16, "Station 16", "240"),
+    (17, "Station 17", "outside"),
+    (18, "Station 18", "outside"),
+]
+
+# IF NOT EXISTS keeps the baseline safe for databases created before migrations existed
+BASELINE = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        tg_id BIGINT UNIQUE NOT NULL,
+        role VARCHAR(20) NOT NULL, -- curator, organizer, admin
+        group_id INT,
+        station_id INT
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS groups (
+        id SERIAL PRIMARY KEY,
+        group_number VARCHAR(20) UNIQUE NOT NULL,
+        score NUMERIC DEFAULT 0
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stations (
+        id SERIAL PRIMARY KEY,
+        number INT UNIQUE NOT NULL,
+        name VARCHAR(200),
+        location TEXT,
+        is_free BOOLEAN DEFAULT TRUE,
+        current_group INT REFERENCES groups(id)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS rewards (
+        id SERIAL PRIMARY KEY,
+        group_id INT REFERENCES groups(id),
+        station_id INT REFERENCES stations(id),
+        points NUMERIC NOT NULL,
+        bonus NUMERIC DEFAULT 0,
+        timestamp TIMESTAMP DEFAULT NOW()
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS settings (
+        key VARCHAR(100) PRIMARY KEY,
+        value TEXT
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id SERIAL PRIMARY KEY,
+        text TEXT NOT NULL,
+        status VARCHAR(20) NOT NULL DEFAULT 'running', -- running, done
+        progress_chat_id BIGINT,
+        progress_message_id BIGINT,
+        created_at TIMESTAMP DEFAULT NOW(),
+        updated_at TIMESTAMP DEFAULT NOW()
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS broadcast_recipients (
+        broadcast_id INT REFERENCES broadcasts(id) ON DELETE CASCADE,
+        tg_id BIGINT NOT NULL,
+        status VARCHAR(20) NOT NULL DEFAULT 'pending', -- pending, sent, failed
+        error TEXT,
+        PRIMARY KEY (broadcast_id, tg_id)
+    );
+    """,
+    # Notify other bot instances about settings changes (also catches manual edits in psql)
+    """
+    CREATE OR REPLACE FUNCTION notify_settings_changed() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('settings_changed', COALESCE(NEW.key, OLD.key));
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS settings_changed ON settings;",
+    """
+    CREATE TRIGGER settings_changed AFTER INSERT OR UPDATE OR DELETE ON settings
+    FOR EACH ROW EXECUTE FUNCTION notify_settings_changed();
+    """,
+]
+
+def _seed_defaults(cur):
+    for key in ("org_registration_open", "quest_started", "quest_ended"):
+        cur.execute("INSERT INTO settings (key, value) VALUES (%s, 'false') ON CONFLICT (key) DO NOTHING;", (key,))
+
+    # If there are no stations — create sample stations
+    cur.execute("SELECT COUNT(*) FROM stations;")
+    if cur.fetchone()[0] == 0:
+        logger.info(f"Creating test stations (1–{len(SAMPLE_STATIONS)})")
+        for number, name, location in SAMPLE_STATIONS:
+            cur.execute(
+                "INSERT INTO stations (number, name, location, is_free) VALUES (%s, %s, %s, TRUE) ON CONFLICT DO NOTHING;",
+                (number, name, location)
+            )
+
+# Indexes for the hot filters
+HOT_PATH_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS users_role_group_idx ON users (role, group_id);",
+    "CREATE INDEX IF NOT EXISTS users_role_station_idx ON users (role, station_id);",
+    "CREATE INDEX IF NOT EXISTS rewards_group_timestamp_idx ON rewards (group_id, timestamp);",
+    "CREATE INDEX IF NOT EXISTS stations_is_free_number_idx ON stations (is_free, number);",
+]
+
+GROUP_SUMMARIES = [
+    """
+    CREATE TABLE IF NOT EXISTS group_summaries (
+        group_id INT PRIMARY KEY REFERENCES groups(id),
+        total NUMERIC NOT NULL DEFAULT 0,
+        reward_count INT NOT NULL DEFAULT 0,
+        last_station_number INT,
+        last_reward_at TIMESTAMP
+    );
+    """,
+    """
+    INSERT INTO group_summaries (group_id, total, reward_count, last_station_number, last_reward_at)
+    SELECT r.group_id,
+           SUM(r.points + COALESCE(r.bonus, 0)),
+           COUNT(*),
+           (SELECT s.number FROM rewards r2 JOIN stations s ON s.id = r2.station_id
+            WHERE r2.group_id = r.group_id ORDER BY r2.timestamp DESC, r2.id DESC LIMIT 1),
+           MAX(r.timestamp)
+    FROM rewards r
+    WHERE r.group_id IS NOT NULL
+    GROUP BY r.group_id
+    ON CONFLICT (group_id) DO NOTHING;
+    """,
+    # Keyset pagination of /info history walks this index in both directions
+    "DROP INDEX IF EXISTS rewards_group_timestamp_idx;",
+    "CREATE INDEX IF NOT EXISTS rewards_group_timestamp_id_idx ON rewards (group_id, timestamp, id);",
+]
+
+UPDATE_QUEUE = [
+    """
+    CREATE TABLE IF NOT EXISTS update_queue (
+        id BIGSERIAL PRIMARY KEY,
+        update_id BIGINT UNIQUE, -- Telegram redeliveries are dropped on insert
+        chat_key BIGINT NOT NULL, -- updates with the same key are processed strictly in order
+        payload JSONB NOT NULL,
+        status VARCHAR(20) NOT NULL DEFAULT 'pending', -- pending, processing, failed
+        attempts INT NOT NULL DEFAULT 0,
+        locked_by TEXT,
+        locked_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS update_queue_status_id_idx ON update_queue (status, id);",
+    "CREATE INDEX IF NOT EXISTS update_queue_chat_status_idx ON update_queue (chat_key, status, id);",
+    # With several worker processes, caches of other instances must hear about user and score changes
+    """
+    CREATE OR REPLACE FUNCTION notify_users_changed() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('users_changed', COALESCE(NEW.tg_id, OLD.tg_id)::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS users_changed ON users;",
+    """
+    CREATE TRIGGER users_changed AFTER INSERT OR UPDATE OR DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION notify_users_changed();
+    """,
+    """
+    CREATE OR REPLACE FUNCTION notify_group_score() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('group_scores', json_build_object(
+            'id', NEW.id, 'group_number', NEW.group_number, 'score', NEW.score)::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS group_scores ON groups;",
+    """
+    CREATE TRIGGER group_scores AFTER INSERT OR UPDATE OF score ON groups
+    FOR EACH ROW EXECUTE FUNCTION notify_group_score();
+    """,
+]
+
+# Other instances drop their cached free-station list on any change of the stations table
+STATIONS_CHANGED = [
+    """
+    CREATE OR REPLACE FUNCTION notify_stations_changed() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('stations_changed', COALESCE(NEW.number, OLD.number)::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS stations_changed ON stations;",
+    """
+    CREATE TRIGGER stations_changed AFTER INSERT OR DELETE OR UPDATE OF is_free, number, location ON stations
+    FOR EACH ROW EXECUTE FUNCTION notify_stations_changed();
+    """,
+]
+
+# Events for push notifications (core.push): arrivals/departures at stations and new rewards
+PUSH_EVENTS = [
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS notify_free BOOLEAN NOT NULL DEFAULT FALSE;",
+    """
+    CREATE OR REPLACE FUNCTION notify_station_event() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('station_events', json_build_object(
+            'station_id', NEW.id, 'number', NEW.number,
+            'is_free', NEW.is_free, 'was_free', OLD.is_free,
+            'group_id', NEW.current_group, 'old_group_id', OLD.current_group)::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS station_events ON stations;",
+    """
+    CREATE TRIGGER station_events AFTER UPDATE OF is_free, current_group ON stations
+    FOR EACH ROW WHEN (OLD.is_free IS DISTINCT FROM NEW.is_free OR OLD.current_group IS DISTINCT FROM NEW.current_group)
+    EXECUTE FUNCTION notify_station_event();
+    """,
+    """
+    CREATE OR REPLACE FUNCTION notify_reward_event() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('reward_events', json_build_object(
+            'group_id', NEW.group_id, 'points', NEW.points, 'bonus', NEW.bonus,
+            'station_number', (SELECT number FROM stations WHERE id = NEW.station_id))::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS reward_events ON rewards;",
+    """
+    CREATE TRIGGER reward_events AFTER INSERT ON rewards
+    FOR EACH ROW EXECUTE FUNCTION notify_reward_event();
+    """,
+]
+
+STATION_WAITLIST = [
+    """
+    CREATE TABLE IF NOT EXISTS station_waitlist (
+        id BIGSERIAL PRIMARY KEY,
+        group_id INT NOT NULL REFERENCES groups(id) ON DELETE CASCADE,
+        station_id INT REFERENCES stations(id) ON DELETE CASCADE, -- NULL: any station not visited yet
+        created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        UNIQUE (group_id, station_id)
+    );
+    """,
+    # UNIQUE above does not cover NULLs: one "any station" entry per group
+    "CREATE UNIQUE INDEX IF NOT EXISTS station_waitlist_any_idx ON station_waitlist (group_id) WHERE station_id IS NULL;",
+    "CREATE INDEX IF NOT EXISTS station_waitlist_station_order_idx ON station_waitlist (station_id, created_at, id);",
+    # "Has the group visited this station" lookups
+    "CREATE INDEX IF NOT EXISTS rewards_group_station_idx ON rewards (group_id, station_id);",
+    "CREATE INDEX IF NOT EXISTS stations_current_group_idx ON stations (current_group);",
+]
+
+# rewards becomes an append-only ledger: corrections are new (negative) entries, never edits.
+# Checkpoints store every group's ledger total up to a reward id, so a score is recomputed
+# from the last checkpoint plus the newer entries instead of a full scan.
+SCORE_LEDGER = [
+    """
+    CREATE OR REPLACE FUNCTION rewards_append_only() RETURNS trigger AS $$
+    BEGIN
+        RAISE EXCEPTION 'rewards is an append-only ledger, insert a correcting entry instead';
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS rewards_append_only ON rewards;",
+    """
+    CREATE TRIGGER rewards_append_only BEFORE UPDATE OR DELETE ON rewards
+    FOR EACH ROW EXECUTE FUNCTION rewards_append_only();
+    """,
+    "DROP TRIGGER IF EXISTS rewards_no_truncate ON rewards;",
+    """
+    CREATE TRIGGER rewards_no_truncate BEFORE TRUNCATE ON rewards
+    FOR EACH STATEMENT EXECUTE FUNCTION rewards_append_only();
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS score_checkpoints (
+        id SERIAL PRIMARY KEY,
+        last_reward_id INT NOT NULL, -- covers rewards with id <= last_reward_id
+        created_at TIMESTAMP NOT NULL DEFAULT NOW()
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS score_checkpoint_entries (
+        checkpoint_id INT REFERENCES score_checkpoints(id) ON DELETE CASCADE,
+        group_id INT REFERENCES groups(id) ON DELETE CASCADE,
+        score NUMERIC NOT NULL,
+        PRIMARY KEY (checkpoint_id, group_id)
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS score_checkpoints_created_idx ON score_checkpoints (created_at);",
+]
+
+# Event (tenant) dimension: every quest is an event; stations, groups, users, settings and the
+# ledger carry event_id. Station numbers and group numbers are unique per event only.
+EVENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS events (
+        id SERIAL PRIMARY KEY,
+        code VARCHAR(50) UNIQUE NOT NULL,
+        title TEXT,
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+    """,
+    f"INSERT INTO events (id, code, title) VALUES ({DEFAULT_EVENT_ID}, 'default', 'Quest') ON CONFLICT DO NOTHING;",
+    "SELECT setval(pg_get_serial_sequence('events', 'id'), (SELECT MAX(id) FROM events));",
+    *[f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS event_id INT NOT NULL DEFAULT {DEFAULT_EVENT_ID} REFERENCES events(id);"
+      for table in ("stations", "groups", "users", "settings", "rewards", "station_waitlist")],
+    "ALTER TABLE stations DROP CONSTRAINT IF EXISTS stations_number_key;",
+    "ALTER TABLE stations ADD CONSTRAINT stations_event_number_key UNIQUE (event_id, number);",
+    "ALTER TABLE groups DROP CONSTRAINT IF EXISTS groups_group_number_key;",
+    "ALTER TABLE groups ADD CONSTRAINT groups_event_number_key UNIQUE (event_id, group_number);",
+    "ALTER TABLE settings DROP CONSTRAINT IF EXISTS settings_pkey;",
+    "ALTER TABLE settings ADD PRIMARY KEY (event_id, key);",
+    # Event-scoped versions of the hot indexes
+    "DROP INDEX IF EXISTS stations_is_free_number_idx;",
+    "CREATE INDEX IF NOT EXISTS stations_event_free_number_idx ON stations (event_id, is_free, number);",
+    "CREATE INDEX IF NOT EXISTS users_event_role_idx ON users (event_id, role);",
+    "CREATE INDEX IF NOT EXISTS rewards_event_id_idx ON rewards (event_id, id);",
+    "CREATE INDEX IF NOT EXISTS station_waitlist_event_order_idx ON station_waitlist (event_id, created_at, id);",
+    # Notification payloads carry the event, so instances only drop that event's caches
+    """
+    CREATE OR REPLACE FUNCTION notify_stations_changed() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('stations_changed', COALESCE(NEW.event_id, OLD.event_id)::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE OR REPLACE FUNCTION notify_group_score() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('group_scores', json_build_object(
+            'id', NEW.id, 'event_id', NEW.event_id, 'group_number', NEW.group_number, 'score', NEW.score)::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE OR REPLACE FUNCTION notify_station_event() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('station_events', json_build_object(
+            'event_id', NEW.event_id, 'station_id', NEW.id, 'number', NEW.number,
+            'is_free', NEW.is_free, 'was_free', OLD.is_free,
+            'group_id', NEW.current_group, 'old_group_id', OLD.current_group)::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE OR REPLACE FUNCTION notify_reward_event() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('reward_events', json_build_object(
+            'event_id', NEW.event_id, 'group_id', NEW.group_id, 'points', NEW.points, 'bonus', NEW.bonus,
+            'station_number', (SELECT number FROM stations WHERE id = NEW.station_id))::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+]
+
+# Every time a group arrives at a station it starts a new visit (stations.visit_id). A visit can
+# be rewarded with points once and with a bonus once, so a repeated /reward cannot double-count.
+REWARD_VISITS = [
+    "CREATE SEQUENCE IF NOT EXISTS station_visit_seq;",
+    "ALTER TABLE stations ADD COLUMN IF NOT EXISTS visit_id BIGINT;",
+    "ALTER TABLE rewards ADD COLUMN IF NOT EXISTS visit_id BIGINT;",
+    """
+    CREATE OR REPLACE FUNCTION stations_new_visit() RETURNS trigger AS $$
+    BEGIN
+        NEW.visit_id := nextval('station_visit_seq');
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS stations_new_visit ON stations;",
+    """
+    CREATE TRIGGER stations_new_visit BEFORE UPDATE OF current_group ON stations
+    FOR EACH ROW WHEN (NEW.current_group IS NOT NULL AND NEW.current_group IS DISTINCT FROM OLD.current_group)
+    EXECUTE FUNCTION stations_new_visit();
+    """,
+    # Rows from before this migration have no visit and are not constrained
+    "CREATE UNIQUE INDEX IF NOT EXISTS rewards_visit_points_key ON rewards (visit_id) WHERE points <> 0;",
+    "CREATE UNIQUE INDEX IF NOT EXISTS rewards_visit_bonus_key ON rewards (visit_id) WHERE bonus <> 0;",
+]
+
+# The in-memory quest state (core.state) applies station changes in order: every update bumps the
+# row revision, and station_events carries it with the visit. Taking and releasing reach other
+# instances through station_events only, stations_changed is left for inserts, deletes and edits.
+STATION_REVISIONS = [
+    "ALTER TABLE stations ADD COLUMN IF NOT EXISTS rev BIGINT NOT NULL DEFAULT 0;",
+    """
+    CREATE OR REPLACE FUNCTION stations_bump_rev() RETURNS trigger AS $$
+    BEGIN
+        NEW.rev := OLD.rev + 1;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS stations_bump_rev ON stations;",
+    """
+    CREATE TRIGGER stations_bump_rev BEFORE UPDATE ON stations
+    FOR EACH ROW EXECUTE FUNCTION stations_bump_rev();
+    """,
+    """
+    CREATE OR REPLACE FUNCTION notify_station_event() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('station_events', json_build_object(
+            'event_id', NEW.event_id, 'station_id', NEW.id, 'number', NEW.number,
+            'is_free', NEW.is_free, 'was_free', OLD.is_free,
+            'group_id', NEW.current_group, 'old_group_id', OLD.current_group,
+            'visit_id', NEW.visit_id, 'rev', NEW.rev)::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS stations_changed ON stations;",
+    """
+    CREATE TRIGGER stations_changed AFTER INSERT OR DELETE OR UPDATE OF event_id, number, name, location ON stations
+    FOR EACH ROW EXECUTE FUNCTION notify_stations_changed();
+    """,
+]
+
+# A release that hands the station straight to a waiting group updates the row twice in one
+# transaction. station_events now fires at commit and skips row versions a later update of the
+# same transaction replaced, so nobody hears "station N is free" for a station that never was.
+FINAL_STATION_EVENTS = [
+    """
+    CREATE OR REPLACE FUNCTION notify_station_event() RETURNS trigger AS $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM stations WHERE id = NEW.id AND rev = NEW.rev) THEN
+            RETURN NULL;
+        END IF;
+        PERFORM pg_notify('station_events', json_build_object(
+            'event_id', NEW.event_id, 'station_id', NEW.id, 'number', NEW.number,
+            'is_free', NEW.is_free, 'was_free', OLD.is_free,
+            'group_id', NEW.current_group, 'old_group_id', OLD.current_group,
+            'visit_id', NEW.visit_id, 'rev', NEW.rev)::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS station_events ON stations;",
+    """
+    CREATE CONSTRAINT TRIGGER station_events AFTER UPDATE OF is_free, current_group ON stations
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW WHEN (OLD.is_free IS DISTINCT FROM NEW.is_free OR OLD.current_group IS DISTINCT FROM NEW.current_group)
+    EXECUTE FUNCTION notify_station_event();
+    """,
+]
+
+# Score checkpoints belong to one event, so /checkpoint and /reconcile of an admin only touch
+# their event. Older checkpoints covered every event; they are kept for the default event, the
+# other events recompute from the full ledger until their first own checkpoint.
+EVENT_CHECKPOINTS = [
+    f"ALTER TABLE score_checkpoints ADD COLUMN IF NOT EXISTS event_id INT NOT NULL DEFAULT {DEFAULT_EVENT_ID} REFERENCES events(id);",
+    "DROP INDEX IF EXISTS score_checkpoints_created_idx;",
+    "CREATE INDEX IF NOT EXISTS score_checkpoints_event_created_idx ON score_checkpoints (event_id, created_at);",
+]
+
+MIGRATIONS = [
+    (1, "baseline schema", BASELINE),
+    (2, "default settings and sample stations", _seed_defaults),
+    (3, "indexes for hot filters", HOT_PATH_INDEXES),
+    (4, "group summaries and history pagination index", GROUP_SUMMARIES),
+    (5, "update work queue and cache invalidation triggers", UPDATE_QUEUE),
+    (6, "free stations cache invalidation trigger", STATIONS_CHANGED),
+    (7, "station and reward events for push notifications", PUSH_EVENTS),
+    (8, "station waitlists", STATION_WAITLIST),
+    (9, "append-only rewards ledger and score checkpoints", SCORE_LEDGER),
+    (10, "events (multi-quest tenancy)", EVENTS),
+    (11, "station visits and one reward per visit", REWARD_VISITS),
+    (12, "station revisions for the in-memory quest state", STATION_REVISIONS),
+    (13, "station events for the committed state only", FINAL_STATION_EVENTS),
+    (14, "score checkpoints per event", EVENT_CHECKPOINTS),
+]
+
+def apply_migrations():
+    """Apply pending migrations. Returns the list of applied versions."""
+    applied_now = []
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT pg_advisory_lock(%s);", (MIGRATIONS_LOCK_ID,))
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT NOW()
+                );
+            """)
+            cur.execute("SELECT version FROM schema_version;")
+            done = {row[0] for row in cur.fetchall()}
+            conn.commit()
+
+            for version, description, step in MIGRATIONS:
+                if version in done:
+                    continue
+                logger.info(f"Applying migration {version}: {description}")
+                try:
+                    if callable(step):
+                        step(cur)
+                    else:
+                        for sql in step:
+                            cur.execute(sql)
+                    cur.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s);", (version, description))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    logger.exception(f"Migration {version} failed")
+                    raise
+                applied_now.append(version)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s);", (MIGRATIONS_LOCK_ID,))
+            conn.commit()
+            cur.close()
+    if not applied_now:
+        logger.info("Database schema is up to date")
+    return applied_now
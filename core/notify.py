@@ -0,0 +1,99 @@
+"""
+Postgres LISTEN/NOTIFY listener.
+
+A single background thread keeps one dedicated connection, LISTENs on every
+subscribed channel and dispatches payloads to the registered callbacks.
+Callbacks run on the listener thread and must be quick and thread-safe.
+"""
+import select
+import logging
+import threading
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from core.config import DB_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class NotificationListener(threading.Thread):
+    def __init__(self, poll_timeout=0.5, reconnect_delay=2.0):
+        super().__init__(name="pg-listener", daemon=True)
+        self.poll_timeout = poll_timeout
+        self.reconnect_delay = reconnect_delay
+        self._callbacks = {}
+        self._reconnect_hooks = []
+        self._stop_event = threading.Event()
+        self._new_channels = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel: str, callback):
+        """Call callback(payload) for every NOTIFY on channel (also works after start())."""
+        with self._lock:
+            if channel not in self._callbacks:
+                self._new_channels.add(channel)
+            self._callbacks.setdefault(channel, []).append(callback)
+
+    def on_reconnect(self, callback):
+        """Call callback() after every (re)connect, to resync state that may have missed notifications."""
+        self._reconnect_hooks.append(callback)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _listen(self, conn, channels):
+        cur = conn.cursor()
+        for channel in channels:
+            cur.execute(f'LISTEN "{channel}";')
+        cur.close()
+
+    def _connect(self):
+        conn = psycopg2.connect(**DB_CONFIG)
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with self._lock:
+            self._new_channels.clear()
+            channels = list(self._callbacks)
+        self._listen(conn, channels)
+        return conn
+
+    def _dispatch(self, channel, payload):
+        with self._lock:
+            callbacks = list(self._callbacks.get(channel, []))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception(f"Notification handler for {channel} failed")
+
+    def run(self):
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                logger.info(f"Listening for notifications on: {', '.join(self._callbacks)}")
+                for hook in self._reconnect_hooks:
+                    hook()
+                while not self._stop_event.is_set():
+                    if self._new_channels:
+                        with self._lock:
+                            channels, self._new_channels = self._new_channels, set()
+                        self._listen(conn, channels)
+                    if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        n = conn.notifies.pop(0)
+                        self._dispatch(n.channel, n.payload)
+            except Exception as e:
+                logger.warning(f"Notification listener error, reconnecting: {e}")
+                self._stop_event.wait(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+listener = NotificationListener()
+
+def start_listener():
+    if listener._callbacks and not listener.is_alive():
+        listener.start()
+
+def stop_listener():
+    listener.stop()
@@ -0,0 +1,172 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool as pg_pool
+from core.metrics import MeteredCursor, Gauge, CallbackCounter, register
+from core.config import DB_CONFIG, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_HEALTHCHECK_INTERVAL
+from core.config import DB_REPLICA_DSN, DB_REPLICA_POOL_MAX
+
+logger = logging.getLogger(__name__)
+
+class PoolTimeout(RuntimeError):
+    pass
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 pool that waits for a free connection instead of failing.
+    Connections idle longer than healthcheck_interval are pinged before reuse.
+    """
+
+    def __init__(self, minconn, maxconn, timeout, healthcheck_interval, **connect_kwargs):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, cursor_factory=MeteredCursor, **connect_kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._discarded = 0
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last = self._last_used.get(id(conn), 0)
+        if time.monotonic() - last < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No free database connection after {self.timeout}s (max={self.maxconn}).")
+        waited = time.monotonic() - started
+        if waited > 1.0:
+            logger.warning(f"Waited {waited:.2f}s for a pooled connection (max={self.maxconn})")
+        try:
+            conn = self._pool.getconn()
+            while not self._is_healthy(conn):
+                logger.warning("Discarding broken pooled connection")
+                self._discard(conn)
+                conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def putconn(self, conn, close=False):
+        try:
+            if close or conn.closed:
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def _discard(self, conn):
+        self._last_used.pop(id(conn), None)
+        with self._lock:
+            self._discarded += 1
+        self._pool.putconn(conn, close=True)
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if not broken and not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            self.putconn(conn, close=broken)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max": self.maxconn,
+                "open": len(self._pool._pool) + len(self._pool._used),
+                "in_use": self._in_use,
+                "checkouts": self._checkouts,
+                "wait_total": self._wait_total,
+                "wait_max": self._wait_max,
+                "wait_avg": self._wait_total / self._checkouts if self._checkouts else 0.0,
+                "discarded": self._discarded,
+            }
+
+    def close(self):
+        self._pool.closeall()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the process-wide pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_HEALTHCHECK_INTERVAL, **DB_CONFIG)
+                logger.info(f"Connection pool created (min={DB_POOL_MIN}, max={DB_POOL_MAX})")
+    return _pool
+
+_replica_pool = None
+
+def get_replica_pool():
+    """Pool of the read replica (DB_REPLICA_DSN), or None when no replica is configured."""
+    global _replica_pool
+    if DB_REPLICA_DSN and _replica_pool is None:
+        with _pool_lock:
+            if _replica_pool is None:
+                _replica_pool = ConnectionPool(0, DB_REPLICA_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_HEALTHCHECK_INTERVAL, dsn=DB_REPLICA_DSN)
+                logger.info(f"Replica connection pool created (max={DB_REPLICA_POOL_MAX})")
+    return _replica_pool
+
+def close_pool():
+    global _pool, _replica_pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+        if _replica_pool is not None:
+            _replica_pool.close()
+            _replica_pool = None
+
+def pool_stats():
+    """Pool usage and wait-time counters (seconds), or None if the pool was never used."""
+    return _pool.stats() if _pool is not None else None
+
+def _stat(key):
+    return lambda: (pool_stats() or {}).get(key)
+
+register(Gauge("db_pool_connections_open", "Open pooled connections", _stat("open")))
+register(Gauge("db_pool_connections_in_use", "Pooled connections checked out", _stat("in_use")))
+register(CallbackCounter("db_pool_checkouts_total", "Connection checkouts since start", _stat("checkouts")))
+register(CallbackCounter("db_pool_wait_seconds_total", "Total time spent waiting for a pooled connection", _stat("wait_total")))
+register(Gauge("db_pool_wait_seconds_max", "Longest wait for a pooled connection", _stat("wait_max")))
+register(Gauge("db_replica_pool_connections_in_use", "Replica connections checked out",
+               lambda: _replica_pool.stats()["in_use"] if _replica_pool is not None else None))
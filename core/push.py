@@ -0,0 +1,146 @@
+"""
+Push notifications driven by Postgres NOTIFY (triggers from migration 7).
+
+- station_events: a group arrived -> the station's organizer is told which group;
+  a station became free -> opted-in curators (/notify_free) whose group is not at a station.
+  Only the state a transaction committed is reported (migration 13), so a station released
+  and handed to a waiting group in one go is announced as an arrival, not as free.
+- reward_events: a reward was inserted -> the group's curator gets the points.
+
+Every bot instance receives the notifications, but only the one holding the
+PUSH_LOCK_ID advisory lock sends messages, so users get each push once.
+Events that arrive while no instance holds the lock (e.g. during a failover) are not sent.
+"""
+import json
+import asyncio
+import logging
+from core import async_db
+from core.database import get_connection
+from core.notify import listener
+from core.leaderboard import leaderboards
+from core.broadcast import deliver
+from core.config import BROADCAST_PER_CHAT_RATE
+from core.utils.cache import TTLCache
+from core.utils.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+PUSH_LOCK_ID = 727002  # arbitrary constant for pg_try_advisory_lock
+LEADER_CHECK_INTERVAL = 10  # seconds
+
+class _Leadership:
+    """Holds the advisory lock on a dedicated connection; losing the connection releases it."""
+
+    def __init__(self):
+        self.conn = None
+        self.is_leader = False
+
+    def check(self):
+        try:
+            if self.conn is None or self.conn.closed:
+                self.is_leader = False
+                self.conn = get_connection()
+                self.conn.autocommit = True
+            with self.conn.cursor() as cur:
+                if self.is_leader:
+                    cur.execute("SELECT 1;")
+                else:
+                    cur.execute("SELECT pg_try_advisory_lock(%s);", (PUSH_LOCK_ID,))
+                    self.is_leader = cur.fetchone()[0]
+                    if self.is_leader:
+                        logger.info("This instance now sends push notifications")
+        except Exception as e:
+            logger.warning(f"Push leadership check failed: {e}")
+            self.release()
+        return self.is_leader
+
+    def release(self):
+        self.is_leader = False
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+_leadership = _Leadership()
+_runner = None
+_senders = set()
+# Spaces out pushes to one chat; buckets of chats that went quiet are dropped
+_chat_buckets = TTLCache(10000, 60)
+
+async def _send(bot, chat_id, text):
+    bucket = _chat_buckets.get(chat_id)
+    if bucket is None:
+        bucket = TokenBucket(BROADCAST_PER_CHAT_RATE, 1)
+        _chat_buckets.set(chat_id, bucket)
+    status, error = await deliver(bot, chat_id, text, bucket)
+    if status != "sent":
+        logger.info(f"Push to {chat_id} failed: {error}")
+
+async def _on_station_event(bot, ev):
+    if ev["group_id"] and ev["group_id"] != ev["old_group_id"] and not ev["is_free"]:
+        organizer = await async_db.get_organizer_tg_by_station_id(ev["station_id"])
+        group = await async_db.get_group_by_id(ev["group_id"])
+        if organizer and group:
+            await _send(bot, organizer, f"Group {group['group_number']} has arrived at your station {ev['number']}.")
+    if ev["is_free"] and not ev["was_free"]:
+        text = f"Station {ev['number']} is free now. Use /free to take it."
+        await asyncio.gather(*(_send(bot, tg, text) for tg in await async_db.get_free_station_subscribers(ev["event_id"])))
+
+async def _on_reward_event(bot, ev):
+    curator = await async_db.get_curator_tg_by_group_id(ev["group_id"])
+    if not curator:
+        return
+    points, bonus = float(ev["points"]), float(ev["bonus"] or 0)
+    where = f"at station {ev['station_number']}" if ev["station_number"] else "from the organizers"
+    text = f"Your group received {points:g} points" + (f" (+{bonus:g} bonus)" if bonus else "") + f" {where}."
+    score = leaderboards.get(ev["event_id"]).score(ev["group_id"])
+    if score is not None:
+        text += f" Total: {float(score):.2f}."
+    await _send(bot, curator, text)
+
+HANDLERS = {
+    "station_events": _on_station_event,
+    "reward_events": _on_reward_event,
+}
+
+async def _run(bot, queue):
+    loop = asyncio.get_running_loop()
+    leader = await async_db.run_db(_leadership.check)
+    next_check = loop.time() + LEADER_CHECK_INTERVAL
+    while True:
+        try:
+            channel, payload = await asyncio.wait_for(queue.get(), max(0.0, next_check - loop.time()))
+        except asyncio.TimeoutError:
+            leader = await async_db.run_db(_leadership.check)
+            next_check = loop.time() + LEADER_CHECK_INTERVAL
+            continue
+        if not leader:
+            continue
+        # Each event in its own task: a slow fan-out must not hold up the other pushes
+        task = asyncio.create_task(HANDLERS[channel](bot, json.loads(payload)))
+        _senders.add(task)
+        task.add_done_callback(_done)
+
+def _done(task):
+    _senders.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error("Push notification failed", exc_info=task.exception())
+
+async def start_push_notifications(application):
+    """Subscribe to station/reward events (call from Application.post_init)."""
+    global _runner
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    for channel in HANDLERS:
+        listener.subscribe(channel, lambda payload, channel=channel: loop.call_soon_threadsafe(queue.put_nowait, (channel, payload)))
+    _runner = asyncio.create_task(_run(application.bot, queue))
+
+async def stop_push_notifications(application=None):
+    """Cancel pending pushes and give up the lock (call from Application.post_shutdown)."""
+    if _runner is not None:
+        _runner.cancel()
+    for task in list(_senders):
+        task.cancel()
+    await async_db.run_db(_leadership.release)
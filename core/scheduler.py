@@ -0,0 +1,31 @@
+"""
+Station assignment for waiting groups.
+
+The queues live in Postgres (station_waitlist, see the Waitlists section of core.database), so every
+bot instance and worker shares them. release_station_by_number assigns the freed station in the same
+transaction. The handlers then use announce_assignments() to tell the curators where to go.
+"""
+import logging
+from telegram.error import TelegramError
+from core import async_db
+
+logger = logging.getLogger(__name__)
+
+def assignment_text(a):
+    return f"Station {a['number']} ({a['name']}, {a['location']}) is now assigned to your group — go there!"
+
+async def announce_assignments(bot, assigned):
+    """Message the curators of groups that got a station from the waitlist."""
+    for a in assigned:
+        curator = await async_db.get_curator_tg_by_group_id(a["group_id"])
+        if not curator:
+            continue
+        try:
+            await bot.send_message(chat_id=curator, text=assignment_text(a))
+        except TelegramError as e:
+            logger.warning(f"Could not announce station {a['number']} to group {a['group_number']}: {e}")
+
+def released_text(number, assigned):
+    lines = [f"Station {number} has been marked as free."]
+    lines += [f"Station {a['number']} was assigned to waiting group {a['group_number']}." for a in assigned]
+    return "\n".join(lines)
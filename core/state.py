@@ -0,0 +1,344 @@
+"""
+In-memory quest state: the stations, groups and users of all events.
+
+The live state of a quest is small (tens to hundreds of stations, a few hundred groups and
+users), so the bot loads it at startup and serves the hot reads from here: identities and
+roles, stations by number or id, free lists, the curator of a group and the organizer of a
+station. Postgres stays the authority. Every write still runs there (claims are conditional
+UPDATEs), and the helpers in core.database apply the rows their transaction returned right
+after it commits. Changes made by other bot instances, the importer or psql arrive through
+NOTIFY (start_state_sync()).
+
+Station records carry the row revision (stations.rev, bumped by a trigger on every update),
+so a late notification or a reload that raced a write never rolls a station back.
+reconcile() reloads everything and reports what had drifted (/resync).
+"""
+import json
+import logging
+import threading
+from decimal import Decimal
+from core.pool import get_pool
+from core.notify import listener
+from core.metrics import register, Gauge
+
+logger = logging.getLogger(__name__)
+
+class _Record:
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(**{name: row[name] for name in cls.__slots__})
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class StationRec(_Record):
+    __slots__ = ("id", "event_id", "number", "name", "location", "is_free", "current_group", "visit_id", "rev")
+
+class GroupRec(_Record):
+    __slots__ = ("id", "event_id", "group_number", "score")
+
+class UserRec(_Record):
+    __slots__ = ("id", "tg_id", "role", "group_id", "station_id", "event_id", "notify_free")
+
+STATIONS_SQL = "SELECT id, event_id, number, name, location, is_free, current_group, visit_id, rev FROM stations"
+GROUPS_SQL = "SELECT id, event_id, group_number, score FROM groups"
+USERS_SQL = "SELECT id, tg_id, role, group_id, station_id, event_id, notify_free FROM users"
+
+def _query(sql, params=()):
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, params)
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+class QuestState:
+    def __init__(self):
+        self.loaded = False
+        self._lock = threading.RLock()
+        self._stations = {}  # id -> StationRec
+        self._station_numbers = {}  # (event_id, number) -> StationRec
+        self._groups = {}  # id -> GroupRec
+        self._group_numbers = {}  # (event_id, group_number) -> GroupRec
+        self._users = {}  # tg_id -> UserRec
+        self._curators = {}  # group_id -> tg_id
+        self._organizers = {}  # station_id -> tg_id
+
+    # --- Loading ---
+    def load(self):
+        """(Re)load everything from Postgres."""
+        stations, groups, users = self._fetch_all()
+        with self._lock:
+            self._replace(stations, groups, users)
+            self.loaded = True
+        logger.info(f"Quest state loaded: {len(stations)} stations, {len(groups)} groups, {len(users)} users")
+
+    @staticmethod
+    def _fetch_all():
+        return ([StationRec.from_row(r) for r in _query(STATIONS_SQL + ";")],
+                [GroupRec.from_row(r) for r in _query(GROUPS_SQL + ";")],
+                [UserRec.from_row(r) for r in _query(USERS_SQL + ";")])
+
+    def _replace(self, stations, groups, users):
+        old_stations = self._stations
+        self._stations, self._station_numbers = {}, {}
+        for rec in stations:
+            old = old_stations.get(rec.id)
+            # A write committed after the reload read the row: keep it
+            self._index_station(old if old is not None and old.rev > rec.rev else rec)
+        self._groups, self._group_numbers = {}, {}
+        for rec in groups:
+            self._index_group(rec)
+        self._users, self._curators, self._organizers = {}, {}, {}
+        for rec in users:
+            self._index_user(rec)
+
+    def load_stations(self, event_id=None):
+        """Reload the stations of one event (all events for None), e.g. after an import."""
+        if event_id is None:
+            rows = _query(STATIONS_SQL + ";")
+        else:
+            rows = _query(STATIONS_SQL + " WHERE event_id = %s;", (event_id,))
+        fresh = {r["id"]: StationRec.from_row(r) for r in rows}
+        with self._lock:
+            for rec in list(self._stations.values()):
+                if (event_id is None or rec.event_id == event_id) and rec.id not in fresh:
+                    self._unindex_station(rec)
+            for rec in fresh.values():
+                self._put_station(rec)
+
+    def load_user(self, tg_id):
+        """Reload one user (after a change made elsewhere)."""
+        rows = _query(USERS_SQL + " WHERE tg_id = %s;", (tg_id,))
+        with self._lock:
+            if rows:
+                self.put_user(rows[0])
+            else:
+                old = self._users.get(tg_id)
+                if old is not None:
+                    self._unindex_user(old)
+
+    # --- Indexes ---
+    def _index_station(self, rec):
+        self._stations[rec.id] = rec
+        self._station_numbers[(rec.event_id, rec.number)] = rec
+
+    def _unindex_station(self, rec):
+        self._stations.pop(rec.id, None)
+        if self._station_numbers.get((rec.event_id, rec.number)) is rec:
+            del self._station_numbers[(rec.event_id, rec.number)]
+
+    def _put_station(self, rec):
+        old = self._stations.get(rec.id)
+        if old is not None:
+            if old.rev > rec.rev:
+                return
+            self._unindex_station(old)
+        self._index_station(rec)
+
+    def _index_group(self, rec):
+        self._groups[rec.id] = rec
+        self._group_numbers[(rec.event_id, rec.group_number)] = rec
+
+    def _index_user(self, rec):
+        self._users[rec.tg_id] = rec
+        if rec.role == "curator" and rec.group_id is not None:
+            self._curators[rec.group_id] = rec.tg_id
+        if rec.role == "organizer" and rec.station_id is not None:
+            self._organizers[rec.station_id] = rec.tg_id
+
+    def _unindex_user(self, rec):
+        self._users.pop(rec.tg_id, None)
+        if self._curators.get(rec.group_id) == rec.tg_id:
+            del self._curators[rec.group_id]
+        if self._organizers.get(rec.station_id) == rec.tg_id:
+            del self._organizers[rec.station_id]
+
+    # --- Write-through (rows committed by core.database) ---
+    def put_stations(self, rows):
+        """Apply full station rows (RETURNING of a committed UPDATE); older revisions are ignored."""
+        with self._lock:
+            for row in rows:
+                self._put_station(StationRec.from_row(row))
+
+    def apply_station_event(self, ev):
+        """Apply a station_events payload. Returns False if the station is unknown."""
+        with self._lock:
+            rec = self._stations.get(ev["station_id"])
+            if rec is None:
+                return False
+            if ev["rev"] > rec.rev:
+                rec.is_free, rec.current_group = ev["is_free"], ev["group_id"]
+                rec.visit_id, rec.rev = ev["visit_id"], ev["rev"]
+            return True
+
+    def put_group(self, row):
+        with self._lock:
+            old = self._groups.get(row["id"])
+            if old is not None:
+                self._group_numbers.pop((old.event_id, old.group_number), None)
+            self._index_group(GroupRec.from_row(row))
+
+    def set_score(self, group_id, score):
+        with self._lock:
+            rec = self._groups.get(group_id)
+            if rec is not None:
+                rec.score = score
+
+    def put_user(self, row):
+        with self._lock:
+            old = self._users.get(row["tg_id"])
+            if old is not None:
+                self._unindex_user(old)
+            self._index_user(UserRec.from_row(row))
+
+    def update_user(self, tg_id, **fields):
+        with self._lock:
+            rec = self._users.get(tg_id)
+            if rec is not None:
+                self.put_user({**rec.as_dict(), **fields})
+
+    # --- Reads (copies, shaped like the database rows they replace) ---
+    def station(self, event_id, number):
+        with self._lock:
+            rec = self._station_numbers.get((event_id, number))
+            return rec.as_dict() if rec else None
+
+    def station_by_id(self, station_id):
+        with self._lock:
+            rec = self._stations.get(station_id)
+            return rec.as_dict() if rec else None
+
+    def free_stations(self, event_id):
+        """[(number, location), ...] of the event's free stations, ordered by number."""
+        with self._lock:
+            return sorted((s.number, s.location) for s in self._stations.values() if s.event_id == event_id and s.is_free)
+
+    def group(self, group_id):
+        with self._lock:
+            rec = self._groups.get(group_id)
+            return rec.as_dict() if rec else None
+
+    def group_by_number(self, event_id, group_number):
+        with self._lock:
+            rec = self._group_numbers.get((event_id, group_number))
+            return rec.as_dict() if rec else None
+
+    def group_scores(self, event_id):
+        """[{"group_number", "score"}, ...] of the event, best first."""
+        with self._lock:
+            groups = [g for g in self._groups.values() if g.event_id == event_id]
+        groups.sort(key=lambda g: (g.score is None, -(g.score or 0)))
+        return [{"group_number": g.group_number, "score": g.score} for g in groups]
+
+    def user(self, tg_id):
+        with self._lock:
+            rec = self._users.get(tg_id)
+            return rec.as_dict() if rec else None
+
+    def identity(self, tg_id):
+        """{"tg_id", "role", "group_id", "station_id", "event_id"} or None for unknown users."""
+        with self._lock:
+            rec = self._users.get(tg_id)
+            if rec is None:
+                return None
+            return {"tg_id": rec.tg_id, "role": rec.role, "group_id": rec.group_id,
+                    "station_id": rec.station_id, "event_id": rec.event_id}
+
+    def curator_of(self, group_id):
+        with self._lock:
+            return self._curators.get(group_id)
+
+    def organizer_of(self, station_id):
+        with self._lock:
+            return self._organizers.get(station_id)
+
+    def user_tgids(self, event_id):
+        with self._lock:
+            return [u.tg_id for u in self._users.values() if u.event_id == event_id and u.tg_id]
+
+    def free_station_subscribers(self, event_id):
+        """Opted-in curators of the event whose group is not at a station right now."""
+        with self._lock:
+            busy = {s.current_group for s in self._stations.values() if s.current_group is not None}
+            return [u.tg_id for u in self._users.values()
+                    if u.event_id == event_id and u.role == "curator" and u.notify_free and u.group_id not in busy]
+
+    def __len__(self):
+        return len(self._stations) + len(self._groups) + len(self._users)
+
+    # --- Reconciliation ---
+    def reconcile(self):
+        """
+        Reload everything and return what memory had wrong, as [{"kind", "label", "diff"}].
+        A station whose memory revision is newer than the reloaded row was written during the
+        reload and is not reported (it is kept).
+        """
+        stations, groups, users = self._fetch_all()
+        drift = []
+        with self._lock:
+            for kind, old, fresh, key in (
+                ("station", self._stations, stations, lambda r: r.id),
+                ("group", self._groups, groups, lambda r: r.id),
+                ("user", self._users, users, lambda r: r.tg_id),
+            ):
+                fresh = {key(r): r for r in fresh}
+                for k in old.keys() | fresh.keys():
+                    mem, db = old.get(k), fresh.get(k)
+                    if kind == "station" and mem is not None and db is not None and mem.rev > db.rev:
+                        continue
+                    diff = _diff(mem, db)
+                    if diff:
+                        drift.append({"kind": kind, "label": _label(kind, db or mem), "diff": diff})
+            self._replace(stations, groups, users)
+            self.loaded = True
+        if drift:
+            logger.warning(f"Quest state reconciled, {len(drift)} records had drifted")
+        return drift
+
+def _diff(mem, db):
+    if mem is None:
+        return "missing in memory"
+    if db is None:
+        return "not in the database"
+    a, b = mem.as_dict(), db.as_dict()
+    return ", ".join(f"{name} {a[name]!r} -> {b[name]!r}" for name in a if a[name] != b[name])
+
+def _label(kind, rec):
+    if kind == "station":
+        return f"station {rec.number} (event {rec.event_id})"
+    if kind == "group":
+        return f"group {rec.group_number} (event {rec.event_id})"
+    return f"user {rec.tg_id} ({rec.role})"
+
+state = QuestState()
+
+register(Gauge("bot_state_records", "Stations, groups and users held in the in-memory quest state",
+               lambda: len(state) if state.loaded else None))
+
+def start_state_sync():
+    """
+    Apply changes committed by other bot instances, the importer or psql. Must be called before
+    the other start_*_sync() of core.database, so their callbacks see the updated state.
+    """
+    def on_station_event(payload):
+        ev = json.loads(payload)
+        if not state.apply_station_event(ev):
+            state.load_stations(ev["event_id"])
+
+    def on_score(payload):
+        g = json.loads(payload)
+        state.put_group({**g, "score": Decimal(str(g["score"] or 0))})
+
+    listener.subscribe("station_events", on_station_event)
+    listener.subscribe("stations_changed", lambda payload: state.load_stations(int(payload) if payload else None))
+    listener.subscribe("users_changed", lambda payload: state.load_user(int(payload)))
+    listener.subscribe("group_scores", on_score)
+    listener.on_reconnect(state.load)
@@ -0,0 +1,81 @@
+"""
+Per-user and per-role flood protection, run before every other handler (TypeHandler, group -2).
+
+Every user has a token bucket sized by their role (THROTTLE_USER_LIMITS), and each role can also
+have one bucket shared by all its users (THROTTLE_ROLE_LIMITS), e.g. to cap what unregistered
+users can cost together. The role comes from the identity cache only; users not in it count as
+"guest" until a handler has looked them up. An update without tokens is dropped: the user gets
+one short notice per throttled streak (callback queries are answered instead), and nothing
+touches the database.
+
+THROTTLE_USER_LIMITS="" and THROTTLE_ROLE_LIMITS="" turn the protection off.
+"""
+import logging
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop
+from core.config import THROTTLE_USER_LIMITS, THROTTLE_ROLE_LIMITS
+from core.database import peek_user_role
+from core.metrics import register, Counter, Gauge
+from core.utils.cache import TTLCache
+from core.utils.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+NOTICE = "Too many requests, please slow down."
+
+def parse_limits(value: str):
+    """"role=rate/burst;..." -> {role: (rate, burst)}; a rate of 0 means unlimited (None)."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(";"))):
+        role, _, spec = item.partition("=")
+        rate, _, burst = spec.partition("/")
+        limits[role.strip()] = (float(rate), float(burst or rate)) if float(rate) > 0 else None
+    return limits
+
+USER_LIMITS = parse_limits(THROTTLE_USER_LIMITS)
+ROLE_LIMITS = parse_limits(THROTTLE_ROLE_LIMITS)
+
+# (tg_id, role) -> [bucket, notified]; idle users are dropped after 10 minutes
+_user_buckets = TTLCache(50000, 600)
+_role_buckets = {role: TokenBucket(*limit) for role, limit in ROLE_LIMITS.items() if limit}
+
+THROTTLED = register(Counter("bot_throttled_updates_total", "Updates dropped by flood protection", ("role", "scope")))
+register(Gauge("bot_throttle_tracked_users", "Users with a flood-protection bucket", lambda: len(_user_buckets)))
+
+def _user_state(tg_id, role):
+    limit = USER_LIMITS.get(role, USER_LIMITS.get("guest"))
+    if limit is None:
+        return None
+    state = _user_buckets.get((tg_id, role))
+    if state is None:
+        state = [TokenBucket(*limit), False]
+        _user_buckets.set((tg_id, role), state)
+    return state
+
+async def throttle_updates(update: Update, context):
+    user = update.effective_user
+    if user is None:
+        return
+    role = peek_user_role(user.id) or "guest"
+    state = _user_state(user.id, role)
+    if state is not None and not state[0].try_acquire():
+        scope = "user"
+    elif role in _role_buckets and not _role_buckets[role].try_acquire():
+        scope = "role"
+    else:
+        if state is not None:
+            state[1] = False
+        return
+    THROTTLED.inc(role, scope)
+    try:
+        if update.callback_query:
+            # Unanswered callback queries keep the button spinning
+            await update.callback_query.answer(NOTICE)
+        elif update.effective_message and (state is None or not state[1]):
+            # One reply per streak, so a flood does not turn into a flood of replies
+            if state is not None:
+                state[1] = True
+            await update.effective_message.reply_text(NOTICE)
+    except Exception as e:
+        logger.debug(f"Throttle notice to {user.id} failed: {e}")
+    raise ApplicationHandlerStop
@@ -0,0 +1,88 @@
+"""
+Concurrent update processing with per-chat ordering (polling and webhook modes).
+
+Up to UPDATE_CONCURRENCY updates are handled at once, so a slow /stats or /mailing no longer
+holds up everyone else's buttons. Updates of one chat (or, without a chat, of one user) still
+run one at a time and in arrival order, so a double-tap cannot race itself.
+
+An update whose chat is busy is parked behind it and gives its slot back at once: a chat with
+a backlog uses one slot, not one per waiting update. Worker mode does not need this, the
+update_queue already serializes chats (see core.workers).
+"""
+import time
+import logging
+from collections import deque
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from core.metrics import register, Histogram, Gauge
+
+logger = logging.getLogger(__name__)
+
+def update_chat_key(update):
+    """Ordering key of an Update: its chat, else its sender, else None (no ordering needed)."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return None
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """BaseUpdateProcessor that serializes updates with the same update_chat_key()."""
+
+    __slots__ = ("_pending",)
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # chat key -> deque of (parked_at, coroutine) waiting behind the update being handled
+        self._pending = {}
+
+    async def do_process_update(self, update, coroutine):
+        key = update_chat_key(update)
+        if key is None:
+            await coroutine
+            return
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending.append((time.perf_counter(), coroutine))
+            return
+        pending = self._pending[key] = deque()
+        try:
+            await self._run(coroutine)
+            while pending:
+                parked_at, coroutine = pending.popleft()
+                CHAT_WAIT_SECONDS.observe(time.perf_counter() - parked_at)
+                await self._run(coroutine)
+        finally:
+            del self._pending[key]
+            # Only left over when the chain was cancelled (shutdown)
+            for _, coroutine in pending:
+                coroutine.close()
+
+    @staticmethod
+    async def _run(coroutine):
+        # Application.process_update already reports handler errors; this keeps the chat's queue going
+        try:
+            await coroutine
+        except Exception:
+            logger.exception("Update processing failed")
+
+    def busy_chats(self):
+        return len(self._pending)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+CHAT_WAIT_SECONDS = register(Histogram("bot_update_chat_wait_seconds", "Time an update waited for an earlier update of its chat"))
+_processor = None
+register(Gauge("bot_busy_chats", "Chats with an update being handled", lambda: _processor.busy_chats() if _processor else None))
+
+def build_update_processor(max_concurrent_updates: int):
+    """Processor for ApplicationBuilder.concurrent_updates(); 1 keeps strictly sequential handling."""
+    global _processor
+    _processor = PerChatUpdateProcessor(max(1, max_concurrent_updates))
+    return _processor
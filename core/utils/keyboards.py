@@ -1,9 +1,9 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-def free_stations_keyboard(stations):
+def free_stations_keyboard(stations, page=1, pages=1):
     """
-    stations: [(number, location), (number, location), ...]
-    callback_data: take:<number>
+    stations: [(number, location), (number, location), ...] — the stations of one page
+    callback_data: take:<number>, paging free:<page>
     """
     buttons = []
     for number, location in stations:
@@ -13,9 +13,39 @@ def free_stations_keyboard(stations):
                 callback_data=f"take:{number}"
             )
         ])
+    if pages > 1:
+        buttons.append(pager_row("free", page, pages))
     # Add a cancel button
     buttons.append([InlineKeyboardButton(text="Cancel", callback_data="cancel")])
     return InlineKeyboardMarkup(buttons)
 
 def station_free_button(number):
     return InlineKeyboardMarkup([[InlineKeyboardButton(text="Station is free", callback_data=f"free_station:{number}")]])
+
+def pager_row(prefix, page, pages):
+    """« / » buttons with callback_data <prefix>:<page>."""
+    row = []
+    if page > 1:
+        row.append(InlineKeyboardButton(text="« Prev", callback_data=f"{prefix}:{page - 1}"))
+    row.append(InlineKeyboardButton(text=f"{page}/{pages}", callback_data="noop"))
+    if page < pages:
+        row.append(InlineKeyboardButton(text="Next »", callback_data=f"{prefix}:{page + 1}"))
+    return row
+
+def pager_keyboard(prefix, page, pages):
+    """Keyboard with just the pager row; None when everything fits on one page."""
+    if pages <= 1:
+        return None
+    return InlineKeyboardMarkup([pager_row(prefix, page, pages)])
+
+def history_keyboard(first, last, has_newer, has_older):
+    """
+    Newer/older buttons for /info history pages.
+    callback_data: hist:<n|o>:<timestamp ISO>:<reward id> — the keyset of the page edge row.
+    """
+    row = []
+    if has_newer:
+        row.append(InlineKeyboardButton(text="« Newer", callback_data=f"hist:n:{first['timestamp'].isoformat()}:{first['id']}"))
+    if has_older:
+        row.append(InlineKeyboardButton(text="Older »", callback_data=f"hist:o:{last['timestamp'].isoformat()}:{last['id']}"))
+    return InlineKeyboardMarkup([row]) if row else None
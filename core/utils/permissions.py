@@ -1,7 +1,8 @@
 from functools import wraps
 from telegram import Update
 from telegram.ext import ContextTypes
-from core.database import get_user_by_tg, get_user_role   # путь поправь под свой проект
+from core.async_db import get_user_identity
+from core.metrics import track_command
 from functools import wraps
 import psycopg2
 import os
@@ -12,17 +13,22 @@ def require_role(*roles):
     """
     Decorator to restrict command access by roles.
     Example: @require_role("admin", "curator")
+    The resolved identity (role, group_id, station_id) is stored in context.identity,
+    so the handler does not need to look the user up again.
     """
     def decorator(func):
         @wraps(func)
         async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
             tg_id = update.effective_user.id
-            role = get_user_role(tg_id)
+            identity = await get_user_identity(tg_id)
+            context.identity = identity
+            role = identity["role"] if identity else None
 
             if role not in roles:
                 await update.message.reply_text("⛔ You do not have permission for this command.")
                 return
 
             return await func(update, context, *args, **kwargs)
-        return wrapper
+        # Latency and DB usage of protected commands are recorded automatically
+        return track_command(wrapper)
     return decorator
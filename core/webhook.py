@@ -0,0 +1,85 @@
+"""
+Embedded webhook server.
+
+Telegram POSTs each update as JSON to http://<WEBHOOK_LISTEN>:<WEBHOOK_PORT>/<WEBHOOK_PATH>.
+Requests without the configured secret token are rejected; the server does not start without
+WEBHOOK_SECRET, since anyone who can reach the port could otherwise post updates as any user. Accepted updates are handed
+to a sink coroutine: by default the Application's update_queue, so the handlers registered
+in main.register_handlers run exactly as with polling.
+
+Local check with a recorded update:
+    curl -X POST -H "Content-Type: application/json" \
+         -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \
+         --data @update.json http://localhost:8443/telegram
+"""
+import hmac
+import json
+import signal
+import asyncio
+import logging
+import tornado.web
+from telegram import Update
+from core.config import WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class UpdateRequestHandler(tornado.web.RequestHandler):
+    def initialize(self, sink, secret):
+        self.sink = sink
+        self.secret = secret
+
+    async def post(self):
+        if not hmac.compare_digest(self.request.headers.get(SECRET_HEADER, ""), self.secret):
+            logger.warning(f"Rejected webhook request from {self.request.remote_ip}: bad secret token")
+            self.set_status(403)
+            return
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+        await self.sink(data)
+        self.set_status(200)
+
+def require_webhook_secret(secret=WEBHOOK_SECRET):
+    if not secret:
+        raise RuntimeError("WEBHOOK_SECRET must be set to receive updates through the webhook server.")
+
+def make_webhook_app(sink, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+    require_webhook_secret(secret)
+    return tornado.web.Application([
+        (rf"/{path.strip('/')}/?", UpdateRequestHandler, {"sink": sink, "secret": secret}),
+    ])
+
+async def wait_for_stop_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+async def serve_webhook(application, sink=None):
+    """Run the application behind the embedded webhook server until SIGINT/SIGTERM."""
+    if sink is None:
+        async def sink(data):
+            await application.update_queue.put(Update.de_json(data, application.bot))
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        if WEBHOOK_URL:
+            url = f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH.strip('/')}"
+            await application.bot.set_webhook(url, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES)
+            logger.info(f"Webhook registered at {url}")
+        server = make_webhook_app(sink).listen(WEBHOOK_PORT, address=WEBHOOK_LISTEN)
+        logger.info(f"Webhook server listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH.strip('/')}")
+        try:
+            await wait_for_stop_signal()
+        finally:
+            server.stop()
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
@@ -0,0 +1,167 @@
+"""
+Horizontal scale-out through a Postgres work queue.
+
+BOT_MODE=ingress: receive updates (webhook server or polling) and only store them in update_queue.
+BOT_MODE=worker:  claim queued updates with FOR UPDATE SKIP LOCKED and run them through the
+                  handlers from main.register_handlers. Any number of workers on any hosts.
+
+Updates of one chat are never processed concurrently or out of order (see claim_updates).
+A worker runs up to WORKER_BATCH handlers at once and claims again as soon as one finishes,
+so one slow handler does not hold back the rest of the queue.
+A worker heartbeats its claims while their handlers run; only claims of a worker that stopped
+heartbeating (it died) are requeued, so a slow /export or /mailing is never run twice.
+"""
+import os
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from telegram import Update
+from telegram.ext import TypeHandler
+from core import async_db
+from core.config import INGRESS_SOURCE, WORKER_BATCH, WORKER_IDLE_POLL, WORKER_MAX_ATTEMPTS, WORKER_STALE_AFTER
+from core.database import UPDATE_QUEUE_CHANNEL
+from core.notify import listener, start_listener
+from core.webhook import serve_webhook, wait_for_stop_signal
+
+logger = logging.getLogger(__name__)
+
+def chat_key(data: dict) -> int:
+    """Ordering key of a raw update: the chat it belongs to, else the sender, else the update itself."""
+    for field in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if field in data:
+            return data[field]["chat"]["id"]
+    if "callback_query" in data:
+        cq = data["callback_query"]
+        if cq.get("message"):
+            return cq["message"]["chat"]["id"]
+        return cq["from"]["id"]
+    for value in data.values():
+        if isinstance(value, dict) and "from" in value:
+            return value["from"]["id"]
+    return -data["update_id"]
+
+async def enqueue_raw(data: dict):
+    await async_db.enqueue_update(data["update_id"], chat_key(data), data)
+
+def run_ingress(application):
+    """Accept updates and queue them; no handlers run in this process."""
+    if INGRESS_SOURCE == "polling":
+        async def enqueue(update: Update, context):
+            await enqueue_raw(update.to_dict())
+        application.add_handler(TypeHandler(Update, enqueue))
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    else:
+        asyncio.run(serve_webhook(application, sink=enqueue_raw))
+
+async def _process(application, row):
+    try:
+        update = Update.de_json(row["payload"], application.bot)
+        # process_update reports handler errors to the error handlers itself
+        await application.process_update(update)
+    except Exception:
+        logger.exception(f"Queued update {row['id']} failed (attempt {row['attempts']})")
+        await _finish(async_db.fail_update, row["id"], WORKER_MAX_ATTEMPTS)
+        return
+    await _finish(async_db.complete_update, row["id"])
+
+async def _finish(call, queue_id, *args):
+    # An unfinished claim blocks its chat until the worker dies (the heartbeat keeps it), so retry a DB blip
+    for attempt in range(WORKER_MAX_ATTEMPTS):
+        try:
+            await call(queue_id, *args)
+            return
+        except Exception:
+            logger.exception(f"Could not finish queued update {queue_id} (attempt {attempt + 1}/{WORKER_MAX_ATTEMPTS})")
+            await asyncio.sleep(min(2 ** attempt, 30))
+
+async def _heartbeat(worker_id):
+    # Several beats per WORKER_STALE_AFTER, so one slow round trip does not get claims requeued
+    while True:
+        await asyncio.sleep(WORKER_STALE_AFTER / 4)
+        try:
+            await async_db.heartbeat_updates(worker_id)
+        except Exception:
+            logger.exception("Worker heartbeat failed")
+
+async def _worker_loop(application, worker_id):
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    listener.subscribe(UPDATE_QUEUE_CHANNEL, lambda payload: loop.call_soon_threadsafe(wake.set))
+    start_listener()
+    heartbeat = asyncio.create_task(_heartbeat(worker_id))
+    try:
+        await _claim_loop(application, worker_id, wake)
+    finally:
+        heartbeat.cancel()
+
+async def _claim_loop(application, worker_id, wake):
+    slots = asyncio.Semaphore(WORKER_BATCH)
+    running = set()
+
+    async def run(row):
+        try:
+            await _process(application, row)
+        finally:
+            running.discard(asyncio.current_task())
+            slots.release()
+            # The next update of this chat may be claimable now
+            wake.set()
+
+    last_requeue = 0.0
+    failures = 0
+    try:
+        while True:
+            # Wait for a free handler slot, then claim as many updates as there are free slots
+            await slots.acquire()
+            try:
+                if time.monotonic() - last_requeue > WORKER_STALE_AFTER / 2:
+                    last_requeue = time.monotonic()
+                    n = await async_db.requeue_stale_updates(WORKER_STALE_AFTER)
+                    if n:
+                        logger.warning(f"Requeued {n} stale updates")
+                wake.clear()
+                rows = await async_db.claim_updates(worker_id, WORKER_BATCH - len(running))
+                failures = 0
+            except Exception:
+                slots.release()
+                failures += 1
+                logger.exception(f"Claiming queued updates failed ({failures} in a row)")
+                await asyncio.sleep(min(2 ** failures, 30))
+                continue
+            if not rows:
+                slots.release()
+                try:
+                    await asyncio.wait_for(wake.wait(), WORKER_IDLE_POLL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            # Claimed rows never share a chat with each other or with a running update
+            for i, row in enumerate(rows):
+                if i:
+                    await slots.acquire()  # does not block: no more rows than free slots were claimed
+                running.add(asyncio.create_task(run(row)))
+    finally:
+        for task in list(running):
+            task.cancel()
+
+async def _run_worker(application):
+    # The random part tells a restarted container (same hostname, pid 1 again) from its dead predecessor
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        logger.info(f"Worker {worker_id} started")
+        task = asyncio.create_task(_worker_loop(application, worker_id))
+        try:
+            await wait_for_stop_signal()
+        finally:
+            task.cancel()
+        await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+def run_worker(application):
+    asyncio.run(_run_worker(application))
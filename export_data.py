@@ -0,0 +1,42 @@
+"""
+Export quest results as CSV.
+
+    python export_data.py rewards -o rewards.csv
+    python export_data.py visits -o visits.csv.gz     # gzip when the name ends with .gz (or --gzip)
+    python export_data.py groups -o -                 # to stdout
+    python export_data.py groups --event spring       # another event (default: "default")
+
+Rows are streamed through a server-side cursor, so memory use stays flat for any event size.
+"""
+import sys
+import logging
+import argparse
+from core.database import wait_for_db, get_event_by_code
+from core.exporter import EXPORTS, export_to_path, write_export
+from core.pool import close_pool
+
+logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=list(EXPORTS))
+    parser.add_argument("-o", "--output", default="-", help="output file, - for stdout (default)")
+    parser.add_argument("--gzip", action="store_true", help="compress the output file")
+    parser.add_argument("--event", default="default", help="event code (default: %(default)s)")
+    args = parser.parse_args()
+
+    wait_for_db()
+    try:
+        event = get_event_by_code(args.event)
+        if not event:
+            sys.exit(f"Unknown event: {args.event}")
+        if args.output == "-":
+            rows = write_export(args.kind, sys.stdout, event["id"])
+        else:
+            rows = export_to_path(args.kind, args.output, compress=args.gzip or args.output.endswith(".gz"), event_id=event["id"])
+    finally:
+        close_pool()
+    print(f"{rows} rows exported", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
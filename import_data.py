@@ -0,0 +1,47 @@
+"""
+Bulk import of stations and groups for a new venue.
+
+    python import_data.py stations stations.csv --dry-run
+    python import_data.py stations stations.csv
+    python import_data.py groups groups.csv
+    python import_data.py stations stations.csv --event spring   # into another event (/new_event)
+
+CSV files need a header row: "number,name,location" for stations, "group_number" for groups.
+Existing stations are updated by number, existing groups are left as they are.
+Running bots pick up the changes through their LISTEN/NOTIFY triggers.
+"""
+import sys
+import logging
+import argparse
+from core.database import wait_for_db, init_db, get_event_by_code
+from core.importer import KINDS, import_csv, format_report
+from core.pool import close_pool
+
+logging.basicConfig(level=logging.INFO)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=sorted(KINDS))
+    parser.add_argument("file", help="CSV file, or - for stdin")
+    parser.add_argument("--dry-run", action="store_true", help="validate and report without writing anything")
+    parser.add_argument("--event", default="default", help="event code (default: %(default)s)")
+    args = parser.parse_args()
+
+    wait_for_db()
+    init_db()
+    try:
+        event = get_event_by_code(args.event)
+        if not event:
+            sys.exit(f"Unknown event: {args.event}")
+        if args.file == "-":
+            report = import_csv(args.kind, sys.stdin, dry_run=args.dry_run, event_id=event["id"])
+        else:
+            with open(args.file, encoding="utf-8", newline="") as f:
+                report = import_csv(args.kind, f, dry_run=args.dry_run, event_id=event["id"])
+    finally:
+        close_pool()
+    print(format_report(report))
+    sys.exit(1 if report["error_count"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,27 @@
+import asyncio
 import logging
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler
-from core.config import TOKEN
-from core.database import wait_for_db, init_db
+from telegram import Update
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, TypeHandler
+from core.config import TOKEN, BOT_MODE, INGRESS_SOURCE, METRICS_LISTEN, METRICS_PORT, PUSH_NOTIFICATIONS, UPDATE_CONCURRENCY
+from core.state import state, start_state_sync
+from core.database import wait_for_db, init_db, load_settings, start_settings_sync, rebuild_leaderboard, start_identity_sync, start_leaderboard_sync, start_free_stations_sync
+from core.pool import close_pool, pool_stats
+from core import async_db
+from core.notify import start_listener, stop_listener
+from core.broadcast import resume_broadcasts
+from core.push import start_push_notifications, stop_push_notifications
+from core.ledger import start_checkpoints, stop_checkpoints
+from core.webhook import serve_webhook, require_webhook_secret
+from core.workers import run_ingress, run_worker
+from core.metrics import MeteredRequest, start_metrics_server
+from core.update_processor import build_update_processor
+from core.idempotency import drop_repeated_updates
+from core.throttle import throttle_updates
 from core.handlers.common import start, help_command, free_cmd
-from core.handlers.curator import reg_user, info, take
+from core.handlers.curator import reg_user, info, take, rank, notify_free, next_station, wait, unwait
 from core.handlers.organizer import reg_org, station, reward, reward_bonus, station_free_cmd
-from core.handlers.admin import open_cmd, close_cmd, begin, end, pay, mailing, stats
+from core.handlers.admin import open_cmd, close_cmd, begin, end, pay, mailing, stats, checkpoint, reconcile, standings, export
+from core.handlers.admin import new_event, events, use_event, resync
 from core.handlers.callbacks import callback_router
 from core.handlers import common, curator, organizer, admin
 
@@ -13,6 +29,10 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def register_handlers(app):
+    # Before any handler: flood protection, then drop redelivered updates
+    app.add_handler(TypeHandler(Update, throttle_updates), group=-2)
+    app.add_handler(TypeHandler(Update, drop_repeated_updates), group=-1)
+
     # General
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
@@ -22,6 +42,11 @@ def register_handlers(app):
     app.add_handler(CommandHandler("reg_user", reg_user))
     app.add_handler(CommandHandler("info", info))
     app.add_handler(CommandHandler("take", take))
+    app.add_handler(CommandHandler("rank", rank))
+    app.add_handler(CommandHandler("notify_free", notify_free))
+    app.add_handler(CommandHandler("next", next_station))
+    app.add_handler(CommandHandler("wait", wait))
+    app.add_handler(CommandHandler("unwait", unwait))
 
     # Organizer
     app.add_handler(CommandHandler("reg_org", reg_org))
@@ -38,22 +63,84 @@ def register_handlers(app):
     app.add_handler(CommandHandler("pay", pay))
     app.add_handler(CommandHandler("mailing", mailing))
     app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(CommandHandler("checkpoint", checkpoint))
+    app.add_handler(CommandHandler("reconcile", reconcile))
+    app.add_handler(CommandHandler("resync", resync))
+    app.add_handler(CommandHandler("standings", standings))
+    app.add_handler(CommandHandler("export", export))
+    app.add_handler(CommandHandler("new_event", new_event))
+    app.add_handler(CommandHandler("events", events))
+    app.add_handler(CommandHandler("use_event", use_event))
 
     # Callback (inline buttons)
     app.add_handler(CallbackQueryHandler(callback_router))
 
     app.add_handler(CommandHandler("start", common.start))
 
+async def post_init(app):
+    await resume_broadcasts(app)
+    await start_checkpoints(app)
+    if PUSH_NOTIFICATIONS:
+        await start_push_notifications(app)
+
+async def post_shutdown(app):
+    await stop_checkpoints(app)
+    if PUSH_NOTIFICATIONS:
+        await stop_push_notifications(app)
+
 def main():
+    if BOT_MODE == "webhook" or (BOT_MODE == "ingress" and INGRESS_SOURCE == "webhook"):
+        # Fail before touching the database rather than after
+        require_webhook_secret()
     logger.info("Waiting Postgres...")
     wait_for_db()
     logger.info("Database initialization (if needed)...")
     init_db()
+    if METRICS_PORT:
+        start_metrics_server(METRICS_LISTEN, METRICS_PORT)
+
+    if BOT_MODE == "ingress":
+        # Only stores updates in update_queue for the workers, no handlers run here
+        builder = Application.builder().token(TOKEN)
+        if INGRESS_SOURCE == "webhook":
+            builder = builder.updater(None)
+        logger.info(f"Ingress started ({INGRESS_SOURCE}).")
+        run_ingress(builder.build())
+        async_db.shutdown()
+        close_pool()
+        return
+
+    load_settings()
+    rebuild_leaderboard()
+    state.load()
+    start_settings_sync()
+    # First, so the cache invalidations below already see the changed state
+    start_state_sync()
+    start_identity_sync()
+    start_leaderboard_sync()
+    start_free_stations_sync()
+    start_listener()
 
-    app = Application.builder().token(TOKEN).build()
+    # Same pool size as the builder's default request, plus per-method latency metrics
+    builder = Application.builder().token(TOKEN).post_init(post_init).post_shutdown(post_shutdown).request(MeteredRequest(connection_pool_size=256))
+    if BOT_MODE in ("webhook", "worker"):
+        builder = builder.updater(None)
+    if BOT_MODE != "worker":
+        # Workers get chat-ordered batches from update_queue and call process_update themselves
+        builder = builder.concurrent_updates(build_update_processor(UPDATE_CONCURRENCY))
+    app = builder.build()
     register_handlers(app)
-    logger.info("Bot started.")
-    app.run_polling()
+    logger.info(f"Bot started ({BOT_MODE}).")
+    if BOT_MODE == "webhook":
+        asyncio.run(serve_webhook(app))
+    elif BOT_MODE == "worker":
+        run_worker(app)
+    else:
+        app.run_polling()
+    stop_listener()
+    async_db.shutdown()
+    logger.info(f"Connection pool stats: {pool_stats()}")
+    close_pool()
 
 if __name__ == "__main__":
     main()